@@ -1,183 +1,898 @@
+import bisect
 import json
+import time
 import pandas as pd
+from collections import OrderedDict
 from datetime import datetime
+from threading import Event, Lock, RLock, Thread
+from types import MappingProxyType
 import logging
 from logging_config import get_logger, log_error, log_info
+from catalog_import import (
+    PRODUCT_COLUMNS, VARIATION_COLUMNS, ImportCancelled, normalize_legacy_format, normalize_new_format
+)
 
 # Настройка логирования
 logger = get_logger('backend')
 
-class DbAct:
-    def __init__(self, db, config, path_xlsx):
+
+def catalog_key(value):
+    """Ключ для table_id/model_id: как при сравнении VARCHAR в MySQL (без учёта регистра и хвостовых пробелов)."""
+    if value is None:
+        return None
+    return str(value).rstrip().lower()
+
+
+def product_available(product):
+    """Товар в продаже: синхронизация каталога снимает пропавшие из листа товары через is_available."""
+    return bool(product.get('is_available', True))
+
+
+def variation_entry(row):
+    """Вариация в том же виде, что отдаёт get_product_variations."""
+    return MappingProxyType({
+        'variation_id': row['variation_id'],
+        'product_id': row['product_id'],
+        'model_id': row['model_id'],
+        'size': str(row['size']),
+        'quantity': row['quantity'],
+        'price': row['price'],
+        'price_yuan': row['price_yuan'],
+        'link': row['link']
+    })
+
+
+def sync_table_key(table_id):
+    """Ключ товара по table_id при синхронизации; пустая ячейка листа ('nan') ключом не считается."""
+    key = catalog_key(table_id)
+    return key if key and key != 'nan' else None
+
+
+def sync_same(current, value):
+    """Совпадает ли значение в БД со значением из листа (цены — с точностью DECIMAL(10, 2))."""
+    if isinstance(value, bool) or isinstance(current, bool):
+        return bool(current) == bool(value)
+    if isinstance(value, (int, float)) and not isinstance(current, str):
+        try:
+            return current is not None and round(float(current), 2) == round(float(value), 2)
+        except (TypeError, ValueError):
+            return False
+    return (current or None) == (value or None)
+
+
+class CatalogSnapshot:
+    """Индексы каталога: товары, вариации по товару, поиск по table_id и model_id.
+
+    Опубликованный снимок не меняется: правки вносятся в copy() и подменяют его.
+    """
+
+    __slots__ = ('products', 'variations', 'variation_ids', 'by_table_id', 'by_model_id')
+
+    def __init__(self, products, variations):
+        self.products = {}
+        self.by_table_id = {}
+        for row in products:
+            self.set_product(row)
+        self.variations = {}
+        self.variation_ids = {}
+        self.by_model_id = {}
+        grouped = {}
+        for row in variations:
+            grouped.setdefault(row['product_id'], []).append(row)
+        for product_id, rows in grouped.items():
+            self.set_variations(product_id, rows)
+
+    def copy(self):
+        """Снимок с копиями индексов; записи неизменяемые и разделяются с исходным."""
+        snapshot = object.__new__(CatalogSnapshot)
+        for name in self.__slots__:
+            setattr(snapshot, name, dict(getattr(self, name)))
+        return snapshot
+
+    def set_product(self, row):
+        product = MappingProxyType(dict(row))
+        previous = self.products.get(product['product_id'])
+        if previous is not None and (
+            catalog_key(previous['table_id']) != catalog_key(product['table_id']) or not product_available(product)
+        ):
+            if self.by_table_id.get(catalog_key(previous['table_id'])) == product['product_id']:
+                self.by_table_id.pop(catalog_key(previous['table_id']), None)
+        self.products[product['product_id']] = product
+        table_key = catalog_key(product['table_id'])
+        # В поиск по table_id попадают только товары в продаже
+        if table_key and product_available(product):
+            # Как и SELECT ... LIMIT 1 без ORDER BY, берём первый товар с этим table_id
+            current = self.by_table_id.get(table_key)
+            if current is None or current > product['product_id']:
+                self.by_table_id[table_key] = product['product_id']
+
+    def set_variations(self, product_id, rows):
+        """Заменяет вариации товара; старые записи убираются из индексов."""
+        entries = tuple(variation_entry(row) for row in sorted(rows, key=lambda r: r['variation_id']))
+        old_entries = self.variations.get(product_id, ())
+        model_keys = {catalog_key(v['model_id']) for v in old_entries + entries}
+        for variation in old_entries:
+            self.variation_ids.pop(variation['variation_id'], None)
+        if entries:
+            self.variations[product_id] = entries
+        else:
+            self.variations.pop(product_id, None)
+        for variation in entries:
+            self.variation_ids[variation['variation_id']] = variation
+        for model_key in model_keys:
+            if not model_key:
+                continue
+            matches = [v for v in self.by_model_id.get(model_key, ()) if v['product_id'] != product_id]
+            matches.extend(v for v in entries if catalog_key(v['model_id']) == model_key)
+            if matches:
+                self.by_model_id[model_key] = tuple(sorted(matches, key=lambda v: v['variation_id']))
+            else:
+                self.by_model_id.pop(model_key, None)
+
+
+class CatalogCache:
+    """Каталог товаров в памяти процесса.
+
+    Снимок строится одной транзакцией и подменяется целиком; после изменений
+    перечитываются только затронутые строки, которые вносятся в копию снимка,
+    и копия подменяет текущий. Читатели обходят снимок без блокировки, поэтому
+    опубликованный снимок и его записи никогда не меняются на месте.
+    """
+
+    # Пауза перед повторной загрузкой, если MySQL недоступен
+    RETRY_AFTER = 30
+
+    def __init__(self, db):
         self.__db = db
-        self.__config = config
-        self.__path_xlsx = path_xlsx
+        self.__lock = RLock()
+        self.__snapshot = None
+        self.__failed_at = 0.0
 
-    def __normalize_username(self, username):
-        if not username:
+    def get(self):
+        """Текущий снимок или None, если загрузить каталог не удалось."""
+        snapshot = self.__snapshot
+        if snapshot is not None:
+            return snapshot
+        if time.monotonic() - self.__failed_at < self.RETRY_AFTER:
             return None
-        uname = str(username).strip()
-        if uname.startswith('@'):
-            uname = uname[1:]
-        return uname.lower()
-
-    def __is_admin_in_config(self, user_id=None, username=None):
-        """Check admin status against config by user_id or username."""
-        cfg = self.__config.get_config() or {}
-        admins_list = cfg.get('admins', []) or []
-        admin_usernames = cfg.get('admin_usernames', []) or []
-
-        # Normalize IDs list: allow strings or ints
-        admin_ids_normalized = set()
-        for val in admins_list:
+        with self.__lock:
+            if self.__snapshot is None:
+                self.rebuild()
+            return self.__snapshot
+
+    def rebuild(self):
+        """Полностью перечитывает каталог (после импорта и очистки)."""
+        def _load(tx):
+            return (
+                tx.read('SELECT * FROM products ORDER BY product_id'),
+                tx.read('SELECT * FROM product_variations ORDER BY variation_id')
+            )
+
+        with self.__lock:
             try:
-                admin_ids_normalized.add(int(val))
-            except Exception:
-                # If it's not an int, treat it as a username token
-                uname_norm = self.__normalize_username(val)
-                if uname_norm:
-                    admin_usernames.append(uname_norm)
+                products, variations = self.__db.run_transaction(_load)
+                self.__snapshot = CatalogSnapshot(products, variations)
+                self.__failed_at = 0.0
+                log_info(logger, f"Каталог загружен в память: товаров {len(products)}, вариаций {len(variations)}")
+            except Exception as e:
+                self.__snapshot = None
+                self.__failed_at = time.monotonic()
+                log_error(logger, e, "Ошибка загрузки каталога, чтение пойдёт напрямую из БД")
+
+    def refresh_product(self, product_id):
+        """Перечитывает товар с primary после изменения."""
+        self.__refresh(lambda tx, snapshot: self.__apply_product(
+            snapshot, product_id, tx.read('SELECT * FROM products WHERE product_id = %s', (product_id,))
+        ))
+
+    def refresh_variations(self, product_id):
+        """Перечитывает вариации товара с primary после изменения остатков."""
+        self.__refresh(lambda tx, snapshot: snapshot.set_variations(product_id, tx.read(
+            'SELECT * FROM product_variations WHERE product_id = %s', (product_id,)
+        )))
+
+    def refresh_variation(self, variation_id):
+        """Перечитывает вариации товара, к которому относится variation_id."""
+        snapshot = self.__snapshot
+        variation = snapshot.variation_ids.get(variation_id) if snapshot is not None else None
+        if variation is None:
+            self.invalidate()
+        else:
+            self.refresh_variations(variation['product_id'])
+
+    def invalidate(self):
+        """Сбрасывает снимок: следующий запрос загрузит каталог заново."""
+        with self.__lock:
+            self.__snapshot = None
+            self.__failed_at = 0.0
+
+    def __refresh(self, apply):
+        # Чтение и применение под одной блокировкой: параллельные правки
+        # одной строки ложатся в кэш в порядке чтения из БД
+        with self.__lock:
+            if self.__snapshot is None:
+                return
+            snapshot = self.__snapshot.copy()
+            try:
+                with self.__db.transaction() as tx:
+                    apply(tx, snapshot)
+                self.__snapshot = snapshot
+            except Exception as e:
+                log_error(logger, e, "Ошибка обновления каталога в памяти, каталог будет перечитан")
+                self.__snapshot = None
+
+    @staticmethod
+    def __apply_product(snapshot, product_id, rows):
+        if rows:
+            snapshot.set_product(rows[0])
+        else:
+            product = snapshot.products.pop(product_id, None)
+            if product is not None and snapshot.by_table_id.get(catalog_key(product['table_id'])) == product_id:
+                snapshot.by_table_id.pop(catalog_key(product['table_id']), None)
+
+
+class UserCache:
+    """LRU-кэш профилей get_user_data с TTL.
+
+    Изменения профиля пишутся в кэш сразу после записи в БД. Результат чтения
+    из БД не попадает в кэш, если профиль успели изменить, пока шло чтение.
+    """
+
+    def __init__(self, max_size=5000, ttl=300):
+        self.__max_size = max(1, int(max_size))
+        self.__ttl = ttl
+        self.__lock = Lock()
+        self.__entries = OrderedDict()
+        self.__loading = {}
+        self.__hits = 0
+        self.__misses = 0
+
+    @staticmethod
+    def __copy(profile):
+        # Вызывающий код получает свою копию: общий словарь в кэше не меняется снаружи
+        profile = dict(profile)
+        if isinstance(profile.get('achievements'), list):
+            profile['achievements'] = list(profile['achievements'])
+        return profile
+
+    def get(self, user_id):
+        with self.__lock:
+            item = self.__entries.get(user_id)
+            if item is not None and item[0] > time.monotonic():
+                self.__entries.move_to_end(user_id)
+                self.__hits += 1
+                return self.__copy(item[1])
+            if item is not None:
+                del self.__entries[user_id]
+            self.__misses += 1
+            return None
+
+    def contains(self, user_id):
+        with self.__lock:
+            item = self.__entries.get(user_id)
+            return item is not None and item[0] > time.monotonic()
+
+    def begin_load(self, user_id):
+        """Отмечает начало чтения профиля из БД; возвращает токен для finish_load."""
+        token = object()
+        with self.__lock:
+            self.__loading[user_id] = token
+        return token
+
+    def finish_load(self, user_id, token, profile):
+        with self.__lock:
+            if self.__loading.get(user_id) is not token:
+                return
+            del self.__loading[user_id]
+            if profile is None:
+                return
+            self.__entries[user_id] = (time.monotonic() + self.__ttl, self.__copy(profile))
+            self.__entries.move_to_end(user_id)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+    def put(self, user_id, profile):
+        """Кладёт в кэш профиль, только что прочитанный с primary после записи."""
+        with self.__lock:
+            self.__loading.pop(user_id, None)
+            self.__entries[user_id] = (time.monotonic() + self.__ttl, self.__copy(profile))
+            self.__entries.move_to_end(user_id)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+    def update(self, user_id, changes=None, deltas=None):
+        """Применяет записанные в БД изменения к профилю в кэше (write-through)."""
+        with self.__lock:
+            self.__loading.pop(user_id, None)
+            item = self.__entries.get(user_id)
+            if item is None:
+                return
+            profile = dict(item[1])
+            try:
+                profile.update(changes or {})
+                for field, delta in (deltas or {}).items():
+                    profile[field] = (profile.get(field) or 0) + delta
+            except TypeError:
+                # Несовместимые типы (например, Decimal и float) — проще перечитать из БД
+                del self.__entries[user_id]
+                return
+            self.__entries[user_id] = (item[0], profile)
+
+    def invalidate(self, *user_ids):
+        with self.__lock:
+            for user_id in user_ids:
+                self.__loading.pop(user_id, None)
+                self.__entries.pop(user_id, None)
+
+    def stats(self):
+        with self.__lock:
+            return {'size': len(self.__entries), 'max_size': self.__max_size, 'ttl': self.__ttl,
+                    'hits': self.__hits, 'misses': self.__misses}
+
+
+class AchievementConflict(Exception):
+    """INSERT IGNORE вставил меньше ачивок, чем ожидалось: их параллельно выдали в другой транзакции."""
+
+
+class AchievementCache:
+    """Заработанные ачивки пользователей: битовая маска на пользователя, LRU.
+
+    Биты раздаются кодам ачивок по мере появления и живут до перезапуска.
+    """
+
+    def __init__(self, max_size=5000):
+        self.__max_size = max(1, int(max_size))
+        self.__lock = Lock()
+        self.__bits = {}
+        self.__masks = OrderedDict()
+
+    def mask(self, codes):
+        mask = 0
+        with self.__lock:
+            for code in codes:
+                bit = self.__bits.get(code)
+                if bit is None:
+                    bit = self.__bits[code] = 1 << len(self.__bits)
+                mask |= bit
+        return mask
+
+    def get(self, user_id):
+        with self.__lock:
+            mask = self.__masks.get(user_id)
+            if mask is not None:
+                self.__masks.move_to_end(user_id)
+            return mask
+
+    def put(self, user_id, codes):
+        mask = self.mask(codes)
+        with self.__lock:
+            self.__masks[user_id] = mask
+            self.__masks.move_to_end(user_id)
+            while len(self.__masks) > self.__max_size:
+                self.__masks.popitem(last=False)
+        return mask
+
+    def add(self, user_id, codes):
+        """Дописывает ачивки в маску, если пользователь уже в кэше."""
+        mask = self.mask(codes)
+        with self.__lock:
+            if user_id in self.__masks:
+                self.__masks[user_id] |= mask
+
+    def invalidate(self, *user_ids):
+        with self.__lock:
+            for user_id in user_ids:
+                self.__masks.pop(user_id, None)
+
+
+class ReferralLeaderboard:
+    """Топ пригласивших: отсортированный список ключей (-referral_count, -user_id).
+
+    Целиком загружается из БД не чаще раза в ttl секунд, а между загрузками
+    обновляется на каждом новом реферале (счётчики только растут).
+    """
+
+    def __init__(self, size=10, ttl=600):
+        self.__size = max(1, int(size))
+        self.__ttl = ttl
+        self.__lock = Lock()
+        self.__keys = []
+        self.__entries = {}
+        self.__loaded_at = None
+
+    @property
+    def size(self):
+        return self.__size
+
+    @staticmethod
+    def __sort_key(entry):
+        return (-(entry['referral_count'] or 0), -entry['user_id'])
+
+    def is_fresh(self):
+        with self.__lock:
+            return self.__loaded_at is not None and time.monotonic() - self.__loaded_at < self.__ttl
+
+    def load(self, rows):
+        entries = {row['user_id']: dict(row) for row in rows}
+        keys = sorted(self.__sort_key(entry) for entry in entries.values())[:self.__size]
+        with self.__lock:
+            self.__keys = keys
+            self.__entries = {-neg_id: entries[-neg_id] for _, neg_id in keys}
+            self.__loaded_at = time.monotonic()
+
+    def bump(self, entry):
+        """Учитывает новое значение referral_count пользователя."""
+        entry = dict(entry)
+        key = self.__sort_key(entry)
+        with self.__lock:
+            if self.__loaded_at is None:
+                return
+            old = self.__entries.get(entry['user_id'])
+            if old is not None:
+                self.__keys.remove(self.__sort_key(old))
+            elif len(self.__keys) >= self.__size and key >= self.__keys[-1]:
+                return
+            bisect.insort(self.__keys, key)
+            self.__entries[entry['user_id']] = entry
+            while len(self.__keys) > self.__size:
+                _, neg_id = self.__keys.pop()
+                self.__entries.pop(-neg_id, None)
+
+    def top(self, limit=None):
+        with self.__lock:
+            keys = self.__keys[:limit] if limit else self.__keys
+            return [dict(self.__entries[-neg_id]) for _, neg_id in keys]
+
+
+class CounterBuffer:
+    """Write-behind буфер инкрементов счётчиков пользователей.
+
+    Инкременты копятся по (user_id, поле) и отдаются flush-функции пачкой:
+    раз в flush_interval секунд из фонового потока или сразу, как только
+    накопилось max_entries пар. Если запись не удалась, пачка возвращается в буфер.
+    """
+
+    def __init__(self, flush, flush_interval=5, max_entries=500):
+        self.__flush_func = flush
+        self.__flush_interval = max(0.1, float(flush_interval))
+        self.__max_entries = max(1, int(max_entries))
+        self.__lock = Lock()
+        self.__flush_lock = Lock()
+        self.__pending = {}
+        self.__wake = Event()
+        self.__stop = Event()
+        self.__thread = None
+
+    def add(self, user_id, field, value):
+        with self.__lock:
+            key = (user_id, field)
+            self.__pending[key] = self.__pending.get(key, 0) + value
+            full = len(self.__pending) >= self.__max_entries
+            if self.__thread is None and not self.__stop.is_set():
+                self.__thread = Thread(target=self.__flush_loop, name='stats-flush', daemon=True)
+                self.__thread.start()
+        if full:
+            self.__wake.set()
 
-        # Normalize usernames list
-        admin_usernames_normalized = set(self.__normalize_username(u) for u in admin_usernames if self.__normalize_username(u))
+    def __flush_loop(self):
+        while not self.__stop.is_set():
+            self.__wake.wait(self.__flush_interval)
+            self.__wake.clear()
+            self.flush()
 
-        # Check by id
+    def flush(self):
+        """Записывает накопленное; возвращает число записанных пар (user_id, поле)."""
+        with self.__flush_lock:
+            with self.__lock:
+                pending, self.__pending = self.__pending, {}
+            if not pending:
+                return 0
+            try:
+                self.__flush_func(pending)
+                return len(pending)
+            except Exception as e:
+                log_error(logger, e, f"Ошибка записи счётчиков, пар в буфере: {len(pending)}")
+                with self.__lock:
+                    for key, value in pending.items():
+                        self.__pending[key] = self.__pending.get(key, 0) + value
+                return 0
+
+    def size(self):
+        with self.__lock:
+            return len(self.__pending)
+
+    def close(self):
+        """Останавливает фоновый поток и сбрасывает остаток в БД."""
+        self.__stop.set()
+        self.__wake.set()
+        if self.__thread is not None and self.__thread.is_alive():
+            self.__thread.join(timeout=self.__flush_interval + 5)
+        return self.flush()
+
+
+def normalize_username(username):
+    if not username:
+        return None
+    uname = str(username).strip()
+    if uname.startswith('@'):
+        uname = uname[1:]
+    return uname.lower()
+
+
+class AdminIndex:
+    """Неизменяемый индекс админов из конфига: ID и нормализованные username."""
+
+    __slots__ = ('ids', 'usernames')
+
+    def __init__(self, cfg):
+        ids = set()
+        usernames = set()
+        for val in cfg.get('admins', []) or []:
+            try:
+                ids.add(int(val))
+            except (TypeError, ValueError):
+                # Не число — считаем username
+                uname_norm = normalize_username(val)
+                if uname_norm:
+                    usernames.add(uname_norm)
+        for val in cfg.get('admin_usernames', []) or []:
+            uname_norm = normalize_username(val)
+            if uname_norm:
+                usernames.add(uname_norm)
+        self.ids = frozenset(ids)
+        self.usernames = frozenset(usernames)
+
+    def matches(self, user_id=None, username=None):
         if user_id is not None:
             try:
-                if int(user_id) in admin_ids_normalized:
+                if int(user_id) in self.ids:
                     return True
-            except Exception:
+            except (TypeError, ValueError):
                 pass
+        uname_norm = normalize_username(username)
+        return bool(uname_norm) and uname_norm in self.usernames
 
-        # Check by username
-        uname_norm = self.__normalize_username(username)
-        if uname_norm and uname_norm in admin_usernames_normalized:
-            return True
 
-        return False
+class DbAct:
+    # Сколько флагов is_admin держать в памяти; при переполнении словарь очищается
+    MAX_ADMIN_FLAGS = 10000
+    # Сколько секунд отдавать статистику админки из памяти
+    ADMIN_STATS_TTL = 30
+    # Сколько пригласивших держать в топе и как часто перечитывать его целиком
+    REFERRAL_LEADERBOARD_SIZE = 10
+    REFERRAL_LEADERBOARD_TTL = 600
+    # Строк в одном INSERT при пакетном импорте каталога
+    IMPORT_CHUNK_SIZE = 1000
+    # Если синхронизация затронула больше товаров, каталог в памяти перечитывается целиком
+    SYNC_REFRESH_LIMIT = 50
+    # Счётчики, которые можно копить в буфере (см. queue_user_stats)
+    BUFFERED_STATS = ('comments', 'orders', 'bs_coin', 'discount')
+
+    def __init__(self, db, config, path_xlsx):
+        self.__db = db
+        self.__config = config
+        self.__path_xlsx = path_xlsx
+        self.__catalog = CatalogCache(db)
+        user_cache_config = (config.get_config() or {}).get('user_cache', {}) or {}
+        self.__users = UserCache(
+            max_size=user_cache_config.get('max_size', 5000),
+            ttl=user_cache_config.get('ttl', 300)
+        )
+        self.__admin_lock = Lock()
+        self.__admin_index = None
+        self.__admin_index_version = None
+        self.__admin_flags = {}
+        self.__admin_stats = None
+        # users.last_active обновляется не чаще раза в activity.touch_interval секунд на пользователя
+        activity_config = (config.get_config() or {}).get('activity', {}) or {}
+        self.__touch_interval = activity_config.get('touch_interval', 300)
+        self.__max_touched = activity_config.get('max_tracked', 50000)
+        self.__touched = {}
+        stats_buffer_config = (config.get_config() or {}).get('stats_buffer', {}) or {}
+        self.__stats_buffer = CounterBuffer(
+            self.__flush_user_stats,
+            flush_interval=stats_buffer_config.get('flush_interval', 5),
+            max_entries=stats_buffer_config.get('max_entries', 500)
+        )
+        self.__stat_thresholds = {}
+        self.__achievements = AchievementCache(max_size=user_cache_config.get('max_size', 5000))
+        self.__referral_top = ReferralLeaderboard(self.REFERRAL_LEADERBOARD_SIZE, self.REFERRAL_LEADERBOARD_TTL)
+
+    def __admins(self):
+        """Индекс админов; пересобирается, только если конфиг перечитан или сохранён."""
+        version = self.__config.version
+        if self.__admin_index is None or self.__admin_index_version != version:
+            with self.__admin_lock:
+                if self.__admin_index is None or self.__admin_index_version != version:
+                    self.__admin_index = AdminIndex(self.__config.get_config() or {})
+                    self.__admin_flags = {}
+                    self.__admin_index_version = version
+        return self.__admin_index
 
     def add_user(self, user_id, first_name, last_name, username):
-        if not self.user_exists(user_id):
-            referral_code = f"ref_{user_id}"
-            is_admin = self.__is_admin_in_config(user_id=user_id, username=username)
-            self.__db.db_write(
-                '''INSERT INTO users 
-                (user_id, first_name, last_name, username, referral_code, is_admin, last_active) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s)''',
-                (user_id, first_name, last_name, username, referral_code, is_admin, datetime.now())
+        is_new, _, _ = self.register_user(user_id, first_name, last_name, username)
+        return is_new
+
+    def register_user(self, user_id, first_name, last_name, username, referrer_id=None):
+        """Регистрация за два запроса: upsert пользователя и чтение профиля.
+
+        Существующему пользователю обновляются имя, username и last_active, так что
+        отдельный touch_user для /start не нужен. Вторым запросом
+        вместе с профилем проверяется, есть ли в базе пригласивший (referrer_id).
+        Возвращает (is_new, profile, referrer_exists); profile кладётся в кэш.
+        """
+        admins = self.__admins()
+        # У users нет AUTO_INCREMENT: при вставке insert id равен 0, а при обновлении
+        # LAST_INSERT_ID(user_id) возвращает user_id. Так вставка отличается от обновления
+        # независимо от того, изменилась ли строка и включён ли у драйвера CLIENT_FOUND_ROWS
+        insert_id = self.__db.db_insert(
+            '''INSERT INTO users
+            (user_id, first_name, last_name, username, referral_code, is_admin, last_active)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                user_id = LAST_INSERT_ID(user_id),
+                first_name = VALUES(first_name),
+                last_name = VALUES(last_name),
+                username = VALUES(username),
+                last_active = VALUES(last_active)''',
+            (user_id, first_name, last_name, username, f"ref_{user_id}",
+             admins.matches(user_id=user_id, username=username), datetime.now())
+        )
+        is_new = insert_id == 0
+
+        key = self.__user_key(user_id)
+        self.__mark_touched(key)
+        referrer_key = self.__user_key(referrer_id) if referrer_id is not None else None
+        user_ids = [user_id]
+        if referrer_key is not None and referrer_key != key:
+            user_ids.append(referrer_id)
+        placeholders = ', '.join(['%s'] * len(user_ids))
+        # Сразу после записи читаем с primary: реплика может ещё не увидеть нового пользователя
+        data = self.__db.db_read(
+            f'SELECT * FROM users WHERE user_id IN ({placeholders})', tuple(user_ids), primary=True
+        )
+        profile = None
+        referrer_exists = False
+        for row in data:
+            row_key = self.__user_key(row.get('user_id'))
+            if row_key == key:
+                profile = self.__parse_user_row(row)
+            elif row_key == referrer_key:
+                referrer_exists = True
+
+        if profile is not None:
+            self.__users.put(key, profile)
+            self.__remember_admin_flag(
+                key, profile['is_admin'] or admins.matches(user_id=user_id, username=profile['username'])
             )
+        else:
+            self.__users.invalidate(key)
+            self.__admin_flags.pop(key, None)
+        return is_new, profile, referrer_exists
+
+    @staticmethod
+    def __user_key(user_id):
+        try:
+            return int(user_id)
+        except (TypeError, ValueError):
+            return user_id
+
+    def user_cache_stats(self):
+        return self.__users.stats()
 
     def user_exists(self, user_id):
+        if self.__users.contains(self.__user_key(user_id)):
+            return True
         data = self.__db.db_read('SELECT COUNT(*) FROM users WHERE user_id = %s', (user_id,))
         return data[0]['COUNT(*)'] > 0 if data else False
 
     def user_is_admin(self, user_id):
         """Check if user is admin by DB flag or by config (user_id or username)."""
+        admins = self.__admins()
+        key = self.__user_key(user_id)
+        if key in admins.ids:
+            return True
+        flags = self.__admin_flags
+        flag = flags.get(key)
+        if flag is not None:
+            return flag
+
         data = self.__db.db_read('SELECT is_admin, username FROM users WHERE user_id = %s', (user_id,))
         if data:
             row = data[0]
-            if bool(row.get('is_admin')):
-                return True
             # Fallback to config-based check via username
-            return self.__is_admin_in_config(user_id=user_id, username=row.get('username'))
-        # If user not in DB, still allow config-based admin by id/username
-        return self.__is_admin_in_config(user_id=user_id, username=None)
+            flag = bool(row.get('is_admin')) or admins.matches(user_id=user_id, username=row.get('username'))
+        else:
+            # If user not in DB, still allow config-based admin by id/username
+            flag = admins.matches(user_id=user_id, username=None)
+        self.__remember_admin_flag(key, flag)
+        return flag
+
+    def __remember_admin_flag(self, key, flag):
+        flags = self.__admin_flags
+        if len(flags) >= self.MAX_ADMIN_FLAGS:
+            flags.clear()
+        flags[key] = flag
 
     def get_user_data(self, user_id):
-        data = self.__db.db_read('SELECT * FROM users WHERE user_id = %s', (user_id,))
+        key = self.__user_key(user_id)
+        profile = self.__users.get(key)
+        if profile is not None:
+            return profile
+        token = self.__users.begin_load(key)
+        try:
+            profile = self.__load_user_data(user_id)
+            return profile
+        finally:
+            self.__users.finish_load(key, token, profile)
+
+    def __load_user_data(self, user_id):
+        # Промах кэша читаем с primary: отставшая реплика положила бы в кэш старый профиль
+        data = self.__db.db_read('SELECT * FROM users WHERE user_id = %s', (user_id,), primary=True)
         if data:
-            row = data[0]
-            
-            # Обработка last_active
-            last_active = row.get('last_active')
-            if isinstance(last_active, str):
+            return self.__parse_user_row(data[0])
+        return None
+
+    @staticmethod
+    def __parse_user_row(row):
+        # Обработка last_active
+        last_active = row.get('last_active')
+        if isinstance(last_active, str):
+            try:
+                last_active = datetime.strptime(last_active, "%Y-%m-%d %H:%M:%S.%f")
+            except ValueError:
                 try:
-                    last_active = datetime.strptime(last_active, "%Y-%m-%d %H:%M:%S.%f")
+                    last_active = datetime.strptime(last_active, "%Y-%m-%d %H:%M:%S")
                 except ValueError:
-                    try:
-                        last_active = datetime.strptime(last_active, "%Y-%m-%d %H:%M:%S")
-                    except ValueError:
-                        last_active = None
-            
-            # Обработка achievements
-            achievements = row.get('achievements', '[]')
-            if isinstance(achievements, str):
-                try:
-                    achievements = json.loads(achievements)
-                except json.JSONDecodeError:
-                    achievements = []
-            
-            return {
-                'user_id': row.get('user_id'),
-                'first_name': row.get('first_name'),
-                'last_name': row.get('last_name'),
-                'username': row.get('username'),
-                'status': row.get('status'),
-                'comments': row.get('comments', 0),
-                'orders': row.get('orders', 0),
-                'bs_coin': row.get('bs_coin', 0),
-                'discount': row.get('discount', 0),
-                'referral_code': row.get('referral_code'),
-                'last_active': last_active,
-                'is_admin': bool(row.get('is_admin', False)),
-                'achievements': achievements
-            }
-        return None
+                    last_active = None
+        
+        # Обработка achievements
+        achievements = row.get('achievements', '[]')
+        if isinstance(achievements, str):
+            try:
+                achievements = json.loads(achievements)
+            except json.JSONDecodeError:
+                achievements = []
+        
+        return {
+            'user_id': row.get('user_id'),
+            'first_name': row.get('first_name'),
+            'last_name': row.get('last_name'),
+            'username': row.get('username'),
+            'status': row.get('status'),
+            'comments': row.get('comments', 0),
+            'orders': row.get('orders', 0),
+            'bs_coin': row.get('bs_coin', 0),
+            'discount': row.get('discount', 0),
+            'referral_code': row.get('referral_code'),
+            'referral_count': row.get('referral_count', 0),
+            'last_active': last_active,
+            'is_admin': bool(row.get('is_admin', False)),
+            'achievements': achievements
+        }
 
     def update_last_active(self, user_id, date):
-        self.__db.db_write(
+        updated = self.__db.db_write(
             'UPDATE users SET last_active = %s WHERE user_id = %s',
             (date, user_id)
         )
+        self.__write_through(user_id, updated, changes={'last_active': date})
+
+    def touch_user(self, user_id):
+        """Отмечает активность пользователя; в БД пишет не чаще activity.touch_interval."""
+        key = self.__user_key(user_id)
+        last = self.__touched.get(key)
+        if last is not None and time.monotonic() - last < self.__touch_interval:
+            return
+        self.__mark_touched(key)
+        self.update_last_active(key, datetime.now())
+
+    def __mark_touched(self, key):
+        if len(self.__touched) >= self.__max_touched:
+            self.__touched.clear()
+        self.__touched[key] = time.monotonic()
 
     def set_discount(self, user_id, discount):
-        self.__db.db_write(
+        updated = self.__db.db_write(
             'UPDATE users SET discount = %s WHERE user_id = %s',
             (discount, user_id)
         )
+        self.__write_through(user_id, updated, changes={'discount': discount})
+
+    def __write_through(self, user_id, updated, changes=None, deltas=None):
+        # rowcount 0 бывает и при ошибке записи, и при неизменном значении — кэш в этом случае сбрасываем
+        if updated:
+            self.__users.update(self.__user_key(user_id), changes=changes, deltas=deltas)
+        else:
+            self.__users.invalidate(self.__user_key(user_id))
 
     def add_product(self, name, description, price, price_yuan, photo_id, category, description_full=None, table_id=None, keywords=None):
+        product_id = self.__insert_product(name, description, price, price_yuan, photo_id, category,
+                                           description_full, table_id, keywords)
+        if product_id:
+            self.__catalog.refresh_product(product_id)
+        return product_id
+
+    def __insert_product(self, name, description, price, price_yuan, photo_id, category, description_full=None, table_id=None, keywords=None):
+        # Импорт вставляет товары пачкой и перестраивает каталог в конце, без правки кэша на каждый товар
         try:
-            result = self.__db.db_write(
+            return self.__db.db_insert(
                 '''INSERT INTO products (name, description, description_full, table_id, keywords, price, price_yuan, photo_id, category, topic) 
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
                 (name, description, description_full, table_id, keywords, price, price_yuan, photo_id, category, "магазин")
             )
             
-            if result:
-                last_id_data = self.__db.db_read('SELECT LAST_INSERT_ID() as last_id')
-                if last_id_data:
-                    return last_id_data[0]['last_id']
-            return None
-            
         except Exception as e:
             log_error(logger, e, "Ошибка добавления товара")
             return None
 
+    @staticmethod
+    def __product_key(product_id):
+        try:
+            return int(product_id)
+        except (TypeError, ValueError):
+            return None
+
+    def reload_catalog(self):
+        """Полностью перечитать каталог в память."""
+        self.__catalog.rebuild()
+
     def get_products(self, category=None, limit=10):
+        """Товары в продаже (is_available), при необходимости — одной категории."""
+        catalog = self.__catalog.get()
+        if catalog is not None:
+            category_key = catalog_key(category)
+            products = [
+                product for product in catalog.products.values()
+                if product_available(product) and (not category or catalog_key(product['category']) == category_key)
+            ]
+            return products[:limit]
         if category:
-            return self.__db.db_read('SELECT * FROM products WHERE category = %s LIMIT %s', (category, limit))
-        return self.__db.db_read('SELECT * FROM products LIMIT %s', (limit,))
+            return self.__db.db_read(
+                'SELECT * FROM products WHERE is_available = TRUE AND category = %s LIMIT %s', (category, limit)
+            )
+        return self.__db.db_read('SELECT * FROM products WHERE is_available = TRUE LIMIT %s', (limit,))
     
+    def get_available_product(self, product_id):
+        """Товар, если он в продаже; снятый синхронизацией товар — None."""
+        product = self.get_product(product_id)
+        return product if product and product_available(product) else None
+
     def get_product(self, product_id):
+        """Товар по ID, в том числе снятый с продажи (нужен для истории заказов)."""
+        catalog = self.__catalog.get()
+        if catalog is not None:
+            return catalog.products.get(self.__product_key(product_id))
         log_info(logger, "DEBUG get_product: product_id = {product_id}")
         data = self.__db.db_read('SELECT * FROM products WHERE product_id = %s', (product_id,))
         return data[0] if data else None
 
     def get_product_by_table_id(self, table_id):
-        """Получить товар по table_id (артикулу)"""
+        """Получить товар в продаже по table_id (артикулу)"""
+        catalog = self.__catalog.get()
+        if catalog is not None:
+            product_id = catalog.by_table_id.get(catalog_key(table_id))
+            return catalog.products.get(product_id) if product_id is not None else None
         log_info(logger, f"DEBUG get_product_by_table_id: table_id = {table_id}")
-        data = self.__db.db_read('SELECT * FROM products WHERE table_id = %s', (table_id,))
+        data = self.__db.db_read('SELECT * FROM products WHERE table_id = %s AND is_available = TRUE', (table_id,))
         return data[0] if data else None
 
     def get_product_by_model_id(self, model_id):
-        """Получить товар по model_id из вариаций (join по product_id)."""
+        """Получить товар в продаже по model_id из вариаций (join по product_id)."""
+        catalog = self.__catalog.get()
+        if catalog is not None:
+            for variation in catalog.by_model_id.get(catalog_key(model_id), ()):
+                product = catalog.products.get(variation['product_id'])
+                if product is not None and product_available(product):
+                    return product
+            return None
         try:
             log_info(logger, f"DEBUG get_product_by_model_id: model_id = {model_id}")
             data = self.__db.db_read(
                 '''SELECT p.* FROM products p 
                    JOIN product_variations pv ON pv.product_id = p.product_id 
-                   WHERE pv.model_id = %s 
+                   WHERE pv.model_id = %s AND p.is_available = TRUE
+                   ORDER BY pv.variation_id
                    LIMIT 1''',
                 (str(model_id),)
             )
@@ -194,63 +909,206 @@ class DbAct:
         )
 
     def add_referral(self, referrer_id, referee_id):
-        try:
-            self.__db.db_write(
+        def _add(tx):
+            tx.write(
                 'INSERT INTO referrals (referrer_id, referee_id) VALUES (%s, %s)',
                 (referrer_id, referee_id)
             )
-            
-            self.update_user_stats(referrer_id, 'bs_coin', 100)
-            self.update_user_stats(referee_id, 'bs_coin', 50)
-            self.update_user_stats(referee_id, 'discount', 5)
-            
-            return True
+            tx.write(
+                'UPDATE users SET bs_coin = bs_coin + 100, referral_count = referral_count + 1 WHERE user_id = %s',
+                (referrer_id,)
+            )
+            tx.write(
+                'UPDATE users SET bs_coin = bs_coin + 50, discount = discount + 5 WHERE user_id = %s',
+                (referee_id,)
+            )
+            return tx.read_one(
+                'SELECT user_id, first_name, username, referral_count FROM users WHERE user_id = %s',
+                (referrer_id,)
+            )
+
+        try:
+            referrer = self.__db.run_transaction(_add)
         except Exception as e:
             log_error(logger, e, "Ошибка добавления реферала")
             return False
+        finally:
+            self.__users.invalidate(self.__user_key(referrer_id), self.__user_key(referee_id))
+        if referrer:
+            self.__referral_top.bump(referrer)
+        return True
 
     def get_referral_stats(self, user_id):
-        data = self.__db.db_read(
-            'SELECT COUNT(*) as count FROM referrals WHERE referrer_id = %s', 
-            (user_id,)
-        )
-        return data[0]['count'] if data else 0
+        # users.referral_count растёт в той же транзакции, что и INSERT в referrals
+        user_data = self.get_user_data(user_id)
+        return (user_data.get('referral_count') or 0) if user_data else 0
+
+    def get_referral_leaderboard(self, limit=None):
+        """Топ пригласивших: user_id, first_name, username, referral_count."""
+        if not self.__referral_top.is_fresh():
+            rows = self.__db.db_read(
+                '''SELECT user_id, first_name, username, referral_count FROM users
+                WHERE referral_count > 0
+                ORDER BY referral_count DESC, user_id DESC LIMIT %s''',
+                (self.__referral_top.size,)
+            )
+            self.__referral_top.load(rows)
+        return self.__referral_top.top(limit)
 
     def add_achievement(self, user_id, achievement_code, achievement_data):
         """Добавить ачивку пользователю"""
-        try:
-            # Проверяем, есть ли уже такая ачивка
-            existing = self.__db.db_read(
-                'SELECT achievement_id FROM achievements WHERE user_id = %s AND achievement_code = %s',
-                (user_id, achievement_code)
+        return achievement_code in self.award_achievements(user_id, {achievement_code: achievement_data})
+
+    def award_achievements(self, user_id, achievements):
+        """Выдаёт ачивки {код: данные} одной транзакцией вместе с наградами.
+
+        Возвращает список кодов, которые действительно выданы (уже имеющиеся пропускаются).
+        """
+        if not achievements:
+            return []
+        key = self.__user_key(user_id)
+        codes = list(achievements)
+        awarded = self.__award([(key, code, achievements[code]) for code in codes])
+        if awarded is None:
+            self.__achievements.invalidate(key)
+            return []
+        # И выданные, и уже имевшиеся коды есть в БД — маска догоняет её, даже если была устаревшей
+        self.__achievements.add(key, codes)
+        if awarded:
+            # Награды за ачивку меняют bs_coin/discount
+            self.__users.invalidate(key)
+        return [code for _, code, _ in awarded]
+
+    def award_achievement_bulk(self, user_ids, achievement_code, achievement_data, chunk_size=500):
+        """Выдаёт одну ачивку многим пользователям (акции); транзакция на каждый чанк.
+
+        Пользователи, у которых ачивка уже есть или которых нет в БД, пропускаются.
+        Возвращает список user_id, получивших ачивку и награду.
+        """
+        keys = list(dict.fromkeys(self.__user_key(user_id) for user_id in user_ids))
+        chunk_size = max(1, int(chunk_size))
+        awarded_users = []
+        for start in range(0, len(keys), chunk_size):
+            chunk = keys[start:start + chunk_size]
+            awarded = self.__award([(key, achievement_code, achievement_data) for key in chunk])
+            if awarded is None:
+                self.__achievements.invalidate(*chunk)
+                continue
+            chunk_awarded = [key for key, _, _ in awarded]
+            for key in chunk_awarded:
+                self.__achievements.add(key, (achievement_code,))
+            self.__users.invalidate(*chunk_awarded)
+            awarded_users.extend(chunk_awarded)
+        return awarded_users
+
+    def __award(self, rows, retries=3):
+        """rows — список (user_id, код, данные). Возвращает выданные строки, None при ошибке."""
+        codes = ', '.join(sorted({code for _, code, _ in rows}))
+        for attempt in range(1, retries + 1):
+            try:
+                return self.__db.run_transaction(lambda tx: self.__award_in_transaction(tx, rows))
+            except AchievementConflict as e:
+                if attempt < retries:
+                    log_info(logger, f"Повтор выдачи ачивок {codes} ({attempt}/{retries}): {e}")
+                    continue
+                log_error(logger, e, f"Не удалось выдать ачивки {codes}")
+            except Exception as e:
+                log_error(logger, e, f"Ошибка добавления ачивок {codes}")
+            return None
+
+    @staticmethod
+    def __award_in_transaction(tx, rows):
+        """INSERT IGNORE ачивок и награды только за реально вставленные строки.
+
+        Одна строка: rowcount INSERT IGNORE сам говорит, была ли она вставлена.
+        Пачка: сначала одним чтением отсекаются имеющиеся ачивки и несуществующие
+        пользователи. Если INSERT IGNORE всё равно вставил меньше строк, ту же ачивку
+        параллельно выдали другой транзакцией — откатываемся и повторяем.
+        """
+        if len(rows) > 1:
+            user_ids = sorted({user_id for user_id, _, _ in rows})
+            codes = sorted({code for _, code, _ in rows})
+            known_users = set()
+            existing = set()
+            for row in tx.read(
+                f'''SELECT u.user_id, a.achievement_code FROM users u
+                LEFT JOIN achievements a ON a.user_id = u.user_id
+                    AND a.achievement_code IN ({', '.join(['%s'] * len(codes))})
+                WHERE u.user_id IN ({', '.join(['%s'] * len(user_ids))})''',
+                (*codes, *user_ids)
+            ):
+                known_users.add(row['user_id'])
+                if row['achievement_code'] is not None:
+                    existing.add((row['user_id'], row['achievement_code']))
+            rows = [row for row in rows if row[0] in known_users and (row[0], row[1]) not in existing]
+            if not rows:
+                return []
+
+        inserted = tx.write_many(
+            '''INSERT IGNORE INTO achievements 
+            (user_id, achievement_code, achievement_name, achievement_description, 
+             achievement_category, bs_coin_reward, discount_bonus) 
+            VALUES (%s, %s, %s, %s, %s, %s, %s)''',
+            [(user_id, code, data['name'], data['description'], data['category'],
+              data['bs_coin_reward'], data['discount_bonus']) for user_id, code, data in rows]
+        )
+        if inserted != len(rows):
+            if len(rows) == 1:
+                return []
+            raise AchievementConflict(f"вставлено {inserted} из {len(rows)}")
+
+        # Награды одним UPDATE на каждую пару сумм (bs_coin, discount)
+        rewards = {}
+        for user_id, _, data in rows:
+            bs_coin, discount = rewards.get(user_id, (0, 0))
+            rewards[user_id] = (bs_coin + data['bs_coin_reward'], discount + data['discount_bonus'])
+        by_reward = {}
+        for user_id, reward in rewards.items():
+            if reward[0] > 0 or reward[1] > 0:
+                by_reward.setdefault(reward, []).append(user_id)
+        for (bs_coin, discount), reward_users in by_reward.items():
+            tx.write(
+                f"UPDATE users SET bs_coin = bs_coin + %s, discount = discount + %s "
+                f"WHERE user_id IN ({', '.join(['%s'] * len(reward_users))})",
+                (bs_coin, discount, *reward_users)
             )
-            
-            if existing:
-                return False  # Ачивка уже есть
-            
-            # Добавляем ачивку
-            self.__db.db_write(
-                '''INSERT INTO achievements 
-                (user_id, achievement_code, achievement_name, achievement_description, 
-                 achievement_category, bs_coin_reward, discount_bonus) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s)''',
-                (user_id, achievement_code, achievement_data['name'], 
-                 achievement_data['description'], achievement_data['category'],
-                 achievement_data['bs_coin_reward'], achievement_data['discount_bonus'])
+        return rows
+
+    def __earned_achievements(self, user_id):
+        key = self.__user_key(user_id)
+        mask = self.__achievements.get(key)
+        if mask is None:
+            rows = self.__db.db_read(
+                'SELECT achievement_code FROM achievements WHERE user_id = %s', (user_id,), primary=True
             )
-            
-            # Начисляем награды
-            if achievement_data['bs_coin_reward'] > 0:
-                self.update_user_stats(user_id, 'bs_coin', achievement_data['bs_coin_reward'])
-            
-            if achievement_data['discount_bonus'] > 0:
-                self.update_user_stats(user_id, 'discount', achievement_data['discount_bonus'])
-            
-            return True
-            
-        except Exception as e:
-            log_error(logger, e, f"Ошибка добавления ачивки {achievement_code} пользователю {user_id}")
-            return False
+            mask = self.__achievements.put(key, [row['achievement_code'] for row in rows])
+        return mask
+
+    def has_achievement(self, user_id, achievement_code):
+        return bool(self.__earned_achievements(user_id) & self.__achievements.mask((achievement_code,)))
+
+    def missing_achievements(self, user_id, achievement_codes):
+        """Коды из achievement_codes, которых у пользователя ещё нет (по кэшу маски)."""
+        earned = self.__earned_achievements(user_id)
+        return [code for code in achievement_codes if not earned & self.__achievements.mask((code,))]
+
+    def get_achievement_counters(self, user_id, counters=None):
+        """Счётчики для условий ачивок одним запросом: orders, reviews_with_photo, referrals."""
+        expressions = {
+            'orders': 'u.orders',
+            'reviews_with_photo': (
+                "(SELECT COUNT(*) FROM reviews r WHERE r.user_id = u.user_id "
+                "AND r.photo_url IS NOT NULL AND r.photo_url NOT IN ('', '[]', 'null'))"
+            ),
+            'referrals': 'u.referral_count',
+        }
+        names = [name for name in (counters or expressions) if name in expressions]
+        if not names:
+            return {}
+        columns = ', '.join(f'{expressions[name]} AS {name}' for name in names)
+        data = self.__db.db_read(f'SELECT {columns} FROM users u WHERE u.user_id = %s', (user_id,), primary=True)
+        row = data[0] if data else {}
+        return {name: int(row.get(name) or 0) for name in names}
 
     def get_user_achievements(self, user_id):
         """Получить все ачивки пользователя"""
@@ -269,11 +1127,7 @@ class DbAct:
     def get_achievement_by_code(self, user_id, achievement_code):
         """Проверить, есть ли у пользователя конкретная ачивка"""
         try:
-            result = self.__db.db_read(
-                'SELECT achievement_id FROM achievements WHERE user_id = %s AND achievement_code = %s',
-                (user_id, achievement_code)
-            )
-            return len(result) > 0
+            return self.has_achievement(user_id, achievement_code)
         except Exception as e:
             log_error(logger, e, f"Ошибка проверки ачивки {achievement_code} у пользователя {user_id}")
             return False
@@ -295,10 +1149,78 @@ class DbAct:
 
     def update_user_stats(self, user_id, field, value):
         if field in ['comments', 'orders', 'bs_coin', 'discount']:
-            self.__db.db_write(
+            updated = self.__db.db_write(
                 f'UPDATE users SET {field} = {field} + %s WHERE user_id = %s',
                 (value, user_id)
             )
+            self.__write_through(user_id, updated, deltas={field: value})
+
+    def queue_user_stats(self, user_id, field, value):
+        """Как update_user_stats, но через write-behind буфер.
+
+        До сброса буфера get_user_data возвращает старое значение счётчика.
+        """
+        if field in self.BUFFERED_STATS:
+            self.__stats_buffer.add(self.__user_key(user_id), field, value)
+
+    def on_stat_threshold(self, field, threshold, callback):
+        """callback(user_id, value) вызывается после каждого сброса буфера, в котором
+        изменился счётчик field и он не меньше threshold.
+
+        Срабатывает и для тех, кто перешёл порог раньше (старым кодом или при
+        неудачной выдаче), поэтому callback должен быть идемпотентным.
+        """
+        self.__stat_thresholds.setdefault(field, []).append((threshold, callback))
+
+    def flush_user_stats(self):
+        return self.__stats_buffer.flush()
+
+    def close_stats_buffer(self):
+        return self.__stats_buffer.close()
+
+    def stats_buffer_size(self):
+        return self.__stats_buffer.size()
+
+    def __flush_user_stats(self, pending):
+        # Один UPDATE на всю пачку: по CASE на каждое поле, плюс чтение итоговых значений
+        fields = sorted({field for _, field in pending})
+        user_ids = sorted({user_id for user_id, _ in pending})
+        assignments = []
+        params = []
+        for field in fields:
+            cases = []
+            for (user_id, pending_field), value in pending.items():
+                if pending_field == field:
+                    cases.append('WHEN %s THEN %s')
+                    params.extend((user_id, value))
+            assignments.append(f"{field} = {field} + CASE user_id {' '.join(cases)} ELSE 0 END")
+        placeholders = ', '.join(['%s'] * len(user_ids))
+
+        def _flush(tx):
+            tx.write(
+                f"UPDATE users SET {', '.join(assignments)} WHERE user_id IN ({placeholders})",
+                tuple(params) + tuple(user_ids)
+            )
+            return tx.read(
+                f"SELECT user_id, {', '.join(fields)} FROM users WHERE user_id IN ({placeholders})",
+                tuple(user_ids)
+            )
+
+        rows = self.__db.run_transaction(_flush)
+        for row in rows:
+            key = self.__user_key(row['user_id'])
+            self.__users.update(key, changes={field: row[field] for field in fields})
+            for field in fields:
+                delta = pending.get((key, field))
+                if not delta:
+                    continue
+                value = row[field] or 0
+                for threshold, callback in self.__stat_thresholds.get(field, ()):
+                    if value >= threshold:
+                        try:
+                            callback(key, value)
+                        except Exception as e:
+                            log_error(logger, e, f"Ошибка обработчика порога {field}={threshold} для {key}")
 
     def add_review(self, user_id, text, photos_json=None):
         return self.__db.db_write(
@@ -328,7 +1250,8 @@ class DbAct:
 
     
     def get_all_users(self):
-        return self.__db.db_read('SELECT user_id, first_name, last_name, username FROM users')
+        """Потоково отдаёт пользователей для выгрузки (генератор)."""
+        return self.__db.db_read_iter('SELECT user_id, first_name, last_name, username FROM users')
     
     @staticmethod
     def safe_convert(value, to_type=float, default=0):
@@ -348,206 +1271,309 @@ class DbAct:
             return default
 
     def import_products_from_excel(self, df):
-        success_count = 0
-        
-        self.clear_all_products()
-        
-        grouped = df.groupby('Модель')
-        
-        for model_name, group in grouped:
-            try:
-                if pd.isna(model_name) or str(model_name).strip() == '':
-                    logger.warning(f"Пропущена пустая модель: {model_name}")
-                    continue
-                    
-                first_row = group.iloc[0]
-                
-                price = self.safe_convert(first_row.get('Цена'), float, 0)
-                price_yuan = self.safe_convert(first_row.get('Цена Y'), float, 0)
-                
-                log_info(logger, "Добавляем товар: {model_name}, цена: {price}, цена Y: {price_yuan}")
-                
-                product_id = self.add_product(
-                    name=str(model_name),
-                    description=f"Модель: {model_name}",
-                    price=price,
-                    price_yuan=price_yuan,
-                    photo_id=None,
-                    category="general"
-                )
-                
-                if product_id:
-                    log_info(logger, "Товар добавлен, ID: {product_id}")
-                    variation_count = 0
-                    for _, row in group.iterrows():
-                        try:
-                            quantity = int(self.safe_convert(row.get('Количество'), int, 0))
-                            size = str(row.get('Размер', '')).strip()
-                            model_id = str(row.get('ID Модели', '')).strip()
-                            link = str(row.get('Ссылка', '')).strip()
-                            
-                            if not size:
-                                continue
-                            
-                            variation_price = self.safe_convert(row.get('Цена'), float, price)
-                            variation_price_yuan = self.safe_convert(row.get('Цена Y'), float, price_yuan)
-                            
-                            self.add_product_variation(
-                                product_id=product_id,
-                                model_id=model_id,
-                                size=size,
-                                quantity=quantity,
-                                price=variation_price,
-                                price_yuan=variation_price_yuan,
-                                link=link if link else None
-                            )
-                            variation_count += 1
-                        except Exception as e:
-                            log_error(logger, e, "Ошибка импорта вариации: {e}")
-                            continue
-                    
-                    log_info(logger, "Добавлено вариаций: {variation_count} для товара {model_name} (ID: {product_id})")
-                    success_count += 1
-                else:
-                    log_error(logger, e, "Ошибка добавления товара: {model_name}")
-                    
-            except Exception as e:
-                log_error(logger, e, "Ошибка импорта товара {model_name}: {e}")
-                continue
-                
-        log_info(logger, "Импорт завершен. Успешно: {success_count}")
-        return success_count
+        """Импорт товаров из старой структуры Excel (один лист)"""
+        products, variations = normalize_legacy_format(df)
+        written_products, written_variations = self.import_catalog(products, variations, replace=True)
+        log_info(logger, f"Импорт завершен. Товаров: {written_products}, вариаций: {written_variations}")
+        return written_products
 
     def import_products_from_excel_new_format(self, economics_df, keys_df):
         """Импорт товаров из новой структуры Excel с двумя листами"""
-        success_count = 0
-        
-        self.clear_all_products()
-        
-        # Создаем словарь для быстрого поиска описаний по ID модели
-        keys_dict = {}
-        for _, row in keys_df.iterrows():
-            model_id = str(row.get('ID', '')).strip()
-            if model_id:
-                keys_dict[model_id] = {
-                    'description': str(row.get('Краткое описание товара Telegram', '')).strip(),
-                    'hashtags': str(row.get('#Хештеги', '')).strip(),
-                    'keywords': str(row.get('Топ - 10 ключевый запросов Yandex WordStat', '')).strip()
-                }
-        
-        # Группируем товары по модели
-        grouped = economics_df.groupby('Модель')
-        
-        for model_name, group in grouped:
-            try:
-                if pd.isna(model_name) or str(model_name).strip() == '':
-                    log_info(logger, f"Пропущена пустая модель: {model_name}")
-                    continue
-                    
-                first_row = group.iloc[0]
-                model_id = str(first_row.get('ID модели', '')).strip()
-                
-                # Получаем описание из листа "КЛЮЧИ"
-                product_info = keys_dict.get(model_id, {})
-                description = product_info.get('description', f"Модель: {model_name}")
-                hashtags = product_info.get('hashtags', '')
-                keywords = product_info.get('keywords', '')
-                
-                # Формируем полное описание
-                full_description = description
-                if hashtags:
-                    full_description += f"\n\n{hashtags}"
-                
-                # Используем цену продажи как основную цену
-                price = self.safe_convert(first_row.get('Цена продажи'), float, 0)
-                price_yuan = self.safe_convert(first_row.get('Цена Y'), float, 0)
-                
-                log_info(logger, f"Добавляем товар: {model_name}, цена: {price}, цена Y: {price_yuan}")
-                
-                product_id = self.add_product(
-                    name=str(model_name),
-                    description=f"Модель: {model_name}",
-                    description_full=full_description,
-                    table_id=model_id,
-                    keywords=keywords,
-                    price=price,
-                    price_yuan=price_yuan,
-                    photo_id=None,
-                    category="general"
-                )
-                
-                if product_id:
-                    log_info(logger, f"Товар добавлен, ID: {product_id}")
-                    variation_count = 0
-                    
-                    for _, row in group.iterrows():
-                        try:
-                            quantity = int(self.safe_convert(row.get('Кол.'), int, 0))
-                            size = str(row.get('Размер', '')).strip()
-                            color = str(row.get('Цвет', '')).strip()
-                            
-                            if not size or pd.isna(size):
-                                continue
-                            
-                            # Используем цену продажи для вариации
-                            variation_price = self.safe_convert(row.get('Цена продажи'), float, price)
-                            variation_price_yuan = self.safe_convert(row.get('Цена Y'), float, price_yuan)
-                            
-                            # Формируем ссылку
-                            link = str(row.get('Ссылки', '')).strip()
-                            
-                            # Добавляем информацию о цвете в размер
-                            size_with_color = f"{size}"
-                            if color and color != 'nan':
-                                size_with_color += f" ({color})"
-                            
-                            self.add_product_variation(
-                                product_id=product_id,
-                                model_id=model_id,
-                                size=size_with_color,
-                                quantity=quantity,
-                                price=variation_price,
-                                price_yuan=variation_price_yuan,
-                                link=link if link else None
-                            )
-                            variation_count += 1
-                            
-                        except Exception as e:
-                            log_error(logger, e, f"Ошибка добавления вариации для {model_name}")
-                            continue
-                    
-                    log_info(logger, f"Добавлено {variation_count} вариаций для {model_name}")
-                    success_count += 1
-                    
-            except Exception as e:
-                log_error(logger, e, f"Ошибка добавления товара {model_name}")
+        products, variations = normalize_new_format(economics_df, keys_df)
+        written_products, written_variations = self.import_catalog(products, variations, replace=True)
+        log_info(logger, f"Импорт завершен. Товаров: {written_products}, вариаций: {written_variations}")
+        return written_products
+
+    def import_catalog(self, products, variations, replace=False, chunk_size=None, progress=None):
+        """Пишет каталог из catalog_import одной транзакцией; возвращает (товаров, вариаций).
+
+        Товары вставляются многострочными INSERT по chunk_size строк через
+        __insert_products: блок AUTO_INCREMENT не обязательно непрерывный, поэтому
+        их ID после каждой пачки перечитываются по name одним SELECT.
+        Вариации пишутся через executemany. При replace=True старый каталог
+        удаляется в той же транзакции, и неудачный импорт его не теряет.
+        progress(товаров, вариаций) вызывается после каждой записанной пачки;
+        ImportCancelled из него откатывает транзакцию и пробрасывается дальше.
+        """
+        chunk_size = max(1, int(chunk_size or self.IMPORT_CHUNK_SIZE))
+        product_rows = list(zip(*(products[column].tolist() for column in PRODUCT_COLUMNS)))
+        variation_columns = [variations[column].tolist() for column in VARIATION_COLUMNS]
+
+        def _import(tx):
+            if replace:
+                self.__delete_catalog(tx)
+            product_ids = dict(zip(
+                (row[0] for row in product_rows), self.__insert_products(tx, product_rows, chunk_size, progress)
+            ))
+            variation_rows = [
+                (product_ids[name], model_id, size, quantity, price, price_yuan, link)
+                for name, model_id, size, quantity, price, price_yuan, link in zip(*variation_columns)
+            ]
+            self.__insert_variations(tx, variation_rows, chunk_size, progress)
+            return len(product_ids), len(variation_rows)
+
+        try:
+            return self.__db.run_transaction(_import)
+        except ImportCancelled:
+            raise
+        except Exception as e:
+            log_error(logger, e, "Ошибка пакетного импорта каталога")
+            return 0, 0
+        finally:
+            self.__catalog.rebuild()
+
+    @staticmethod
+    def __insert_products(tx, rows, chunk_size, progress=None):
+        """Многострочные INSERT товаров (строки в порядке PRODUCT_COLUMNS); возвращает их ID.
+
+        ID идут подряд только при innodb_autoinc_lock_mode 0/1, поэтому после каждой
+        пачки они перечитываются по name (ключ товара в импорте) среди ID не меньше
+        первого вставленного: более старые товары с тем же названием сюда не попадут.
+        """
+        if not rows:
+            return []
+        product_ids = []
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            first_id = tx.insert(
+                '''INSERT INTO products (name, description, description_full, table_id, keywords, price, price_yuan, photo_id, category, topic) 
+                VALUES ''' + ', '.join(["(%s, %s, %s, %s, %s, %s, %s, NULL, 'general', 'магазин')"] * len(chunk)),
+                tuple(value for row in chunk for value in row)
+            )
+            if not first_id:
+                raise RuntimeError(f"INSERT товаров не вернул ID (строк в пачке: {len(chunk)})")
+            names = [row[0] for row in chunk]
+            inserted = {}
+            for row in tx.read(
+                f'''SELECT product_id, name FROM products
+                WHERE product_id >= %s AND name IN ({', '.join(['%s'] * len(names))})
+                ORDER BY product_id''',
+                (first_id, *names)
+            ):
+                inserted.setdefault(catalog_key(row['name']), []).append(row['product_id'])
+            for name in names:
+                ids = inserted.get(catalog_key(name))
+                if not ids:
+                    raise RuntimeError(f"Не найден ID вставленного товара {name!r}")
+                product_ids.append(ids.pop(0))
+            if progress:
+                progress(len(chunk), 0)
+        return product_ids
+
+    @staticmethod
+    def __insert_variations(tx, rows, chunk_size, progress=None):
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            tx.write_many(
+                '''INSERT INTO product_variations 
+                (product_id, model_id, size, quantity, price, price_yuan, link) 
+                VALUES (%s, %s, %s, %s, %s, %s, %s)''',
+                chunk
+            )
+            if progress:
+                progress(0, len(chunk))
+
+    def sync_products_from_excel(self, df):
+        """Инкрементальная синхронизация каталога со старой структурой Excel (см. sync_catalog)"""
+        return self.sync_catalog(*normalize_legacy_format(df))
+
+    def sync_products_from_excel_new_format(self, economics_df, keys_df):
+        """Инкрементальная синхронизация каталога с новой структурой Excel (см. sync_catalog)"""
+        return self.sync_catalog(*normalize_new_format(economics_df, keys_df))
+
+    def sync_catalog(self, products, variations, chunk_size=None, progress=None):
+        """Приводит каталог к таблицам из catalog_import, меняя только отличающиеся строки.
+
+        Товар сопоставляется по table_id; если table_id пуст или повторяется в листе,
+        то по названию. Вариация сопоставляется внутри товара по model_id + размер.
+        Новые строки вставляются, изменённые обновляются. Товары, которых нет в листе,
+        снимаются с продажи (is_available = FALSE), а их вариации обнуляются. Ничего
+        не удаляется, так что история заказов (orders_detailed) сохраняется.
+        Возвращает dict со счётчиками изменений; при ошибке — None.
+        progress — как в import_catalog, считаются только изменённые строки.
+        """
+        chunk_size = max(1, int(chunk_size or self.IMPORT_CHUNK_SIZE))
+        product_rows = list(zip(*(products[column].tolist() for column in PRODUCT_COLUMNS)))
+        variation_rows = list(zip(*(variations[column].tolist() for column in VARIATION_COLUMNS)))
+
+        def _sync(tx):
+            return self.__sync_catalog(tx, product_rows, variation_rows, chunk_size, progress)
+
+        try:
+            stats, touched = self.__db.run_transaction(_sync)
+        except ImportCancelled:
+            raise
+        except Exception as e:
+            log_error(logger, e, "Ошибка синхронизации каталога")
+            self.__catalog.invalidate()
+            return None
+        if len(touched) > self.SYNC_REFRESH_LIMIT:
+            self.__catalog.rebuild()
+        else:
+            for product_id in touched:
+                self.__catalog.refresh_product(product_id)
+                self.__catalog.refresh_variations(product_id)
+        log_info(logger, f"Синхронизация каталога: {stats}")
+        return stats
+
+    def __sync_catalog(self, tx, product_rows, variation_rows, chunk_size, progress=None):
+        stats = dict.fromkeys((
+            'products_added', 'products_updated', 'products_disabled',
+            'variations_added', 'variations_updated', 'variations_disabled'
+        ), 0)
+        touched = set()
+
+        existing_products = tx.read(
+            '''SELECT product_id, name, description, description_full, table_id, keywords, 
+               price, price_yuan, is_available FROM products ORDER BY product_id'''
+        )
+        by_table_id = {}
+        by_name = {}
+        for product in existing_products:
+            table_key = sync_table_key(product['table_id'])
+            if table_key:
+                by_table_id.setdefault(table_key, product)
+            by_name.setdefault(catalog_key(product['name']), product)
+
+        # Сопоставляем товары листа с товарами в БД
+        table_counts = {}
+        for row in product_rows:
+            table_key = sync_table_key(row[3])
+            table_counts[table_key] = table_counts.get(table_key, 0) + 1
+        product_ids = {}
+        matched = set()
+        new_products = []
+        product_updates = []
+        for row in product_rows:
+            name, description, description_full, table_id, keywords, price, price_yuan = row
+            table_key = sync_table_key(table_id)
+            if table_key and table_counts[table_key] == 1:
+                current = by_table_id.get(table_key)
+            else:
+                current = by_name.get(catalog_key(name))
+            if current is None or current['product_id'] in matched:
+                new_products.append(row)
                 continue
-        
-        log_info(logger, f"Импорт завершен. Успешно: {success_count}")
-        return success_count
+            matched.add(current['product_id'])
+            product_ids[name] = current['product_id']
+            changed = (
+                not current['is_available']
+                or any(not sync_same(current[column], value) for column, value in zip(PRODUCT_COLUMNS, row))
+            )
+            if changed:
+                product_updates.append((*row, current['product_id']))
+
+        for start in range(0, len(product_updates), chunk_size):
+            chunk = product_updates[start:start + chunk_size]
+            tx.write_many(
+                '''UPDATE products SET name = %s, description = %s, description_full = %s, table_id = %s, 
+                   keywords = %s, price = %s, price_yuan = %s, is_available = TRUE WHERE product_id = %s''',
+                chunk
+            )
+            if progress:
+                progress(len(chunk), 0)
+        touched.update(row[-1] for row in product_updates)
+        if new_products:
+            new_ids = self.__insert_products(tx, new_products, chunk_size, progress)
+            product_ids.update(zip((row[0] for row in new_products), new_ids))
+            touched.update(new_ids)
+        disabled = [
+            product['product_id'] for product in existing_products
+            if product['product_id'] not in matched and product['is_available']
+        ]
+        for start in range(0, len(disabled), chunk_size):
+            chunk = disabled[start:start + chunk_size]
+            tx.write(
+                f"UPDATE products SET is_available = FALSE WHERE product_id IN ({', '.join(['%s'] * len(chunk))})",
+                tuple(chunk)
+            )
+            if progress:
+                progress(len(chunk), 0)
+        touched.update(disabled)
+        stats['products_added'] = len(new_products)
+        stats['products_updated'] = len(product_updates)
+        stats['products_disabled'] = len(disabled)
+
+        # Вариации: по товару, ключ — model_id + размер (повторы ключа сопоставляются по порядку)
+        existing_variations = {}
+        for variation in tx.read(
+            '''SELECT variation_id, product_id, model_id, size, quantity, price, price_yuan, link 
+               FROM product_variations ORDER BY variation_id'''
+        ):
+            key = (variation['product_id'], catalog_key(variation['model_id']), catalog_key(variation['size']))
+            existing_variations.setdefault(key, []).append(variation)
+
+        new_variations = []
+        variation_updates = []
+        for name, model_id, size, quantity, price, price_yuan, link in variation_rows:
+            product_id = product_ids[name]
+            candidates = existing_variations.get((product_id, catalog_key(model_id), catalog_key(size)))
+            if not candidates:
+                new_variations.append((product_id, model_id, size, quantity, price, price_yuan, link))
+                touched.add(product_id)
+                continue
+            current = candidates.pop(0)
+            values = (model_id, size, quantity, price, price_yuan, link)
+            columns = ('model_id', 'size', 'quantity', 'price', 'price_yuan', 'link')
+            if any(not sync_same(current[column], value) for column, value in zip(columns, values)):
+                variation_updates.append((*values, current['variation_id']))
+                touched.add(product_id)
+
+        for start in range(0, len(variation_updates), chunk_size):
+            chunk = variation_updates[start:start + chunk_size]
+            tx.write_many(
+                '''UPDATE product_variations SET model_id = %s, size = %s, quantity = %s, price = %s, 
+                   price_yuan = %s, link = %s WHERE variation_id = %s''',
+                chunk
+            )
+            if progress:
+                progress(0, len(chunk))
+        self.__insert_variations(tx, new_variations, chunk_size, progress)
+        # Вариации, которых нет в листе, не удаляются: остаток обнуляется
+        removed = [
+            variation for candidates in existing_variations.values()
+            for variation in candidates if variation['quantity']
+        ]
+        for start in range(0, len(removed), chunk_size):
+            chunk = [variation['variation_id'] for variation in removed[start:start + chunk_size]]
+            tx.write(
+                f"UPDATE product_variations SET quantity = 0 WHERE variation_id IN ({', '.join(['%s'] * len(chunk))})",
+                tuple(chunk)
+            )
+            if progress:
+                progress(0, len(chunk))
+        touched.update(variation['product_id'] for variation in removed)
+        stats['variations_added'] = len(new_variations)
+        stats['variations_updated'] = len(variation_updates)
+        stats['variations_disabled'] = len(removed)
+        return stats, touched
 
     def add_product_variation(self, product_id, model_id, size, quantity, price, price_yuan, link):
+        return self.add_product_variations([(product_id, model_id, size, quantity, price, price_yuan, link)]) > 0
+
+    def add_product_variations(self, variations, chunk_size=None):
+        """Пакетно добавить вариации: кортежи (product_id, model_id, size, quantity, price, price_yuan, link).
+
+        Возвращает число добавленных строк.
+        """
         try:
-            result = self.__db.db_write(
+            return self.__db.db_write_many(
                 '''INSERT INTO product_variations 
                 (product_id, model_id, size, quantity, price, price_yuan, link) 
                 VALUES (%s, %s, %s, %s, %s, %s, %s)''',
-                (product_id, model_id, size, quantity, price, price_yuan, link)
+                variations,
+                chunk_size=chunk_size
             )
-            return bool(result)
         except Exception as e:
-            log_error(logger, e, "Ошибка добавления вариации: {e}")
-            return False
+            log_error(logger, e, "Ошибка пакетного добавления вариаций")
+            return 0
 
     def get_product_with_variations(self, product_id):
-        product = self.get_product(product_id)
+        product = self.get_available_product(product_id)
         if not product:
             return None
             
-        variations = self.__db.db_read(
-            'SELECT * FROM product_variations WHERE product_id = %s',
-            (product_id,)
-        )
+        variations = self.get_product_variations(product_id)
         
         return {
             'product_id': product['product_id'],
@@ -573,6 +1599,7 @@ class DbAct:
             'UPDATE product_variations SET quantity = %s WHERE variation_id = %s',
             (new_quantity, variation_id)
         )
+        self.__catalog.refresh_variation(self.__product_key(variation_id))
 
     def get_products_count(self):
         data = self.__db.db_read('SELECT COUNT(*) as count FROM products')
@@ -590,117 +1617,157 @@ class DbAct:
         data = self.__db.db_read('SELECT COUNT(*) as count FROM reviews')
         return data[0]['count'] if data else 0
 
+    def get_admin_stats(self):
+        """Сводная статистика админки одним запросом; кэшируется на ADMIN_STATS_TTL секунд.
+
+        Товары, вариации и остатки берутся из каталога в памяти, если он загружен.
+        Возвращает None, если прочитать статистику не удалось.
+        """
+        cached = self.__admin_stats
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        parts = [
+            "SELECT 'orders_by_status' AS metric, status AS name, COUNT(*) AS value FROM orders_detailed GROUP BY status",
+            "SELECT 'orders_today', NULL, COUNT(*) FROM orders_detailed WHERE created_at >= CURDATE()",
+            "SELECT 'users', NULL, COUNT(*) FROM users",
+            "SELECT 'active_users_24h', NULL, COUNT(*) FROM users WHERE last_active >= NOW() - INTERVAL 1 DAY",
+            "SELECT 'reviews', NULL, COUNT(*) FROM reviews",
+        ]
+        catalog = self.__catalog.get()
+        if catalog is None:
+            parts += [
+                "SELECT 'products', NULL, COUNT(*) FROM products",
+                "SELECT 'variations', NULL, COUNT(*) FROM product_variations",
+                "SELECT 'stock_units', NULL, COALESCE(SUM(GREATEST(quantity, 0)), 0) FROM product_variations",
+            ]
+        rows = self.__db.db_read('\nUNION ALL\n'.join(parts))
+        if not rows:
+            return None
+
+        stats = {'orders_by_status': {}, 'orders': 0}
+        for row in rows:
+            value = int(row['value'] or 0)
+            if row['metric'] == 'orders_by_status':
+                stats['orders_by_status'][row['name'] or 'без статуса'] = value
+                stats['orders'] += value
+            else:
+                stats[row['metric']] = value
+        if catalog is not None:
+            stats['products'] = len(catalog.products)
+            stats['variations'] = len(catalog.variation_ids)
+            stats['stock_units'] = sum(max(v['quantity'] or 0, 0) for v in catalog.variation_ids.values())
+
+        self.__admin_stats = (time.monotonic() + self.ADMIN_STATS_TTL, stats)
+        return stats
+
     def update_product_exclusive(self, product_id, is_exclusive, coin_price=0):
         try:
             self.__db.db_write(
                 'UPDATE products SET is_exclusive = %s, coin_price = %s WHERE product_id = %s',
                 (is_exclusive, coin_price, product_id)
             )
+            self.__catalog.refresh_product(self.__product_key(product_id))
             return True
         except Exception as e:
             log_error(logger, e, "Ошибка обновления товара: {e}")
             return False
 
     def get_all_products(self):
-        return self.__db.db_read('SELECT * FROM products')
+        """Потоково отдаёт все товары (генератор)."""
+        return self.__db.db_read_iter('SELECT * FROM products')
 
     def update_product_photo(self, product_id, photo_id):
-        return self.__db.db_write(
+        updated = self.__db.db_write(
             'UPDATE products SET photo_id = %s WHERE product_id = %s',
             (photo_id, product_id)
         )
+        self.__catalog.refresh_product(self.__product_key(product_id))
+        return updated
     
     def get_all_products_for_export(self):
-        try:
-            products = self.__db.db_read('''
-                SELECT p.product_id, p.name, pv.model_id, pv.size, pv.price_yuan, 
-                    pv.quantity, pv.price, pv.link, p.is_exclusive, p.coin_price
-                FROM products p
-                LEFT JOIN product_variations pv ON p.product_id = pv.product_id
-                ORDER BY p.name, pv.size
-            ''')
-            
-            result = []
-            for product in products:
-                result.append({
-                    'product_id': product['product_id'],
-                    'name': product['name'],
-                    'model_id': product['model_id'] if product['model_id'] else '',
-                    'size': product['size'] if product['size'] else '',
-                    'price_yuan': product['price_yuan'] if product['price_yuan'] else 0,
-                    'quantity': product['quantity'] if product['quantity'] else 0,
-                    'price': product['price'] if product['price'] else 0,
-                    'link': product['link'] if product['link'] else '',
-                    'is_exclusive': bool(product['is_exclusive']),
-                    'coin_price': product['coin_price'] if product['coin_price'] else 0
-                })
-            
-            return result
-            
-        except Exception as e:
-            log_error(logger, e, "Ошибка получения данных для экспорта: {e}")
-            return []
+        """Потоково отдаёт строки каталога для выгрузки в Excel (генератор)."""
+        products = self.__db.db_read_iter('''
+            SELECT p.product_id, p.name, pv.model_id, pv.size, pv.price_yuan, 
+                pv.quantity, pv.price, pv.link, p.is_exclusive, p.coin_price
+            FROM products p
+            LEFT JOIN product_variations pv ON p.product_id = pv.product_id
+            ORDER BY p.name, pv.size
+        ''')
+        for product in products:
+            yield {
+                'product_id': product['product_id'],
+                'name': product['name'],
+                'model_id': product['model_id'] if product['model_id'] else '',
+                'size': product['size'] if product['size'] else '',
+                'price_yuan': product['price_yuan'] if product['price_yuan'] else 0,
+                'quantity': product['quantity'] if product['quantity'] else 0,
+                'price': product['price'] if product['price'] else 0,
+                'link': product['link'] if product['link'] else '',
+                'is_exclusive': bool(product['is_exclusive']),
+                'coin_price': product['coin_price'] if product['coin_price'] else 0
+            }
         
     def clear_all_products(self):
         try:
-            # Удаляем в правильном порядке из-за внешних ключей
-            self.__db.db_write('DELETE FROM orders_detailed WHERE product_id IN (SELECT product_id FROM products)')
-            self.__db.db_write('DELETE FROM orders WHERE product_id IN (SELECT product_id FROM products)')
-            self.__db.db_write('DELETE FROM product_variations')
-            self.__db.db_write('DELETE FROM products')
+            self.__db.run_transaction(self.__delete_catalog)
+            self.__catalog.rebuild()
             return True
         except Exception as e:
             log_error(logger, e, "Ошибка очистки товаров: {e}")
             return False
 
+    @staticmethod
+    def __delete_catalog(tx):
+        # Удаляем в правильном порядке из-за внешних ключей
+        tx.write('DELETE FROM orders_detailed WHERE product_id IN (SELECT product_id FROM products)')
+        tx.write('DELETE FROM orders WHERE product_id IN (SELECT product_id FROM products)')
+        tx.write('DELETE FROM product_variations')
+        tx.write('DELETE FROM products')
+
     def create_detailed_order(self, user_id, product_id, size, city, address, full_name, phone, delivery_type):
-        try:
-            log_info(logger, "DEBUG: Создание заказа для user_id: {user_id}, product_id: {product_id}, size: {size}")
-            
-            variation_data = self.__db.db_read(
-                'SELECT variation_id, quantity FROM product_variations WHERE product_id = %s AND size = %s',
+        def _create(tx):
+            # Блокируем строку вариации до конца транзакции, чтобы параллельные
+            # заказы не продали последнюю единицу дважды
+            variation = tx.read_one(
+                'SELECT variation_id, quantity FROM product_variations WHERE product_id = %s AND size = %s LIMIT 1 FOR UPDATE',
                 (product_id, str(size))
             )
             
-            log_info(logger, "DEBUG: Найдены вариации: {variation_data}")
-            
-            if not variation_data:
-                log_error(logger, "❌ Вариация не найдена - product_id: {product_id}, size: {size}")
+            if not variation:
+                log_info(logger, f"❌ Вариация не найдена - product_id: {product_id}, size: {size}")
                 return None
                 
-            variation_id = variation_data[0]['variation_id']
-            current_quantity = variation_data[0]['quantity']
+            variation_id = variation['variation_id']
             
             # Проверяем достаточность товара
-            if current_quantity <= 0:
-                log_error(logger, "❌ Товара нет в наличии - product_id: {product_id}, size: {size}")
+            if variation['quantity'] <= 0:
+                log_info(logger, f"❌ Товара нет в наличии - product_id: {product_id}, size: {size}")
                 return None
-                
-            log_info(logger, "DEBUG: Используем variation_id: {variation_id}, количество: {current_quantity}")
             
-            # Создаем запись в базе и получаем order_id, не обращаясь к приватным полям DB
-            insert_result = self.__db.db_write(
+            order_id = tx.insert(
                 '''INSERT INTO orders_detailed 
                 (user_id, product_id, variation_id, quantity, city, address, full_name, phone, delivery_type) 
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)''',
                 (user_id, product_id, variation_id, 1, city, address, full_name, phone, delivery_type)
             )
-            order_id_data = self.__db.db_read('SELECT LAST_INSERT_ID() as last_id') if insert_result else []
-            order_id = order_id_data[0]['last_id'] if order_id_data else None
             
             # Уменьшаем количество товара
+            tx.write(
+                'UPDATE product_variations SET quantity = quantity - 1 WHERE variation_id = %s',
+                (variation_id,)
+            )
+            return order_id
+
+        try:
+            order_id = self.__db.run_transaction(_create)
             if order_id:
-                success = self.__db.db_write(
-                    'UPDATE product_variations SET quantity = quantity - 1 WHERE variation_id = %s AND quantity > 0',
-                    (variation_id,)
-                )
-                log_info(logger, "DEBUG: Уменьшение количества - success: {success}")
-                
-            log_info(logger, "DEBUG: Создан заказ с ID: {order_id}")
+                self.__catalog.refresh_variations(self.__product_key(product_id))
+            log_info(logger, f"Создан заказ с ID: {order_id} (user_id: {user_id}, product_id: {product_id}, size: {size})")
             return order_id
             
         except Exception as e:
-            log_error(logger, e, "Ошибка создания заказа: {e}")
+            log_error(logger, e, "Ошибка создания заказа")
             return None
         
     def save_order_message_id(self, order_id, message_id, topic_id):
@@ -761,6 +1828,8 @@ class DbAct:
                 'UPDATE product_variations SET quantity = quantity - 1 WHERE product_id = %s AND size = %s',
                 (product_id, size_str)
             )
+            if success:
+                self.__catalog.refresh_variations(self.__product_key(product_id))
             
             log_info(logger, "DEBUG: Уменьшение количества - success: {success}")
             return bool(success)
@@ -770,6 +1839,9 @@ class DbAct:
             return False
 
     def get_product_variations(self, product_id):
+        catalog = self.__catalog.get()
+        if catalog is not None:
+            return list(catalog.variations.get(self.__product_key(product_id), ()))
         try:
             data = self.__db.db_read(
                 'SELECT * FROM product_variations WHERE product_id = %s',
@@ -796,6 +1868,9 @@ class DbAct:
 
     def get_product_variations_by_model_id(self, model_id):
         """Возвращает вариации по строковому идентификатору модели (например, M1906DD)."""
+        catalog = self.__catalog.get()
+        if catalog is not None:
+            return list(catalog.by_model_id.get(catalog_key(model_id), ()))
         try:
             data = self.__db.db_read(
                 'SELECT * FROM product_variations WHERE model_id = %s',
@@ -823,6 +1898,8 @@ class DbAct:
     def check_size_availability(self, product_id, size):
         """Проверяет доступность размера"""
         try:
+            if self.get_available_product(product_id) is None:
+                return False
             variations = self.get_product_variations(product_id)
             for variation in variations:
                 var_size = str(variation['size']).strip()
@@ -860,6 +1937,8 @@ class DbAct:
                 'UPDATE product_variations SET quantity = quantity + %s WHERE variation_id = %s',
                 (order_quantity, variation_id)
             )
+            if success:
+                self.__catalog.refresh_variation(variation_id)
             
             log_info(logger, "DEBUG: Возврат товара - order_id: {order_id}, variation_id: {variation_id}, quantity: {order_quantity}, success: {success}")
             return bool(success)
@@ -868,6 +1947,51 @@ class DbAct:
             log_error(logger, e, "Ошибка возврата товара: {e}")
             return False
 
+    def get_orders_page(self, user_id=None, status=None, before_id=None, limit=10):
+        """Страница заказов вместе с товаром и покупателем одним запросом.
+
+        Заказы идут по убыванию order_id; следующая страница запрашивается
+        с before_id из результата (keyset-пагинация, без OFFSET). status ищется
+        как подстрока. Возвращает (orders, next_before_id); на последней
+        странице next_before_id — None.
+        """
+        conditions = []
+        params = []
+        if user_id is not None:
+            conditions.append('o.user_id = %s')
+            params.append(user_id)
+        if status:
+            escaped = str(status).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append('o.status LIKE %s')
+            params.append(f'%{escaped}%')
+        if before_id is not None:
+            conditions.append('o.order_id < %s')
+            params.append(int(before_id))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        # Лишняя строка показывает, есть ли следующая страница
+        params.append(limit + 1)
+        try:
+            rows = self.__db.db_read(
+                f'''SELECT o.order_id, o.user_id, o.product_id, o.status, o.created_at,
+                       p.name AS product_name, COALESCE(v.price, p.price) AS product_price, v.size,
+                       u.first_name, u.last_name, u.username
+                FROM orders_detailed o
+                LEFT JOIN products p ON p.product_id = o.product_id
+                LEFT JOIN product_variations v ON v.variation_id = o.variation_id
+                LEFT JOIN users u ON u.user_id = o.user_id
+                {where}
+                ORDER BY o.order_id DESC
+                LIMIT %s''',
+                tuple(params)
+            )
+        except Exception as e:
+            log_error(logger, e, "Ошибка получения страницы заказов")
+            return [], None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, rows[-1]['order_id']
+        return rows, None
+
     def get_user_orders(self, user_id, limit=50):
         """Возвращает список заказов пользователя (последние по дате)."""
         try:
@@ -0,0 +1,64 @@
+"""Сравнение драйверов MySQL на выгрузке каталога (get_all_products_for_export).
+
+Запуск: python bench_drivers.py [повторов] [драйвер ...]
+Берёт настройки MySQL из secrets.json; драйверы, которые не установлены, пропускаются.
+"""
+import os
+import sys
+import time
+import platform
+import statistics
+from config_parser import ConfigParser
+from backend import DbAct
+from db import DB, DRIVERS
+
+
+def bench_driver(driver, mysql_config, config, xlsx_path, repeats):
+    db = DB(
+        host=mysql_config.get('host', '127.0.0.1'),
+        user=mysql_config.get('user', 'root'),
+        password=mysql_config.get('password', '12345678'),
+        database=mysql_config.get('database', 'bridgeside_bot'),
+        port=mysql_config.get('port', 3306),
+        pool_min_size=1,
+        pool_max_size=1,
+        keepalive_interval=0,
+        driver=driver,
+    )
+    try:
+        db_actions = DbAct(db, config, xlsx_path)
+        # Прогрев: первое обращение поднимает соединение и кэши сервера
+        rows = sum(1 for _ in db_actions.get_all_products_for_export())
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            for _ in db_actions.get_all_products_for_export():
+                pass
+            timings.append((time.perf_counter() - started) * 1000)
+        return rows, timings
+    finally:
+        db.close()
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    drivers = sys.argv[2:] or list(DRIVERS)
+
+    work_dir = os.path.dirname(os.path.realpath(__file__))
+    config = ConfigParser(f'{work_dir}/secrets.json', platform.system())
+    config_data = config.get_config()
+    mysql_config = config_data.get('mysql', {})
+
+    print(f"get_all_products_for_export, повторов: {repeats}")
+    for driver in drivers:
+        try:
+            rows, timings = bench_driver(driver, mysql_config, config, config_data['xlsx_path'], repeats)
+        except RuntimeError as e:
+            print(f"{driver:12} пропущен: {e}")
+            continue
+        print(f"{driver:12} строк: {rows:6}  медиана: {statistics.median(timings):8.2f} мс  "
+              f"мин: {min(timings):8.2f} мс  макс: {max(timings):8.2f} мс")
+
+
+if __name__ == '__main__':
+    main()
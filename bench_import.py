@@ -0,0 +1,116 @@
+"""Замер пакетного импорта каталога (catalog_import + DbAct.import_catalog).
+
+Запуск: python bench_import.py [вариаций] [--per-row]
+Генерирует книгу нового формата («ЭКОНОМИКА» + «КЛЮЧИ») с заданным числом
+вариаций (по умолчанию 10 000) и импортирует её в отдельную БД
+<database>_bench из secrets.json: рабочий каталог не трогается.
+С --per-row для сравнения замеряется и прежняя схема — INSERT на каждый товар
+и каждую вариацию.
+"""
+import os
+import sys
+import time
+import platform
+import pandas as pd
+from config_parser import ConfigParser
+from backend import DbAct
+from catalog_import import normalize_new_format
+from db import DB
+
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL', '36', '38', '40', '42']
+
+
+def make_workbook(variations):
+    models = max(1, variations // len(SIZES))
+    rows = []
+    for index in range(variations):
+        model = index // len(SIZES)
+        rows.append({
+            'Модель': f"Модель {model:05d}",
+            'ID модели': f"M{model:05d}",
+            'Размер': SIZES[index % len(SIZES)],
+            'Цена Y': 100 + model % 50,
+            'Кол.': index % 7,
+            'Цена продажи': 1500 + model % 300,
+            'Цвет': 'черный' if index % 2 else '',
+            'Ссылки': f"https://example.com/{model}/{index}",
+        })
+    keys = [
+        {
+            'ID': f"M{model:05d}",
+            'Краткое описание товара Telegram': f"Описание модели {model}",
+            '#Хештеги': '#bench #catalog',
+            'Топ - 10 ключевый запросов Yandex WordStat': 'кроссовки, кеды',
+        }
+        for model in range(models)
+    ]
+    return pd.DataFrame(rows), pd.DataFrame(keys)
+
+
+def import_per_row(db, products, variations):
+    """Прежняя схема: INSERT на каждый товар (с чтением его ID) и на каждую вариацию."""
+    product_ids = {}
+    for product in products.to_dict('records'):
+        product_ids[product['name']] = db.db_insert(
+            '''INSERT INTO products (name, description, description_full, table_id, keywords, price, price_yuan, photo_id, category, topic)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, NULL, 'general', 'магазин')''',
+            (product['name'], product['description'], product['description_full'], product['table_id'],
+             product['keywords'], product['price'], product['price_yuan'])
+        )
+    for variation in variations.to_dict('records'):
+        db.db_write(
+            '''INSERT INTO product_variations
+            (product_id, model_id, size, quantity, price, price_yuan, link)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)''',
+            (product_ids[variation['name']], variation['model_id'], variation['size'], variation['quantity'],
+             variation['price'], variation['price_yuan'], variation['link'])
+        )
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    per_row = '--per-row' in sys.argv
+    variations_count = int(args[0]) if args else 10000
+
+    work_dir = os.path.dirname(os.path.realpath(__file__))
+    config = ConfigParser(f'{work_dir}/secrets.json', platform.system())
+    config_data = config.get_config()
+    mysql_config = config_data.get('mysql', {})
+    db = DB(
+        host=mysql_config.get('host', '127.0.0.1'),
+        user=mysql_config.get('user', 'root'),
+        password=mysql_config.get('password', '12345678'),
+        database=f"{mysql_config.get('database', 'bridgeside_bot')}_bench",
+        port=mysql_config.get('port', 3306),
+        pool_min_size=1,
+        pool_max_size=2,
+        keepalive_interval=0,
+        driver=mysql_config.get('driver', 'pymysql'),
+    )
+    try:
+        db_actions = DbAct(db, config, config_data['xlsx_path'])
+        economics_df, keys_df = make_workbook(variations_count)
+
+        started = time.perf_counter()
+        products, variations = normalize_new_format(economics_df, keys_df)
+        normalized = time.perf_counter()
+        written_products, written_variations = db_actions.import_catalog(products, variations, replace=True)
+        finished = time.perf_counter()
+
+        print(f"Товаров: {written_products}, вариаций: {written_variations}")
+        print(f"Нормализация: {(normalized - started) * 1000:9.1f} мс")
+        print(f"Запись в БД:  {(finished - normalized) * 1000:9.1f} мс")
+        print(f"Всего:        {(finished - started) * 1000:9.1f} мс")
+
+        if per_row:
+            db_actions.clear_all_products()
+            started = time.perf_counter()
+            import_per_row(db, products, variations)
+            print(f"По строке:    {(time.perf_counter() - started) * 1000:9.1f} мс")
+        db_actions.clear_all_products()
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
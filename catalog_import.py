@@ -0,0 +1,362 @@
+"""Нормализация и проверка листов Excel с каталогом для пакетного импорта.
+
+Листы обрабатываются целыми колонками pandas, без iterrows. Результат — две
+таблицы: товары (по строке на модель) и их вариации. В БД их одной
+транзакцией пишет DbAct.import_catalog.
+
+Книга загрузки читается функциями open_workbook/read_sheet: из памяти, в
+режиме read-only openpyxl, каждый лист — одним проходом по строкам.
+validate_new_format/validate_legacy_format проверяют листы до записи в БД:
+ошибки останавливают импорт, предупреждения — строки, которые импорт просто
+пропустит. error_workbook собирает и те и другие в xlsx.
+"""
+import io
+import zipfile
+from itertools import islice
+import openpyxl
+import pandas as pd
+from openpyxl.utils.exceptions import InvalidFileException
+
+# Колонки таблиц, которые ждёт DbAct.import_catalog
+PRODUCT_COLUMNS = ['name', 'description', 'description_full', 'table_id', 'keywords', 'price', 'price_yuan']
+# name — ключ товара, по нему вариации получают product_id
+VARIATION_COLUMNS = ['name', 'model_id', 'size', 'quantity', 'price', 'price_yuan', 'link']
+
+# Колонки листов нового формата, которые нужны импорту; остальные не читаются
+ECONOMICS_COLUMNS = ['Модель', 'ID модели', 'Размер', 'Цена Y', 'Кол.', 'Цена продажи', 'Цвет', 'Ссылки']
+KEYS_COLUMNS = ['ID', 'Краткое описание товара Telegram', '#Хештеги', 'Топ - 10 ключевый запросов Yandex WordStat']
+# Строк листа на один чанк при чтении
+READ_CHUNK_SIZE = 5000
+# Колонки отчёта проверки: ошибки останавливают импорт, предупреждения — нет
+ERRORS_COLUMN = 'Ошибки'
+WARNINGS_COLUMN = 'Предупреждения'
+# openpyxl читает только книги Office Open XML; старый .xls (BIFF) он не откроет
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xlsm')
+
+
+class ImportCancelled(Exception):
+    """Импорт отменён; бросается из progress-колбэка и откатывает транзакцию импорта."""
+
+
+def is_workbook_name(file_name):
+    """Можно ли прочитать файл через open_workbook (по расширению)."""
+    return str(file_name or '').lower().endswith(WORKBOOK_EXTENSIONS)
+
+
+def open_workbook(data):
+    """Книга из байтов файла без записи на диск; закрывать через workbook.close().
+
+    Если это не xlsx (например, .xls с переименованным расширением), бросает ValueError.
+    """
+    try:
+        return openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException) as e:
+        raise ValueError(f"Файл не является книгой .xlsx: {e}") from e
+
+
+def _sheet_chunk(rows, positions):
+    return pd.DataFrame({
+        name: [row[position] if position < len(row) else None for row in rows]
+        for name, position in positions.items()
+    })
+
+
+def read_sheet(workbook, sheet_name=None, columns=None, chunk_size=READ_CHUNK_SIZE, progress=None):
+    """Лист книги (по умолчанию первый) -> DataFrame, первая строка — заголовок.
+
+    Строки идут итератором read-only листа и собираются чанками по chunk_size,
+    так что в памяти держатся только значения колонок из columns (None — всех),
+    а не разобранная книга целиком. Пустые ячейки — NaN, как в pd.read_excel.
+    progress(n) вызывается после каждого чанка с числом прочитанных в нём строк.
+    """
+    sheet = workbook[sheet_name] if sheet_name is not None else workbook.worksheets[0]
+    rows = sheet.iter_rows(values_only=True)
+    positions = {}
+    for position, name in enumerate(next(rows, None) or ()):
+        # При повторе заголовка берётся первая колонка
+        if name is not None and name not in positions and (columns is None or name in columns):
+            positions[name] = position
+
+    chunks = []
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        chunks.append(_sheet_chunk(chunk, positions))
+        if progress:
+            progress(len(chunk))
+    if not chunks:
+        return pd.DataFrame(columns=list(positions))
+    df = pd.concat(chunks, ignore_index=True).infer_objects()
+    # Пустые строки в конце листа отбрасываются, как в pd.read_excel
+    filled = df.notna().any(axis=1).to_numpy().nonzero()[0]
+    df = df.iloc[:filled[-1] + 1 if len(filled) else 0]
+    return df.where(df.notna(), float('nan')).infer_objects()
+
+
+def _column(df, name, default=''):
+    if name in df.columns:
+        return df[name]
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def _text(series):
+    # Ровно str(value).strip() по ячейке: пустая ячейка становится 'nan', как и раньше.
+    # astype(str) в pandas 3 сохраняет пропуски, поэтому str применяется явно
+    return series.map(str).str.strip()
+
+
+def _number(series):
+    # Как DbAct.safe_convert: пустое и нечисловое значение -> NaN (дальше подставляется default)
+    return pd.to_numeric(series, errors='coerce').replace([float('inf'), float('-inf')], float('nan'))
+
+
+def _model_rows(df, model_column):
+    """Строки с непустой моделью; name — str(модель), как раньше при groupby."""
+    models = df[model_column]
+    rows = df[models.notna()]
+    names = rows[model_column].map(str)
+    return rows[names.str.strip() != ''], names[names.str.strip() != '']
+
+
+def _variations(rows, names, products, model_ids, size):
+    """Вариации по строкам листа; цены по умолчанию — цены товара (первой строки модели)."""
+    product_price = names.map(products.set_index('name')['price'])
+    product_price_yuan = names.map(products.set_index('name')['price_yuan'])
+    link = rows['link'].astype(object)
+    variations = pd.DataFrame({
+        'name': names,
+        'model_id': model_ids,
+        'size': size,
+        'quantity': _number(rows['quantity']).fillna(0).astype('int64'),
+        'price': _number(rows['price']).fillna(product_price),
+        'price_yuan': _number(rows['price_yuan']).fillna(product_price_yuan),
+        'link': link.where(link != '', None),
+    })
+    variations = variations[variations['size'] != '']
+    # Порядок как у прежнего импорта: по моделям, внутри модели — как в листе
+    return variations.sort_values('name', kind='stable')[VARIATION_COLUMNS].reset_index(drop=True)
+
+
+def normalize_new_format(economics_df, keys_df):
+    """Листы «ЭКОНОМИКА» и «КЛЮЧИ» -> (товары, вариации)."""
+    keys = pd.DataFrame({
+        'table_id': _text(_column(keys_df, 'ID')),
+        'description': _text(_column(keys_df, 'Краткое описание товара Telegram')),
+        'hashtags': _text(_column(keys_df, '#Хештеги')),
+        'keywords': _text(_column(keys_df, 'Топ - 10 ключевый запросов Yandex WordStat')),
+    })
+    # При повторе ID в листе «КЛЮЧИ» побеждает последняя строка
+    keys = keys[keys['table_id'] != ''].drop_duplicates('table_id', keep='last').set_index('table_id')
+
+    source, names = _model_rows(economics_df, 'Модель')
+    rows = pd.DataFrame({
+        'name': names,
+        'model_id': _text(_column(source, 'ID модели')),
+        'quantity': _column(source, 'Кол.', None),
+        'price': _column(source, 'Цена продажи', None),
+        'price_yuan': _column(source, 'Цена Y', None),
+        'link': _text(_column(source, 'Ссылки')),
+    })
+
+    first = rows.drop_duplicates('name').sort_values('name', kind='stable')
+    info = keys.reindex(first['model_id'])
+    has_info = first['model_id'].isin(keys.index).to_numpy()
+    fallback = 'Модель: ' + first['name']
+    description = pd.Series(info['description'].to_numpy(), index=first.index).where(has_info, fallback)
+    hashtags = pd.Series(info['hashtags'].to_numpy(), index=first.index).where(has_info, '')
+    keywords = pd.Series(info['keywords'].to_numpy(), index=first.index).where(has_info, '')
+    products = pd.DataFrame({
+        'name': first['name'],
+        'description': fallback,
+        'description_full': description.where(hashtags == '', description + '\n\n' + hashtags),
+        'table_id': first['model_id'],
+        'keywords': keywords,
+        'price': _number(first['price']).fillna(0),
+        'price_yuan': _number(first['price_yuan']).fillna(0),
+    })[PRODUCT_COLUMNS].reset_index(drop=True)
+
+    # Вариации получают ID модели товара, а размер дополняется цветом
+    raw_size = _text(_column(source, 'Размер'))
+    color = _text(_column(source, 'Цвет'))
+    size = raw_size.where(color.isin(['', 'nan']) | (raw_size == ''), raw_size + ' (' + color + ')')
+    model_ids = names.map(products.set_index('name')['table_id'])
+    return products, _variations(rows, names, products, model_ids, size)
+
+
+def normalize_legacy_format(df):
+    """Старый формат (один лист, колонки уже приведены в process_products_file) -> (товары, вариации)."""
+    source, names = _model_rows(df, 'Модель')
+    rows = pd.DataFrame({
+        'name': names,
+        'quantity': _column(source, 'Количество', None),
+        'price': _column(source, 'Цена', None),
+        'price_yuan': _column(source, 'Цена Y', None),
+        'link': _text(_column(source, 'Ссылка')),
+    })
+
+    first = rows.drop_duplicates('name').sort_values('name', kind='stable')
+    products = pd.DataFrame({
+        'name': first['name'],
+        'description': 'Модель: ' + first['name'],
+        'description_full': None,
+        'table_id': None,
+        'keywords': None,
+        'price': _number(first['price']).fillna(0),
+        'price_yuan': _number(first['price_yuan']).fillna(0),
+    })[PRODUCT_COLUMNS].reset_index(drop=True)
+
+    # В старом формате у каждой строки свой ID модели
+    model_ids = _text(_column(source, 'ID Модели'))
+    size = _text(_column(source, 'Размер'))
+    return products, _variations(rows, names, products, model_ids, size)
+
+
+def _filled_rows(df):
+    # Строка считается заполненной, если в ней есть хоть одна непустая ячейка
+    return ~df.isna().all(axis=1) if len(df.columns) else pd.Series(False, index=df.index)
+
+
+class _SheetErrors:
+    """Ошибки и предупреждения по строкам листа; каждая проверка — маска по всей колонке.
+
+    Текст колонок считается один раз и переиспользуется проверками.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.messages = {
+            ERRORS_COLUMN: pd.Series('', index=df.index, dtype=object),
+            WARNINGS_COLUMN: pd.Series('', index=df.index, dtype=object),
+        }
+        self.__texts = {}
+
+    def text(self, column):
+        if column not in self.__texts:
+            self.__texts[column] = _text(self.df[column])
+        return self.__texts[column]
+
+    def blank(self, column):
+        return self.df[column].isna() | (self.text(column) == '')
+
+    def add(self, mask, message, column=ERRORS_COLUMN):
+        mask = mask.fillna(False).astype(bool)
+        if mask.any():
+            messages = self.messages[column]
+            self.messages[column] = messages.where(~mask, messages + message + '; ')
+
+    def warn(self, mask, message):
+        """Строка не мешает импорту (он её пропустит), но попадёт в отчёт."""
+        self.add(mask, message, WARNINGS_COLUMN)
+
+    def number(self, column, decimal_comma=False):
+        if decimal_comma:
+            return _number(self.text(column).str.replace(',', '.'))
+        return _number(self.df[column])
+
+    def not_number(self, column, mask, decimal_comma=False):
+        """Непустая ячейка, которая не приводится к числу."""
+        bad = mask & ~self.blank(column) & self.number(column, decimal_comma).isna()
+        self.add(bad, f'{column}: не число «' + self.text(column) + '»')
+        return bad
+
+    def negative(self, column, mask, decimal_comma=False):
+        bad = self.not_number(column, mask, decimal_comma)
+        self.add(mask & ~bad & (self.number(column, decimal_comma) < 0), f'{column}: отрицательное количество')
+
+    def duplicates(self, keys, label, column=ERRORS_COLUMN):
+        """Повтор ключа (колонки keys, NaN — нет ключа): каждая следующая строка ссылается на первую."""
+        keys = keys[keys.notna().all(axis=1)]
+        repeated = keys.duplicated(keep='first')
+        if not repeated.any():
+            return
+        rows = pd.Series(keys.index + 2, index=keys.index)
+        first_row = rows.groupby([keys[column] for column in keys.columns]).transform('first')
+        self.add(repeated.reindex(self.df.index, fill_value=False),
+                 (f'повтор {label} из строки ' + first_row.astype(str)).reindex(self.df.index, fill_value=''),
+                 column)
+
+    def report(self):
+        """Строки с замечаниями: номер строки Excel, исходные ячейки, ошибки и предупреждения."""
+        bad = (self.messages[ERRORS_COLUMN] != '') | (self.messages[WARNINGS_COLUMN] != '')
+        rows = self.df[bad].copy()
+        rows.insert(0, 'Строка', rows.index + 2)
+        for column, messages in self.messages.items():
+            rows[column] = messages[bad].str.rstrip('; ')
+        return rows.reset_index(drop=True)
+
+
+def validate_new_format(economics_df, keys_df):
+    """Проверка листов «ЭКОНОМИКА» и «КЛЮЧИ» без записи в БД.
+
+    Колонки листов должны быть уже проверены. Возвращает {лист: DataFrame строк
+    с ошибками или предупреждениями} — пустой dict, если замечаний нет. Строки,
+    которые normalize_new_format не использует (без модели, лишние ID в «КЛЮЧИ»),
+    и повтор ID в «КЛЮЧИ» (берётся последняя строка) — предупреждения.
+    """
+    economics = _SheetErrors(economics_df)
+    has_model = ~economics.blank('Модель')
+    economics.warn(_filled_rows(economics_df) & ~has_model, 'не указана модель, строка пропущена')
+    economics.add(has_model & economics.blank('ID модели'), 'не указан ID модели')
+    economics.add(has_model & economics.blank('Размер'), 'не указан размер')
+    economics.not_number('Цена продажи', has_model)
+    economics.not_number('Цена Y', has_model)
+    economics.negative('Кол.', has_model)
+    # Размер с цветом — как в normalize_new_format
+    raw_size = economics.text('Размер')
+    color = economics.text('Цвет')
+    size = raw_size.where(color.isin(['', 'nan']) | (raw_size == ''), raw_size + ' (' + color + ')')
+    economics.duplicates(pd.DataFrame({
+        'model': economics.text('Модель').where(has_model),
+        'size': size.where(~economics.blank('Размер')),
+    }), 'модели и размера')
+
+    keys = _SheetErrors(keys_df)
+    has_id = ~keys.blank('ID')
+    keys.warn(_filled_rows(keys_df) & ~has_id, 'не указан ID, строка пропущена')
+    model_ids = economics.text('ID модели')[has_model & ~economics.blank('ID модели')]
+    keys.warn(has_id & ~keys.text('ID').isin(set(model_ids)), 'ID нет в листе ЭКОНОМИКА, строка пропущена')
+    keys.duplicates(pd.DataFrame({'id': keys.text('ID').where(has_id)}), 'ID', WARNINGS_COLUMN)
+
+    report = {'ЭКОНОМИКА': economics.report(), 'КЛЮЧИ': keys.report()}
+    return {sheet: rows for sheet, rows in report.items() if len(rows)}
+
+
+def validate_legacy_format(df, sheet_name='Товары'):
+    """Проверка листа старой структуры (колонки уже приведены) без записи в БД; как validate_new_format."""
+    errors = _SheetErrors(df)
+    has_model = ~errors.blank('Модель')
+    errors.warn(_filled_rows(df) & ~has_model, 'не указана модель, строка пропущена')
+    errors.add(has_model & errors.blank('ID Модели'), 'не указан ID модели')
+    errors.add(has_model & errors.blank('Размер'), 'не указан размер')
+    # Формулы в «Цена» пересчитываются из «Цена Y», это не ошибка
+    errors.not_number('Цена', has_model & ~errors.text('Цена').str.startswith('='))
+    # «Цена Y» и «Количество» старый импорт читает и с десятичной запятой
+    errors.not_number('Цена Y', has_model, decimal_comma=True)
+    errors.negative('Количество', has_model, decimal_comma=True)
+    errors.duplicates(pd.DataFrame({
+        'model': errors.text('Модель').where(has_model),
+        'size': errors.text('Размер').where(~errors.blank('Размер')),
+    }), 'модели и размера')
+    rows = errors.report()
+    return {sheet_name: rows} if len(rows) else {}
+
+
+def report_counts(report):
+    """Отчёт validate_* -> (строк с ошибками, строк только с предупреждениями)."""
+    error_rows = sum(int((rows[ERRORS_COLUMN] != '').sum()) for rows in report.values())
+    total_rows = sum(len(rows) for rows in report.values())
+    return error_rows, total_rows - error_rows
+
+
+def error_workbook(report):
+    """Отчёт validate_* -> байты xlsx: по листу на проверенный лист, «Ошибки» и «Предупреждения» в конце."""
+    workbook = openpyxl.Workbook(write_only=True)
+    for sheet_name, rows in report.items():
+        sheet = workbook.create_sheet(sheet_name)
+        sheet.append([str(column) for column in rows.columns])
+        for values in rows.astype(object).where(rows.notna(), None).itertuples(index=False):
+            sheet.append(list(values))
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
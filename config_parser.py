@@ -21,7 +21,33 @@ class ConfigParser:
                 'user': 'root',
                 'password': '12345678',
                 'database': 'bridgeside_bot',
-                'port': 3306
+                'port': 3306,
+                'pool': {
+                    'min_size': 1,
+                    'max_size': 10,
+                    'timeout': 10,
+                    'recycle': 3600,
+                    'health_check_idle': 30,
+                    'keepalive_interval': 60
+                },
+                'replicas': [],
+                'replica_stickiness': 5,
+                'bulk_chunk_size': 1000,
+                'driver': 'pymysql',
+                'stream_chunk_size': 500,
+                'slow_query_ms': 200
+            },
+            'user_cache': {
+                'max_size': 5000,
+                'ttl': 300
+            },
+            'stats_buffer': {
+                'flush_interval': 5,
+                'max_entries': 500
+            },
+            'activity': {
+                'touch_interval': 300,
+                'max_tracked': 50000
             },
             'yadisk': {
                 'client_id': '',
@@ -32,12 +58,15 @@ class ConfigParser:
             }
         }
         self.__current_config = None
+        # Растёт при каждой загрузке/сохранении: по нему кэши понимают, что конфиг изменился
+        self.__version = 0
         self.load_conf()
 
     def load_conf(self):
         if os.path.exists(self.__file_path):
             with open(self.__file_path, 'r', encoding='utf-8') as file:
                 self.__current_config = json.loads(file.read())
+            self.__version += 1
             if len(self.__current_config['tg_api']) == 0:
                 sys.exit('config is invalid')
         else:
@@ -50,11 +79,16 @@ class ConfigParser:
 
     def get_config(self):
         return self.__current_config
+
+    @property
+    def version(self):
+        return self.__version
     
     def save_config(self):
         """Сохранить текущую конфигурацию в файл"""
         with open(self.__file_path, 'w', encoding='utf-8') as file:
             file.write(json.dumps(self.__current_config, sort_keys=True, indent=4))
+        self.__version += 1
     
     def update_yadisk_tokens(self, access_token, refresh_token, expires_in):
         """Обновить токены Яндекс.Диска в конфигурации"""
@@ -1,136 +1,803 @@
 import os
+import re
 import pymysql
 import time
-from threading import Lock
+from collections import deque
+from collections.abc import Mapping
+from contextlib import contextmanager
+from itertools import cycle, islice
+from threading import Condition, Event, Lock, Thread, local
 from datetime import datetime
 import logging
 from logging_config import get_logger, log_error, log_info
 
 # Настройка логирования
 logger = get_logger('db')
+# Медленные запросы пишутся в отдельный файл (см. logging_config)
+slow_logger = get_logger('db.slow')
+
+# Коды ошибок MySQL, означающие потерю соединения
+DISCONNECT_ERRORS = (2006, 2013, 2014, 2017, 2055)
+# Deadlock (1213) и таймаут ожидания блокировки (1205): транзакцию можно повторить целиком
+RETRYABLE_TRANSACTION_ERRORS = (1205, 1213)
+
+# Вторичные индексы: (таблица, имя индекса, колонки). У каждой миграции индексов
+# свой неизменный список: миграция может ссылаться только на колонки, которые
+# уже есть к её версии.
+# Миграция 5: горячие запросы каталога, заказов и отзывов
+HOT_QUERY_INDEXES = (
+    ('product_variations', 'idx_variations_product_size', ('product_id', 'size')),
+    ('product_variations', 'idx_variations_model_id', ('model_id',)),
+    ('products', 'idx_products_table_id', ('table_id',)),
+    ('products', 'idx_products_category', ('category',)),
+    ('orders_detailed', 'idx_orders_detailed_user_created', ('user_id', 'created_at')),
+    ('reviews', 'idx_reviews_created_at', ('created_at',)),
+)
+# Миграция 6: статистика для админов
+STATS_INDEXES = (
+    ('orders_detailed', 'idx_orders_detailed_created_at', ('created_at',)),
+    ('orders_detailed', 'idx_orders_detailed_status', ('status',)),
+    ('users', 'idx_users_last_active', ('last_active',)),
+)
+# Миграция 8: рефералы (users.referral_count появляется в миграции 7)
+REFERRAL_INDEXES = (
+    ('referrals', 'idx_referrals_referrer', ('referrer_id',)),
+    ('users', 'idx_users_referral_count', ('referral_count', 'user_id')),
+)
+# Все индексы актуальной схемы — для check_indexes
+SECONDARY_INDEXES = HOT_QUERY_INDEXES + STATS_INDEXES + REFERRAL_INDEXES
+
+# Реестр миграций схемы: (версия, описание, метод DB). Новые миграции — только в конец.
+MIGRATIONS = (
+    (1, 'Базовые таблицы', 'create_tables'),
+    (2, 'orders_detailed: admin_message_id, admin_topic_id', 'migrate_orders_detailed_table'),
+    (3, 'users: last_active, achievements TEXT NULL', 'migrate_users_table'),
+    (4, 'products: description_full, table_id, keywords', 'migrate_products_table'),
+    (5, 'Вторичные индексы для горячих запросов', 'migrate_hot_query_indexes'),
+    (6, 'Индексы для статистики: orders_detailed.created_at/status, users.last_active', 'migrate_stats_indexes'),
+    (7, 'users: referral_count (счётчик рефералов)', 'migrate_referral_count'),
+    (8, 'Индексы для рефералов: referrals.referrer_id, users.referral_count', 'migrate_referral_indexes'),
+)
+
+
+class PoolTimeoutError(pymysql.Error):
+    """Не удалось получить соединение из пула за отведённое время."""
+
+
+class TransactionNotStarted(pymysql.OperationalError):
+    """Соединение разорвано до первого запроса транзакции; её можно безопасно повторить."""
+
+
+class Row(Mapping):
+    """Строка результата: кортеж значений драйвера и общий для выборки индекс колонок.
+
+    Имя колонки переводится в позицию только при обращении, поэтому на каждую
+    строку не создаётся dict. Поддерживает row['name'], row.get(), row[0].
+    """
+
+    __slots__ = ('_values', '_index')
+
+    def __init__(self, values, index):
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._values[key]
+        return self._values[self._index[key]]
+
+    def get(self, key, default=None):
+        position = self._index.get(key)
+        return default if position is None else self._values[position]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return f"Row({dict(self.items())!r})"
+
+
+def row_index(description):
+    """Строит индекс колонка -> позиция по cursor.description."""
+    index = {}
+    for position, column in enumerate(description or ()):
+        # При совпадении имён (SELECT r.*, u.* ...) остаётся первая колонка
+        index.setdefault(column[0], position)
+    return index
+
+
+def fetch_rows(cursor, rows=None):
+    """Оборачивает кортежи из курсора в Row с общим индексом колонок."""
+    if rows is None:
+        rows = cursor.fetchall()
+    if not cursor.description:
+        return []
+    index = row_index(cursor.description)
+    return [Row(values, index) for values in rows]
+
+
+class PyMySQLDriver:
+    """Драйвер на чистом Python (pymysql), используется по умолчанию."""
+
+    name = 'pymysql'
+    Error = pymysql.Error
+    OperationalError = pymysql.OperationalError
+    ProgrammingError = pymysql.ProgrammingError
+
+    def connect(self, host, user, password, port, database=None, timeout=10, autocommit=True):
+        kwargs = {
+            'host': host,
+            'user': user,
+            'password': password,
+            'port': int(port),
+            'charset': 'utf8mb4',
+            # Строки приходят кортежами и оборачиваются в Row
+            'cursorclass': pymysql.cursors.Cursor,
+            'connect_timeout': timeout,
+            'read_timeout': timeout,
+            'write_timeout': timeout,
+            'autocommit': autocommit,
+        }
+        if database:
+            kwargs['database'] = database
+        return pymysql.connect(**kwargs)
+
+    def ping(self, conn):
+        conn.ping(reconnect=False)
+
+    def streaming_cursor(self, conn):
+        """Небуферизованный курсор: строки читаются с сервера по мере fetchmany."""
+        return conn.cursor(pymysql.cursors.SSCursor)
+
+
+class MySQLClientDriver:
+    """C-драйвер mysqlclient (MySQLdb); устанавливается отдельно: pip install mysqlclient."""
+
+    name = 'mysqlclient'
+
+    def __init__(self):
+        try:
+            import MySQLdb
+            import MySQLdb.cursors
+        except ImportError as e:
+            raise RuntimeError("Драйвер mysqlclient не установлен: pip install mysqlclient") from e
+        self.__module = MySQLdb
+        self.Error = (MySQLdb.Error, PoolTimeoutError, TransactionNotStarted)
+        self.OperationalError = (MySQLdb.OperationalError, TransactionNotStarted)
+        self.ProgrammingError = MySQLdb.ProgrammingError
+
+    def connect(self, host, user, password, port, database=None, timeout=10, autocommit=True):
+        kwargs = {
+            'host': host,
+            'user': user,
+            'passwd': password,
+            'port': int(port),
+            'charset': 'utf8mb4',
+            'connect_timeout': timeout,
+            'read_timeout': timeout,
+            'write_timeout': timeout,
+            'autocommit': autocommit,
+        }
+        if database:
+            kwargs['db'] = database
+        return self.__module.connect(**kwargs)
+
+    def ping(self, conn):
+        # В mysqlclient ping() не принимает reconnect по имени
+        conn.ping()
+
+    def streaming_cursor(self, conn):
+        """Небуферизованный курсор: строки читаются с сервера по мере fetchmany."""
+        return conn.cursor(self.__module.cursors.SSCursor)
+
+
+DRIVERS = {
+    PyMySQLDriver.name: PyMySQLDriver,
+    MySQLClientDriver.name: MySQLClientDriver,
+}
+
+
+def get_driver(name):
+    """Возвращает драйвер MySQL по имени из конфигурации."""
+    try:
+        return DRIVERS[name or PyMySQLDriver.name]()
+    except KeyError:
+        raise ValueError(f"Неизвестный драйвер MySQL: {name}. Доступны: {', '.join(DRIVERS)}")
+
+
+class PooledConnection:
+    """Соединение из пула вместе с его служебными метками времени."""
+
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+# Нормализация SQL в отпечаток: литералы и параметры -> ?, списки значений -> (?+).
+# Кавычка внутри строки экранируется и обратной косой чертой, и удвоением ('it''s')
+FINGERPRINT_RULES = (
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), '?'),
+    (re.compile(r'"(?:[^"\\]|\\.|"")*"'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\s+'), ' '),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?+)'),
+    (re.compile(r'\(\?\+\)(?:\s*,\s*\(\?\+\))+'), '(?+)'),
+)
+
+
+def fingerprint(query):
+    """Приводит запрос к отпечатку: одинаковые запросы с разными параметрами совпадают."""
+    for pattern, replacement in FINGERPRINT_RULES:
+        query = pattern.sub(replacement, query)
+    return query.strip()
+
+
+class QueryStat:
+    """Накопленная статистика одного отпечатка запроса."""
+
+    __slots__ = ('calls', 'errors', 'total', 'max', 'rows', 'wait', 'samples')
+
+    def __init__(self, samples):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.wait = 0.0
+        # Последние замеры для перцентилей; память на отпечаток ограничена
+        self.samples = deque(maxlen=samples)
+
+
+class QueryStats:
+    """Время выполнения запросов по отпечаткам и журнал медленных запросов.
+
+    wait — ожидание свободного соединения из пула. Ожидание блокировок строк
+    InnoDB (SELECT ... FOR UPDATE в транзакциях) входит во время самого запроса.
+    """
+
+    # Сколько текстов запросов держать в кэше отпечатков
+    MAX_CACHED_FINGERPRINTS = 2048
+
+    def __init__(self, slow_query_ms=200, samples=256):
+        self.__slow_query_ms = slow_query_ms
+        self.__samples = samples
+        self.__lock = Lock()
+        self.__stats = {}
+        self.__fingerprints = {}
+        self.__since = datetime.now()
+
+    def __fingerprint(self, query):
+        # Почти все запросы — строковые константы из DbAct: нормализуем один раз
+        key = self.__fingerprints.get(query)
+        if key is None:
+            key = fingerprint(query)
+            if len(self.__fingerprints) >= self.MAX_CACHED_FINGERPRINTS:
+                self.__fingerprints.clear()
+            self.__fingerprints[query] = key
+        return key
+
+    def record(self, query, elapsed, rows=0, wait=0.0, error=False):
+        """Учитывает один запрос; elapsed и wait в секундах."""
+        key = self.__fingerprint(query)
+        with self.__lock:
+            stat = self.__stats.get(key)
+            if stat is None:
+                stat = self.__stats[key] = QueryStat(self.__samples)
+            stat.calls += 1
+            stat.errors += bool(error)
+            stat.total += elapsed
+            stat.max = max(stat.max, elapsed)
+            stat.rows += rows or 0
+            stat.wait += wait
+            stat.samples.append(elapsed)
+        elapsed_ms = elapsed * 1000
+        if self.__slow_query_ms and elapsed_ms >= self.__slow_query_ms:
+            slow_logger.warning(
+                f"{elapsed_ms:.1f} мс, строк: {rows or 0}, ожидание соединения: {wait * 1000:.1f} мс"
+                f"{', ошибка' if error else ''} | {key}"
+            )
+
+    def top(self, limit=10, order_by='total_ms'):
+        """Топ отпечатков по полю order_by (total_ms, avg_ms, p95_ms, max_ms, calls, rows, wait_ms)."""
+        with self.__lock:
+            snapshot = [(key, stat.calls, stat.errors, stat.total, stat.max, stat.rows, stat.wait,
+                         sorted(stat.samples)) for key, stat in self.__stats.items()]
+        result = []
+        for key, calls, errors, total, max_elapsed, rows, wait, samples in snapshot:
+            result.append({
+                'fingerprint': key,
+                'calls': calls,
+                'errors': errors,
+                'total_ms': total * 1000,
+                'avg_ms': total * 1000 / calls,
+                'p50_ms': self.__percentile(samples, 50),
+                'p95_ms': self.__percentile(samples, 95),
+                'p99_ms': self.__percentile(samples, 99),
+                'max_ms': max_elapsed * 1000,
+                'rows': rows,
+                'wait_ms': wait * 1000,
+            })
+        result.sort(key=lambda item: item.get(order_by, 0), reverse=True)
+        return result[:limit]
+
+    @staticmethod
+    def __percentile(samples, percent):
+        if not samples:
+            return 0.0
+        position = min(len(samples) - 1, int(round(percent / 100 * (len(samples) - 1))))
+        return samples[position] * 1000
+
+    def reset(self):
+        with self.__lock:
+            self.__stats.clear()
+            self.__since = datetime.now()
+
+    @property
+    def since(self):
+        return self.__since
+
+
+class ConnectionPool:
+    """Ограниченный пул соединений с MySQL.
+
+    Держит от min_size до max_size соединений, выдаёт их потокам по одному
+    и пересоздаёт соединения старше recycle секунд. Собирает статистику
+    ожидания и занятости для подбора размера пула.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=10, recycle=3600, ping=None):
+        self.__connect = connect
+        self.__ping = ping or (lambda conn: conn.ping())
+        self.__min_size = max(0, int(min_size))
+        self.__max_size = max(1, int(max_size), self.__min_size)
+        self.__timeout = timeout
+        self.__recycle = recycle
+        self.__cond = Condition(Lock())
+        self.__idle = deque()
+        self.__size = 0
+        self.__in_use = 0
+        self.__closed = False
+        self.__stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+            'peak_in_use': 0,
+            'opened': 0,
+            'recycled': 0,
+            'discarded': 0,
+        }
+        self.fill()
+
+    def fill(self):
+        """Открывает соединения до минимального размера пула."""
+        while True:
+            with self.__cond:
+                if self.__closed or self.__size >= self.__min_size:
+                    return
+                self.__size += 1
+            try:
+                entry = self.__open()
+            except Exception:
+                with self.__cond:
+                    self.__size -= 1
+                    self.__cond.notify()
+                raise
+            with self.__cond:
+                self.__idle.append(entry)
+                self.__cond.notify()
+
+    def __open(self):
+        entry = PooledConnection(self.__connect())
+        with self.__cond:
+            self.__stats['opened'] += 1
+        return entry
+
+    def acquire(self, timeout=None):
+        """Выдаёт соединение из пула, при необходимости ожидая освобождения."""
+        timeout = self.__timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+        entry = None
+        with self.__cond:
+            while True:
+                if self.__closed:
+                    raise PoolTimeoutError("Пул соединений закрыт")
+                if self.__idle:
+                    entry = self.__idle.pop()
+                    break
+                if self.__size < self.__max_size:
+                    self.__size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.__stats['timeouts'] += 1
+                    raise PoolTimeoutError(
+                        f"Нет свободных соединений в пуле за {timeout}s "
+                        f"(занято {self.__in_use}/{self.__max_size})"
+                    )
+                waited = True
+                self.__cond.wait(remaining)
+
+            self.__in_use += 1
+            wait_time = time.monotonic() - started
+            self.__stats['checkouts'] += 1
+            self.__stats['wait_total'] += wait_time
+            self.__stats['wait_max'] = max(self.__stats['wait_max'], wait_time)
+            self.__stats['peak_in_use'] = max(self.__stats['peak_in_use'], self.__in_use)
+            if waited:
+                self.__stats['waits'] += 1
+
+        try:
+            if entry is None:
+                entry = self.__open()
+            elif self.__recycle and time.monotonic() - entry.created_at > self.__recycle:
+                entry.close()
+                entry = self.__open()
+                with self.__cond:
+                    self.__stats['recycled'] += 1
+        except Exception:
+            with self.__cond:
+                self.__size -= 1
+                self.__in_use -= 1
+                self.__cond.notify()
+            raise
+        return entry
+
+    def release(self, entry, discard=False):
+        """Возвращает соединение в пул; сломанные соединения закрываются."""
+        entry.last_used = time.monotonic()
+        with self.__cond:
+            self.__in_use -= 1
+            if discard or self.__closed:
+                self.__size -= 1
+                if discard:
+                    self.__stats['discarded'] += 1
+            else:
+                self.__idle.append(entry)
+                entry = None
+            self.__cond.notify()
+        if entry is not None:
+            entry.close()
+
+    def replace(self, entry):
+        """Закрывает сломанное соединение и открывает вместо него новое.
+
+        Если новое соединение открыть не удалось, вызывающий код должен вернуть
+        старое через release(): оно уже закрыто и будет выброшено из пула.
+        """
+        entry.close()
+        fresh = self.__open()
+        with self.__cond:
+            self.__stats['discarded'] += 1
+        return fresh
+
+    def ping_idle(self, idle_after):
+        """Пингует свободные соединения, простаивающие дольше idle_after секунд.
+
+        Пока идёт пинг, соединения изъяты из очереди свободных, но учитываются
+        в размере пула. Мёртвые соединения закрываются и выбрасываются.
+        """
+        now = time.monotonic()
+        with self.__cond:
+            if self.__closed:
+                return 0, 0
+            stale = [entry for entry in self.__idle if now - entry.last_used >= idle_after]
+            for entry in stale:
+                self.__idle.remove(entry)
+
+        alive = []
+        broken = 0
+        for entry in stale:
+            try:
+                self.__ping(entry.conn)
+                entry.last_used = time.monotonic()
+                alive.append(entry)
+            except Exception:
+                entry.close()
+                broken += 1
+
+        with self.__cond:
+            # Проверенные соединения ставим в начало: горячие остаются справа
+            self.__idle.extendleft(alive)
+            self.__size -= broken
+            self.__stats['discarded'] += broken
+            self.__cond.notify_all()
+        return len(alive), broken
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Контекстный менеджер: соединение возвращается в пул при выходе."""
+        entry = self.acquire(timeout)
+        try:
+            yield entry
+        finally:
+            self.release(entry, discard=not getattr(entry.conn, 'open', True))
+
+    def stats(self):
+        """Снимок занятости пула и времени ожидания соединений."""
+        with self.__cond:
+            checkouts = self.__stats['checkouts']
+            return {
+                'size': self.__size,
+                'idle': len(self.__idle),
+                'in_use': self.__in_use,
+                'min_size': self.__min_size,
+                'max_size': self.__max_size,
+                'peak_in_use': self.__stats['peak_in_use'],
+                'checkouts': checkouts,
+                'waits': self.__stats['waits'],
+                'timeouts': self.__stats['timeouts'],
+                'avg_wait_ms': (self.__stats['wait_total'] / checkouts * 1000) if checkouts else 0.0,
+                'max_wait_ms': self.__stats['wait_max'] * 1000,
+                'opened': self.__stats['opened'],
+                'recycled': self.__stats['recycled'],
+                'discarded': self.__stats['discarded'],
+            }
+
+    def close(self):
+        """Закрывает все свободные соединения; занятые закроются при возврате."""
+        with self.__cond:
+            self.__closed = True
+            idle = list(self.__idle)
+            self.__idle.clear()
+            self.__size -= len(idle)
+            self.__cond.notify_all()
+        for entry in idle:
+            entry.close()
+
+
+class Transaction:
+    """Запросы внутри одной транзакции на закреплённом соединении.
+
+    Ошибки не глушатся: они пробрасываются в DB.transaction(), который
+    откатывает транзакцию.
+    """
+
+    def __init__(self, conn, stats=None):
+        self.__conn = conn
+        self.__stats = stats
+        self.__started = False
+        self.__committing = False
+
+    @property
+    def retry_safe(self):
+        """Ни один запрос ещё не выполнен и commit не начат: транзакцию можно повторить."""
+        return not self.__started and not self.__committing
+
+    def mark_committing(self):
+        self.__committing = True
+
+    def __execute(self, cursor, query, params, many=False):
+        started = time.monotonic()
+        failed = True
+        try:
+            if many:
+                cursor.executemany(query, params)
+            else:
+                cursor.execute(query, params)
+            failed = False
+            self.__started = True
+        finally:
+            if self.__stats is not None:
+                self.__stats.record(query, time.monotonic() - started,
+                                    rows=0 if failed else cursor.rowcount, error=failed)
+
+    def read(self, query, args=()):
+        with self.__conn.cursor() as cursor:
+            self.__execute(cursor, query, args)
+            return fetch_rows(cursor)
+
+    def read_one(self, query, args=()):
+        rows = self.read(query, args)
+        return rows[0] if rows else None
+
+    def write(self, query, params=None):
+        with self.__conn.cursor() as cursor:
+            self.__execute(cursor, query, params)
+            return cursor.rowcount
+
+    def insert(self, query, params=None):
+        """Выполняет INSERT и возвращает AUTO_INCREMENT id."""
+        with self.__conn.cursor() as cursor:
+            self.__execute(cursor, query, params)
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def write_many(self, query, params_seq):
+        params_seq = list(params_seq)
+        if not params_seq:
+            return 0
+        with self.__conn.cursor() as cursor:
+            self.__execute(cursor, query, params_seq, many=True)
+            return cursor.rowcount
+
 
 class DB:
-    def __init__(self, host, user, password, database, port=3306, lock=None):
+    def __init__(self, host, user, password, database, port=3306,
+                 pool_min_size=1, pool_max_size=10, pool_timeout=10, pool_recycle=3600,
+                 health_check_idle=30, keepalive_interval=60,
+                 replicas=None, replica_stickiness=5, bulk_chunk_size=1000, driver='pymysql',
+                 stream_chunk_size=500, slow_query_ms=200):
         super(DB, self).__init__()
-        self.__lock = lock or Lock()
+        self.__driver = get_driver(driver)
         self.__host = host
         self.__user = user
         self.__password = password
         self.__database = database
         self.__port = port
-        self.__cursor = None
-        self.__db = None
+        self.__pool_options = {
+            'min_size': pool_min_size,
+            'max_size': pool_max_size,
+            'timeout': pool_timeout,
+            'recycle': pool_recycle,
+            'ping': self.__driver.ping,
+        }
+        self.__pool = None
+        # Соединения, простаивавшие дольше health_check_idle секунд, пингуются перед выдачей
+        self.__health_check_idle = health_check_idle
+        self.__keepalive_interval = keepalive_interval
+        self.__keepalive_stop = Event()
+        self.__keepalive_thread = None
+        # Реплики для чтения: список dict с host/port (user/password/database — как у primary)
+        self.__replicas = [r for r in (replicas or []) if isinstance(r, dict) and r.get('host')]
+        self.__replica_pools = []
+        self.__replica_cycle = None
+        # Сколько секунд после записи поток читает с primary (read-your-writes)
+        self.__replica_stickiness = replica_stickiness
+        self.__local = local()
+        # Размер чанка по умолчанию для db_write_many
+        self.__bulk_chunk_size = bulk_chunk_size
+        # Сколько строк за раз забирает db_read_iter
+        self.__stream_chunk_size = stream_chunk_size
+        self.__query_stats = QueryStats(slow_query_ms)
         self.init()
 
     def init(self):
         try:
-            # Убеждаемся, что база данных существует
-            self.__ensure_database()
+            try:
+                self.__pool = ConnectionPool(self._connect, **self.__pool_options)
+                self.migrate()
+            except self.__driver.OperationalError as e:
+                # 1049: Unknown database — создаём базу и пробуем ещё раз
+                if not (e.args and e.args[0] == 1049):
+                    raise
+                if self.__pool:
+                    self.__pool.close()
+                self.__create_database()
+                self.__pool = ConnectionPool(self._connect, **self.__pool_options)
+                self.migrate()
+            self.check_indexes()
 
-            self.__db = self._connect()
-            self.__cursor = self.__db.cursor()
+            self.__init_replicas()
+            self.__start_keepalive()
             
-            # Создание таблиц
-            self.create_tables()
-            self.migrate_tables()
-            
-        except pymysql.Error as e:
+        except self.__driver.Error as e:
             log_error(logger, e, "Ошибка подключения к MySQL")
             raise
 
-    def _connect(self):
-        """Создает новое соединение с БД."""
-        return pymysql.connect(
-            host=self.__host,
-            user=self.__user,
-            password=self.__password,
-            database=self.__database,
-            port=self.__port,
-            charset='utf8mb4',
-            cursorclass=pymysql.cursors.DictCursor,
-            connect_timeout=10,
-            read_timeout=10,
-            write_timeout=10,
-            autocommit=False,
+    def _connect(self, host=None, port=None, user=None, password=None, database=None):
+        """Создает новое соединение с БД (по умолчанию — с primary)."""
+        # Соединения переиспользуются пулом: без autocommit читающее соединение
+        # держало бы старый снимок InnoDB и не видело чужих записей
+        return self.__driver.connect(
+            host=host or self.__host,
+            user=user or self.__user,
+            password=password if password is not None else self.__password,
+            database=database or self.__database,
+            port=port or self.__port,
+            autocommit=True,
         )
 
-    def ensure_connection(self):
-        """Проверяет соединение и восстанавливает при необходимости."""
-        try:
-            if self.__db is None:
-                self.__db = self._connect()
-                self.__cursor = self.__db.cursor()
-                return
-            # ping с авто-реконнектом
-            self.__db.ping(reconnect=True)
-            # если курсор закрыт — пересоздаем
-            try:
-                self.__cursor.execute("SELECT 1")
-            except Exception:
-                self.__cursor = self.__db.cursor()
-        except pymysql.Error as _:
-            # жесткий реконнект
+    @property
+    def driver_name(self):
+        return self.__driver.name
+
+    def __init_replicas(self):
+        """Создаёт пулы соединений к репликам; недоступные реплики пропускаются."""
+        for replica in self.__replicas:
+            options = {key: replica.get(key) for key in ('host', 'port', 'user', 'password', 'database')}
             try:
-                if self.__cursor:
-                    try:
-                        self.__cursor.close()
-                    except Exception:
-                        pass
-                if self.__db:
-                    try:
-                        self.__db.close()
-                    except Exception:
-                        pass
-            finally:
-                self.__db = self._connect()
-                self.__cursor = self.__db.cursor()
+                pool = ConnectionPool(lambda options=options: self._connect(**options), **self.__pool_options)
+                self.__replica_pools.append(pool)
+                log_info(logger, f"Подключена реплика для чтения {options['host']}:{options['port'] or self.__port}")
+            except self.__driver.Error as e:
+                log_error(logger, e, f"Реплика {options['host']} недоступна, чтение пойдёт на primary")
+        if self.__replica_pools:
+            self.__replica_cycle = cycle(self.__replica_pools)
+
+    def __read_pool(self, primary=False):
+        """Выбирает пул для чтения: реплика, если поток недавно ничего не писал."""
+        if primary or self.__replica_cycle is None:
+            return self.__pool
+        last_write = getattr(self.__local, 'last_write', None)
+        if last_write is not None and time.monotonic() - last_write < self.__replica_stickiness:
+            return self.__pool
+        return next(self.__replica_cycle)
+
+    def ensure_connection(self, entry, pool=None):
+        """Проверяет соединение из пула, только если оно долго простаивало.
 
-    def __ensure_database(self):
-        """Проверяет доступность целевой БД; при отсутствии — создаёт с ретраями."""
-        # 1) Сначала пробуем подключиться напрямую к целевой базе — если уже есть, выходим
+        Недавно использованные соединения выдаются без проверки: разрыв
+        (2006/2013) ловится при выполнении запроса, и запрос повторяется
+        на новом соединении.
+        """
+        if time.monotonic() - entry.last_used < self.__health_check_idle:
+            return entry
         try:
-            test_conn = pymysql.connect(
-                host=self.__host,
-                user=self.__user,
-                password=self.__password,
-                database=self.__database,
-                port=self.__port,
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor,
-                connect_timeout=5,
-                read_timeout=5,
-                write_timeout=5,
-            )
-            try:
-                with test_conn.cursor() as cur:
-                    cur.execute("SELECT 1")
-                test_conn.commit()
-            finally:
-                test_conn.close()
+            self.__driver.ping(entry.conn)
+            return entry
+        except self.__driver.Error as _:
+            # жесткий реконнект
+            return (pool or self.__pool).replace(entry)
+
+    def __start_keepalive(self):
+        """Запускает фоновый поток, поддерживающий свободные соединения живыми."""
+        if not self.__keepalive_interval or self.__keepalive_thread is not None:
             return
-        except pymysql.OperationalError as e:
-            # 1049: Unknown database — нужно создать
-            if not (e.args and e.args[0] == 1049):
-                # Иные ошибки — пробрасываем (таймауты/аутентификация и т.п.)
-                log_error(logger, e, "Ошибка проверки существования базы данных")
-                raise
+        self.__keepalive_thread = Thread(target=self.__keepalive_loop, name='db-keepalive', daemon=True)
+        self.__keepalive_thread.start()
+
+    def __keepalive_loop(self):
+        while not self.__keepalive_stop.wait(self.__keepalive_interval):
+            try:
+                for pool in [self.__pool] + self.__replica_pools:
+                    alive, broken = pool.ping_idle(self.__keepalive_interval)
+                    if broken:
+                        log_info(logger, f"Keepalive: выброшено мёртвых соединений: {broken}, живых: {alive}")
+                    # Восполняем пул до минимума, если мёртвые соединения были выброшены
+                    pool.fill()
+            except Exception as e:
+                log_error(logger, e, "Ошибка keepalive соединений с БД")
+
+    def pool_stats(self):
+        """Статистика пула соединений (занятость и ожидание)."""
+        return self.__pool.stats() if self.__pool else {}
+
+    def replica_pool_stats(self):
+        """Статистика пулов реплик в порядке из конфигурации."""
+        return [pool.stats() for pool in self.__replica_pools]
+
+    def query_stats(self, limit=10, order_by='total_ms'):
+        """Топ запросов по отпечаткам (см. QueryStats.top)."""
+        return self.__query_stats.top(limit, order_by)
 
-        # 2) Создаём базу с ретраями, если её нет
+    def query_stats_since(self):
+        return self.__query_stats.since
+
+    def reset_query_stats(self):
+        self.__query_stats.reset()
+
+    def __create_database(self):
+        """Создаёт целевую БД с ретраями (вызывается, только если её нет)."""
         attempts = 5
         base_delay_seconds = 2
         last_err = None
         for attempt in range(1, attempts + 1):
             try:
-                tmp_conn = pymysql.connect(
+                tmp_conn = self.__driver.connect(
                     host=self.__host,
                     user=self.__user,
                     password=self.__password,
                     port=self.__port,
-                    charset='utf8mb4',
-                    cursorclass=pymysql.cursors.DictCursor,
-                    connect_timeout=10,
-                    read_timeout=10,
-                    write_timeout=10
+                    autocommit=False,
                 )
                 try:
                     with tmp_conn.cursor() as cur:
@@ -141,9 +808,9 @@ class DB:
                 finally:
                     tmp_conn.close()
                 return
-            except pymysql.OperationalError as e:
+            except self.__driver.OperationalError as e:
                 last_err = e
-                if e.args and e.args[0] in (2006, 2013, 2014, 2017, 2055):
+                if e.args and e.args[0] in DISCONNECT_ERRORS:
                     delay_seconds = base_delay_seconds * (2 ** (attempt - 1))
                     log_info(logger, f"Повторная попытка создания БД ({attempt}/{attempts}) через {delay_seconds}s из-за: {e}")
                     time.sleep(delay_seconds)
@@ -151,17 +818,62 @@ class DB:
                 else:
                     log_error(logger, e, "Ошибка создания базы данных")
                     raise
-            except pymysql.Error as e:
+            except self.__driver.Error as e:
                 log_error(logger, e, "Ошибка создания базы данных")
                 raise
         if last_err:
             log_error(logger, last_err, "Ошибка создания базы данных после ретраев")
             raise last_err
 
-    def create_tables(self):
+    def migrate(self):
+        """Применяет миграции из MIGRATIONS, которых ещё нет в schema_version.
+
+        При актуальной схеме на старте выполняется один запрос — чтение версии.
+        """
+        with self.__pool.connection() as entry:
+            conn = entry.conn
+            with conn.cursor() as cursor:
+                current = self.__schema_version(cursor)
+                pending = [migration for migration in MIGRATIONS if migration[0] > current]
+                if not pending:
+                    log_info(logger, f"Схема БД актуальна (версия {current})")
+                    return current
+
+                for version, description, method_name in pending:
+                    started = time.monotonic()
+                    getattr(self, method_name)(conn, cursor)
+                    cursor.execute(
+                        'INSERT INTO schema_version (version, description) VALUES (%s, %s)',
+                        (version, description)
+                    )
+                    conn.commit()
+                    log_info(logger, f"✅ Миграция {version} применена за {time.monotonic() - started:.2f}s: {description}")
+                    current = version
+                return current
+
+    def __schema_version(self, cursor):
+        """Текущая версия схемы; при первом запуске создаёт таблицу schema_version."""
+        try:
+            cursor.execute('SELECT MAX(version) AS version FROM schema_version')
+            rows = fetch_rows(cursor)
+            return (rows[0]['version'] if rows else None) or 0
+        except self.__driver.ProgrammingError as e:
+            # 1146: таблицы ещё нет — схема не версионировалась
+            if not (e.args and e.args[0] == 1146):
+                raise
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255),
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            ''')
+            return 0
+
+    def create_tables(self, conn, cursor):
         try:
             # Таблица users
-            self.__cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
                     user_id BIGINT PRIMARY KEY,
                     first_name VARCHAR(255),
@@ -182,7 +894,7 @@ class DB:
             ''')
             
             # Таблица products
-            self.__cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS products (
                     product_id INT AUTO_INCREMENT PRIMARY KEY,
                     name VARCHAR(255),
@@ -204,7 +916,7 @@ class DB:
             ''')
             
             # Таблица orders
-            self.__cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS orders (
                     order_id INT AUTO_INCREMENT PRIMARY KEY,
                     user_id BIGINT,
@@ -219,7 +931,7 @@ class DB:
             ''')
             
             # Таблица referrals
-            self.__cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS referrals (
                     referral_id INT AUTO_INCREMENT PRIMARY KEY,
                     referrer_id BIGINT,
@@ -231,7 +943,7 @@ class DB:
             ''')
             
             # Таблица reviews
-            self.__cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS reviews (
                     review_id INT AUTO_INCREMENT PRIMARY KEY,
                     user_id BIGINT,
@@ -243,7 +955,7 @@ class DB:
             ''')
             
             # Таблица product_variations
-            self.__cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS product_variations (
                     variation_id INT AUTO_INCREMENT PRIMARY KEY,
                     product_id INT,
@@ -260,7 +972,7 @@ class DB:
             ''')    
             
             # Таблица pending_reviews
-            self.__cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS pending_reviews (
                     review_id INT AUTO_INCREMENT PRIMARY KEY,
                     user_id BIGINT,
@@ -273,7 +985,7 @@ class DB:
             ''')
             
             # Таблица orders_detailed
-            self.__cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS orders_detailed (
                     order_id INT AUTO_INCREMENT PRIMARY KEY,
                     user_id BIGINT,
@@ -297,7 +1009,7 @@ class DB:
             ''')
             
             # Таблица achievements
-            self.__cursor.execute('''
+            cursor.execute('''
                 CREATE TABLE IF NOT EXISTS achievements (
                     achievement_id INT AUTO_INCREMENT PRIMARY KEY,
                     user_id BIGINT,
@@ -313,173 +1025,504 @@ class DB:
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
             ''')
             
-            self.__db.commit()
+            conn.commit()
             log_info(logger, "Таблицы успешно созданы/проверены")
             
-        except pymysql.Error as e:
+        except self.__driver.Error as e:
             log_error(logger, e, "Ошибка создания таблиц")
-            self.__db.rollback()
+            conn.rollback()
             raise
 
-    def migrate_tables(self):
-        self.migrate_orders_detailed_table()
-        self.migrate_users_table()
-        self.migrate_products_table()
-
-    def migrate_orders_detailed_table(self):
+    def migrate_orders_detailed_table(self, conn, cursor):
         try:
             # Проверяем существование колонок
-            self.__cursor.execute("""
+            cursor.execute("""
                 SELECT COLUMN_NAME 
                 FROM INFORMATION_SCHEMA.COLUMNS 
                 WHERE TABLE_NAME = 'orders_detailed' 
                 AND TABLE_SCHEMA = DATABASE()
             """)
-            columns = [row['COLUMN_NAME'] for row in self.__cursor.fetchall()]
+            columns = [row['COLUMN_NAME'] for row in fetch_rows(cursor)]
             
             if 'admin_message_id' not in columns:
-                self.__cursor.execute("ALTER TABLE orders_detailed ADD COLUMN admin_message_id BIGINT")
+                cursor.execute("ALTER TABLE orders_detailed ADD COLUMN admin_message_id BIGINT")
                 log_info(logger, "✅ Добавлена колонка admin_message_id")
             
             if 'admin_topic_id' not in columns:
-                self.__cursor.execute("ALTER TABLE orders_detailed ADD COLUMN admin_topic_id BIGINT")
+                cursor.execute("ALTER TABLE orders_detailed ADD COLUMN admin_topic_id BIGINT")
                 log_info(logger, "✅ Добавлена колонка admin_topic_id")
             
-            self.__db.commit()
+            conn.commit()
             
-        except pymysql.Error as e:
+        except self.__driver.Error as e:
             log_error(logger, e, "❌ Ошибка миграции orders_detailed")
-            self.__db.rollback()
+            conn.rollback()
+            raise
 
-    def migrate_users_table(self):
+    def migrate_users_table(self, conn, cursor):
         try:
-            self.__cursor.execute("""
+            cursor.execute("""
                 SELECT COLUMN_NAME 
                 FROM INFORMATION_SCHEMA.COLUMNS 
                 WHERE TABLE_NAME = 'users' 
                 AND TABLE_SCHEMA = DATABASE()
             """)
-            columns = [row['COLUMN_NAME'] for row in self.__cursor.fetchall()]
+            columns = [row['COLUMN_NAME'] for row in fetch_rows(cursor)]
             
             if 'last_active' not in columns:
-                self.__cursor.execute("ALTER TABLE users ADD COLUMN last_active TIMESTAMP NULL")
-                self.__db.commit()
+                cursor.execute("ALTER TABLE users ADD COLUMN last_active TIMESTAMP NULL")
+                conn.commit()
                 log_info(logger, "✅ Добавлена колонка last_active в users")
             
             # Убираем default у TEXT поля achievements, если он есть
             try:
-                self.__cursor.execute("ALTER TABLE users MODIFY achievements TEXT NULL")
-                self.__db.commit()
+                cursor.execute("ALTER TABLE users MODIFY achievements TEXT NULL")
+                conn.commit()
                 log_info(logger, "✅ Обновлена колонка achievements (TEXT без DEFAULT)")
             except Exception as _:
                 pass
                 
-        except pymysql.Error as e:
+        except self.__driver.Error as e:
             log_error(logger, e, "❌ Ошибка миграции users")
+            raise
 
-    def migrate_products_table(self):
+    def migrate_products_table(self, conn, cursor):
         try:
             # Проверяем существование колонок
-            self.__cursor.execute("""
+            cursor.execute("""
                 SELECT COLUMN_NAME 
                 FROM INFORMATION_SCHEMA.COLUMNS 
                 WHERE TABLE_NAME = 'products' 
                 AND TABLE_SCHEMA = DATABASE()
             """)
-            columns = [row['COLUMN_NAME'] for row in self.__cursor.fetchall()]
+            columns = [row['COLUMN_NAME'] for row in fetch_rows(cursor)]
             
             # Добавляем новые колонки, если их нет
             if 'description_full' not in columns:
-                self.__cursor.execute("ALTER TABLE products ADD COLUMN description_full TEXT NULL")
-                self.__db.commit()
+                cursor.execute("ALTER TABLE products ADD COLUMN description_full TEXT NULL")
+                conn.commit()
                 log_info(logger, "✅ Добавлена колонка description_full в products")
             
             if 'table_id' not in columns:
-                self.__cursor.execute("ALTER TABLE products ADD COLUMN table_id VARCHAR(100) NULL")
-                self.__db.commit()
+                cursor.execute("ALTER TABLE products ADD COLUMN table_id VARCHAR(100) NULL")
+                conn.commit()
                 log_info(logger, "✅ Добавлена колонка table_id в products")
             
             if 'keywords' not in columns:
-                self.__cursor.execute("ALTER TABLE products ADD COLUMN keywords TEXT NULL")
-                self.__db.commit()
+                cursor.execute("ALTER TABLE products ADD COLUMN keywords TEXT NULL")
+                conn.commit()
                 log_info(logger, "✅ Добавлена колонка keywords в products")
                 
-        except pymysql.Error as e:
+        except self.__driver.Error as e:
             log_error(logger, e, "❌ Ошибка миграции products")
+            raise
 
-    def db_write(self, query, params=None):
-        self.set_lock()
+    def migrate_referral_count(self, conn, cursor):
+        """Добавляет users.referral_count и заполняет его по таблице referrals."""
+        try:
+            cursor.execute("""
+                SELECT COLUMN_NAME 
+                FROM INFORMATION_SCHEMA.COLUMNS 
+                WHERE TABLE_NAME = 'users' 
+                AND TABLE_SCHEMA = DATABASE()
+            """)
+            columns = [row['COLUMN_NAME'] for row in fetch_rows(cursor)]
+
+            if 'referral_count' not in columns:
+                cursor.execute("ALTER TABLE users ADD COLUMN referral_count INT NOT NULL DEFAULT 0")
+                log_info(logger, "✅ Добавлена колонка referral_count в users")
+
+            cursor.execute("""
+                UPDATE users u
+                JOIN (SELECT referrer_id, COUNT(*) AS cnt FROM referrals GROUP BY referrer_id) r
+                    ON r.referrer_id = u.user_id
+                SET u.referral_count = r.cnt
+            """)
+            conn.commit()
+            log_info(logger, f"✅ referral_count заполнен, пользователей с рефералами: {cursor.rowcount}")
+        except self.__driver.Error as e:
+            log_error(logger, e, "❌ Ошибка миграции referral_count")
+            raise
+
+    def migrate_hot_query_indexes(self, conn, cursor):
+        self.migrate_indexes(conn, cursor, HOT_QUERY_INDEXES)
+
+    def migrate_stats_indexes(self, conn, cursor):
+        self.migrate_indexes(conn, cursor, STATS_INDEXES)
+
+    def migrate_referral_indexes(self, conn, cursor):
+        self.migrate_indexes(conn, cursor, REFERRAL_INDEXES)
+
+    def migrate_indexes(self, conn, cursor, indexes):
+        """Создаёт недостающие индексы из списка indexes."""
+        for table, index_name, columns in self.__find_missing_indexes(cursor, indexes):
+            try:
+                column_list = ', '.join(f"`{column}`" for column in columns)
+                cursor.execute(f"CREATE INDEX `{index_name}` ON `{table}` ({column_list})")
+                conn.commit()
+                log_info(logger, f"✅ Добавлен индекс {index_name} на {table}({', '.join(columns)})")
+            except self.__driver.Error as e:
+                log_error(logger, e, f"❌ Ошибка создания индекса {index_name}")
+                raise
+
+    def __find_missing_indexes(self, cursor, indexes=SECONDARY_INDEXES):
+        """Возвращает индексы из indexes, которых нет в схеме.
+
+        Индекс считается существующим, если на таблице есть любой индекс,
+        начинающийся с тех же колонок в том же порядке.
+        """
+        cursor.execute("""
+            SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME
+            FROM INFORMATION_SCHEMA.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE()
+            ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+        """)
+        existing = {}
+        for row in fetch_rows(cursor):
+            existing.setdefault((row['TABLE_NAME'], row['INDEX_NAME']), []).append(row['COLUMN_NAME'])
+
+        missing = []
+        for table, index_name, columns in indexes:
+            covered = any(
+                existing_table == table and tuple(existing_columns[:len(columns)]) == tuple(columns)
+                for (existing_table, _), existing_columns in existing.items()
+            )
+            if not covered:
+                missing.append((table, index_name, columns))
+        return missing
+
+    def check_indexes(self):
+        """Проверяет наличие вторичных индексов и пишет в лог недостающие."""
+        try:
+            with self.__pool.connection() as entry:
+                with entry.conn.cursor() as cursor:
+                    missing = self.__find_missing_indexes(cursor)
+        except self.__driver.Error as e:
+            log_error(logger, e, "❌ Ошибка проверки индексов")
+            return []
+        for table, index_name, columns in missing:
+            logger.warning(f"Отсутствует индекс {index_name} на {table}({', '.join(columns)})")
+        if not missing:
+            log_info(logger, "Все вторичные индексы на месте")
+        return missing
+
+    def __execute_write(self, query, params=None):
+        """Выполняет изменяющий запрос на primary; возвращает (rowcount, lastrowid)."""
+        entry = None
+        cursor = None
+        started = time.monotonic()
+        wait = 0.0
+        rows_affected = 0
+        failed = True
         try:
-            self.ensure_connection()
-            cursor = self.__db.cursor()
+            entry = self.__pool.acquire()
+            wait = time.monotonic() - started
+            entry = self.ensure_connection(entry)
+            cursor = entry.conn.cursor()
             try:
                 if params:
                     cursor.execute(query, params)
                 else:
                     cursor.execute(query)
-                self.__db.commit()
                 rows_affected = cursor.rowcount
+                failed = False
                 logger.debug(f"DB_WRITE: query='{query}', params={params}, rows_affected={rows_affected}")
-                return rows_affected
-            except pymysql.OperationalError as e:
+                return rows_affected, cursor.lastrowid
+            except self.__driver.OperationalError as e:
                 # Ошибки потери соединения: 2006 (MySQL server has gone away), 2013 (Lost connection during query)
-                if e.args and e.args[0] in (2006, 2013, 2014, 2017, 2055):
+                if e.args and e.args[0] in DISCONNECT_ERRORS:
                     log_info(logger, "Обнаружен разрыв соединения, выполняю реконнект и повтор" )
-                    self.ensure_connection()
-                    cursor = self.__db.cursor()
+                    entry = self.__pool.replace(entry)
+                    cursor = entry.conn.cursor()
                     if params:
                         cursor.execute(query, params)
                     else:
                         cursor.execute(query)
-                    self.__db.commit()
-                    return cursor.rowcount
+                    rows_affected = cursor.rowcount
+                    failed = False
+                    return rows_affected, cursor.lastrowid
                 raise
-        except pymysql.Error as e:
+        except self.__driver.Error as e:
             log_error(logger, e, f"Ошибка записи в БД. Query: {query}, Params: {params}")
-            try:
-                self.__db.rollback()
-            except Exception:
-                pass
-            return 0
+            return 0, None
         finally:
             try:
                 cursor.close()
             except Exception:
                 pass
-            self.realise_lock()
+            if entry is not None:
+                self.__release(entry)
+            self.__local.last_write = time.monotonic()
+            self.__query_stats.record(query, self.__local.last_write - started,
+                                      rows=rows_affected, wait=wait, error=failed)
 
-    def db_read(self, query, args=()):
-        self.set_lock()
+    def db_write(self, query, params=None):
+        rows_affected, _ = self.__execute_write(query, params)
+        return rows_affected
+
+    def db_insert(self, query, params=None):
+        """Выполняет INSERT и возвращает AUTO_INCREMENT id вставленной строки.
+
+        LAST_INSERT_ID() привязан к соединению, поэтому читать его отдельным
+        db_read нельзя: запрос может уйти на другое соединение из пула или на реплику.
+        """
+        rows_affected, last_id = self.__execute_write(query, params)
+        return last_id if rows_affected else None
+
+    def db_write_many(self, query, params_seq, chunk_size=None):
+        """Пакетная запись через executemany: одна транзакция на каждый чанк.
+
+        Для INSERT ... VALUES драйвер собирает чанк в один многострочный запрос.
+        Чанк с ошибкой откатывается целиком и пропускается; возвращает общее
+        число затронутых строк.
+        """
+        chunk_size = max(1, int(chunk_size or self.__bulk_chunk_size))
+        params_iter = iter(params_seq)
+        total = 0
+        entry = None
+        started = time.monotonic()
+        wait = 0.0
+        failed = False
         try:
-            self.ensure_connection()
+            entry = self.__pool.acquire()
+            wait = time.monotonic() - started
+            entry = self.ensure_connection(entry)
+            while True:
+                chunk = list(islice(params_iter, chunk_size))
+                if not chunk:
+                    break
+                for attempt in (1, 2):
+                    try:
+                        with entry.conn.cursor() as cursor:
+                            entry.conn.begin()
+                            cursor.executemany(query, chunk)
+                            entry.conn.commit()
+                            total += cursor.rowcount
+                        break
+                    except self.__driver.Error as e:
+                        try:
+                            entry.conn.rollback()
+                        except Exception:
+                            pass
+                        if attempt == 1 and isinstance(e, self.__driver.OperationalError) and e.args and e.args[0] in DISCONNECT_ERRORS:
+                            # Чанк откатился целиком, поэтому повтор безопасен
+                            log_info(logger, "Разрыв соединения при пакетной записи, реконнект и повтор чанка")
+                            entry = self.__pool.replace(entry)
+                            continue
+                        log_error(logger, e, f"Ошибка пакетной записи чанка из {len(chunk)} строк. Query: {query}")
+                        failed = True
+                        break
+            logger.debug(f"DB_WRITE_MANY: query='{query}', rows_affected={total}")
+            return total
+        except self.__driver.Error as e:
+            log_error(logger, e, f"Ошибка пакетной записи в БД. Query: {query}")
+            failed = True
+            return total
+        finally:
+            if entry is not None:
+                self.__release(entry)
+            self.__local.last_write = time.monotonic()
+            self.__query_stats.record(query, self.__local.last_write - started,
+                                      rows=total, wait=wait, error=failed)
+
+    @contextmanager
+    def transaction(self):
+        """Транзакция на одном соединении: commit при выходе, rollback при ошибке.
+
+        with db.transaction() as tx:
+            row = tx.read_one('SELECT ... FOR UPDATE', (...,))
+            tx.write('UPDATE ...', (...,))
+        """
+        entry = self.__pool.acquire()
+        broken = False
+        try:
+            entry = self.ensure_connection(entry)
+            tx = Transaction(entry.conn, self.__query_stats)
             try:
-                self.__cursor.execute(query, args)
-                return self.__cursor.fetchall()
-            except pymysql.OperationalError as e:
-                if e.args and e.args[0] in (2006, 2013, 2014, 2017, 2055):
-                    log_info(logger, "Разрыв соединения при чтении, реконнект и повтор")
-                    self.ensure_connection()
-                    self.__cursor.execute(query, args)
-                    return self.__cursor.fetchall()
+                entry.conn.begin()
+                yield tx
+                tx.mark_committing()
+                entry.conn.commit()
+            except BaseException as e:
+                broken = self.__is_disconnect(e)
+                if broken and tx.retry_safe:
+                    # Разрыв до первого запроса: run_transaction повторит на новом соединении
+                    raise TransactionNotStarted(*e.args) from e
+                if not broken:
+                    try:
+                        entry.conn.rollback()
+                    except Exception:
+                        pass
+                raise
+        finally:
+            self.__pool.release(entry, discard=broken or not getattr(entry.conn, 'open', True))
+            self.__local.last_write = time.monotonic()
+
+    def __is_disconnect(self, error):
+        return (
+            isinstance(error, self.__driver.OperationalError)
+            and bool(error.args) and error.args[0] in DISCONNECT_ERRORS
+        )
+
+    def run_transaction(self, func, retries=3):
+        """Выполняет func(tx) в транзакции и возвращает её результат.
+
+        При deadlock (1213) или таймауте блокировки (1205) транзакция
+        повторяется целиком, до retries попыток. Разрыв соединения (DISCONNECT_ERRORS)
+        повторяется, только если он случился до первого запроса: соединение
+        выбрасывается из пула и берётся новое. После начала commit повторов нет.
+        """
+        for attempt in range(1, retries + 1):
+            try:
+                with self.transaction() as tx:
+                    return func(tx)
+            except TransactionNotStarted as e:
+                if attempt < retries:
+                    log_info(logger, f"Разрыв соединения до начала транзакции ({attempt}/{retries}), повтор: {e}")
+                    continue
+                raise
+            except self.__driver.OperationalError as e:
+                if attempt < retries and e.args and e.args[0] in RETRYABLE_TRANSACTION_ERRORS:
+                    log_info(logger, f"Повтор транзакции ({attempt}/{retries}) из-за: {e}")
+                    time.sleep(0.05 * attempt)
+                    continue
                 raise
-        except pymysql.Error as e:
+
+    def db_read(self, query, args=(), primary=False):
+        """Выполняет SELECT; без primary=True запрос может уйти на реплику."""
+        pool = self.__read_pool(primary)
+        if pool is not self.__pool:
+            try:
+                return self.__execute_read(pool, query, args)
+            except self.__driver.Error as e:
+                log_error(logger, e, "Ошибка чтения с реплики, повтор на primary")
+        try:
+            return self.__execute_read(self.__pool, query, args)
+        except self.__driver.Error as e:
             log_error(logger, e, "❌ Ошибка чтения из БД")
             return []
+
+    def db_read_iter(self, query, args=(), chunk_size=None, primary=False):
+        """Потоково выполняет SELECT через небуферизованный курсор.
+
+        Строки забираются с сервера порциями по chunk_size и отдаются по одной,
+        поэтому память не растёт с размером выборки. Пока генератор не исчерпан
+        или не закрыт, он держит соединение из пула: читать нужно без долгих пауз.
+        """
+        chunk_size = max(1, int(chunk_size or self.__stream_chunk_size))
+        pool = self.__read_pool(primary)
+        opened = None
+        if pool is not self.__pool:
+            try:
+                opened = self.__open_stream(pool, query, args)
+            except self.__driver.Error as e:
+                log_error(logger, e, "Ошибка чтения с реплики, повтор на primary")
+        if opened is None:
+            pool = self.__pool
+            try:
+                opened = self.__open_stream(pool, query, args)
+            except self.__driver.Error as e:
+                log_error(logger, e, "❌ Ошибка чтения из БД")
+                return
+
+        entry, cursor, elapsed, wait = opened
+        finished = False
+        count = 0
+        try:
+            index = row_index(cursor.description)
+            while True:
+                started = time.monotonic()
+                rows = cursor.fetchmany(chunk_size)
+                # Время обработки строк вызывающим кодом в статистику не входит
+                elapsed += time.monotonic() - started
+                if not rows:
+                    break
+                count += len(rows)
+                for values in rows:
+                    yield Row(values, index)
+            finished = True
+        except self.__driver.Error as e:
+            # Часть строк уже отдана — повторять нельзя, вызывающий код должен узнать об обрыве
+            log_error(logger, e, "❌ Ошибка потокового чтения из БД")
+            raise
         finally:
-            self.realise_lock()
+            if finished:
+                try:
+                    cursor.close()
+                except Exception:
+                    finished = False
+            # Недочитанный или оборванный поток не переиспользуем: дочитывать
+            # остаток выборки ради возврата соединения в пул дороже, чем открыть новое
+            pool.release(entry, discard=not finished or not getattr(entry.conn, 'open', True))
+            self.__query_stats.record(query, elapsed, rows=count, wait=wait, error=not finished)
 
-    def set_lock(self):
-        self.__lock.acquire(True)
+    def __open_stream(self, pool, query, args=()):
+        started = time.monotonic()
+        entry = pool.acquire()
+        wait = time.monotonic() - started
+        try:
+            entry = self.ensure_connection(entry, pool)
+            cursor = self.__driver.streaming_cursor(entry.conn)
+            try:
+                cursor.execute(query, args)
+            except self.__driver.OperationalError as e:
+                if not (e.args and e.args[0] in DISCONNECT_ERRORS):
+                    raise
+                log_info(logger, "Разрыв соединения при чтении, реконнект и повтор")
+                entry = pool.replace(entry)
+                cursor = self.__driver.streaming_cursor(entry.conn)
+                cursor.execute(query, args)
+            return entry, cursor, time.monotonic() - started, wait
+        except BaseException:
+            self.__release(entry, pool)
+            self.__query_stats.record(query, time.monotonic() - started, wait=wait, error=True)
+            raise
+
+    def __execute_read(self, pool, query, args=()):
+        entry = None
+        cursor = None
+        started = time.monotonic()
+        wait = 0.0
+        rows = None
+        try:
+            entry = pool.acquire()
+            wait = time.monotonic() - started
+            entry = self.ensure_connection(entry, pool)
+            cursor = entry.conn.cursor()
+            try:
+                cursor.execute(query, args)
+                rows = fetch_rows(cursor)
+                return rows
+            except self.__driver.OperationalError as e:
+                if e.args and e.args[0] in DISCONNECT_ERRORS:
+                    log_info(logger, "Разрыв соединения при чтении, реконнект и повтор")
+                    entry = pool.replace(entry)
+                    cursor = entry.conn.cursor()
+                    cursor.execute(query, args)
+                    rows = fetch_rows(cursor)
+                    return rows
+                raise
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+            if entry is not None:
+                self.__release(entry, pool)
+            self.__query_stats.record(query, time.monotonic() - started, rows=len(rows or ()),
+                                      wait=wait, error=rows is None)
 
-    def realise_lock(self):
-        self.__lock.release()
+    def __release(self, entry, pool=None):
+        """Возвращает соединение в пул; закрытые соединения выбрасываются."""
+        (pool or self.__pool).release(entry, discard=not getattr(entry.conn, 'open', True))
 
     def close(self):
-        """Закрытие соединения с БД"""
-        if self.__cursor:
-            self.__cursor.close()
-        if self.__db:
-            self.__db.close()
+        """Закрытие всех соединений пула"""
+        self.__keepalive_stop.set()
+        for pool in self.__replica_pools:
+            pool.close()
+        if self.__pool:
+            self.__pool.close()
 
     def __del__(self):
-        self.close()
\ No newline at end of file
+        self.close()
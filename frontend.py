@@ -1,8 +1,9 @@
 from telebot import types
+from collections.abc import Mapping
 
 def get_product_field(product, field_name, default=None):
     """Получить поле продукта по имени для совместимости с MySQL"""
-    if isinstance(product, dict):
+    if isinstance(product, Mapping):
         return product.get(field_name, default)
     elif isinstance(product, (list, tuple)):
         # Маппинг полей для обратной совместимости
@@ -159,6 +160,16 @@ class Bot_inline_btns:
             markup.add(btn)
         return markup
     
+    def next_page_button(self, callback_data):
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("➡️ Следующая страница", callback_data=callback_data))
+        return markup
+
+    def import_job_buttons(self, job_id):
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("⛔️ Отменить импорт", callback_data=f"import_cancel_{job_id}"))
+        return markup
+
     def create_order_status_buttons(order_id):
         markup = types.InlineKeyboardMarkup(row_width=2)
         
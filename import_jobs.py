@@ -0,0 +1,231 @@
+"""Фоновые задачи импорта каталога.
+
+Загрузки из /upload_products выполняются по одной в отдельном потоке, поэтому
+polling-обработчики продолжают отвечать покупателям, пока большой лист читается
+и пишется в БД. У задачи есть номер, счётчики прогресса и отмена.
+"""
+import time
+from collections import OrderedDict, deque
+from threading import Condition, Event, Lock, Thread
+from catalog_import import ImportCancelled
+from logging_config import get_logger, log_error, log_info
+
+logger = get_logger('import_jobs')
+
+
+class ImportJobError(Exception):
+    """Импорт остановлен с понятной админу причиной (нет колонок, ошибка записи и т.п.)."""
+
+
+class ImportJob:
+    """Задача импорта. Счётчики меняет только поток воркера."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    def __init__(self, job_id, user_id, payload, on_change):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.payload = payload
+        # ID сообщения с прогрессом; заполняет on_progress при первом показе
+        self.message_id = None
+        self.status = self.QUEUED
+        self.stage = ''
+        self.rows = 0
+        self.products = 0
+        self.variations = 0
+        self.errors = []
+        self.result = None
+        self.started_at = None
+        self.finished_at = None
+        self.__on_change = on_change
+        self.__cancel = Event()
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED, self.CANCELLED)
+
+    @property
+    def cancel_requested(self):
+        return self.__cancel.is_set()
+
+    def cancel(self):
+        self.__cancel.set()
+
+    def check(self):
+        """Бросает ImportCancelled, если запрошена отмена."""
+        if self.__cancel.is_set():
+            raise ImportCancelled(f"Импорт #{self.job_id} отменён")
+
+    def set_stage(self, stage):
+        self.check()
+        self.stage = stage
+        self.__on_change(self, True)
+
+    def add_rows(self, count):
+        """progress-колбэк для catalog_import.read_sheet."""
+        self.rows += count
+        self.check()
+        self.__on_change(self, False)
+
+    def add_written(self, products, variations):
+        """progress-колбэк для DbAct.import_catalog / sync_catalog."""
+        self.products += products
+        self.variations += variations
+        self.check()
+        self.__on_change(self, False)
+
+    def add_error(self, message):
+        self.errors.append(message)
+        self.__on_change(self, False)
+
+
+class ImportJobQueue:
+    """Очередь задач импорта с одним фоновым воркером.
+
+    run(job) выполняет задачу и возвращает её результат (job.result). Прогресс
+    отдаётся в on_progress(job): при смене этапа и статуса сразу, между ними —
+    не чаще раза в progress_interval секунд, чтобы не упираться в лимиты Telegram.
+    """
+
+    MAX_FINISHED = 20
+
+    def __init__(self, run, on_progress=None, progress_interval=2.0):
+        self.__run = run
+        self.__on_progress = on_progress
+        self.__progress_interval = max(0.0, float(progress_interval))
+        self.__condition = Condition(Lock())
+        self.__queue = deque()
+        self.__jobs = OrderedDict()
+        self.__next_id = 1
+        self.__current = None
+        self.__last_report = 0.0
+        self.__stop = False
+        self.__thread = None
+
+    def submit(self, user_id, payload):
+        """Ставит задачу в очередь и возвращает её."""
+        with self.__condition:
+            if self.__stop:
+                raise RuntimeError("Очередь импорта остановлена")
+            job = ImportJob(self.__next_id, user_id, payload, self.__changed)
+            self.__next_id += 1
+            self.__jobs[job.job_id] = job
+        # Первый показ — до постановки в очередь, чтобы воркер не обогнал его
+        self.__report(job)
+        with self.__condition:
+            self.__queue.append(job)
+            if self.__thread is None:
+                self.__thread = Thread(target=self.__work_loop, name='catalog-import', daemon=True)
+                self.__thread.start()
+            self.__condition.notify()
+        log_info(logger, f"Импорт #{job.job_id} от {user_id} поставлен в очередь, перед ним: {len(self.__queue) - 1}")
+        return job
+
+    def get(self, job_id):
+        with self.__condition:
+            return self.__jobs.get(job_id)
+
+    def current(self):
+        with self.__condition:
+            return self.__current
+
+    def position(self, job):
+        """Место задачи в очереди (1 — следующая); 0, если она уже не ждёт."""
+        with self.__condition:
+            return self.__queue.index(job) + 1 if job in self.__queue else 0
+
+    def cancel(self, job_id):
+        """Отменяет задачу: ждущая снимается сразу, выполняемая — на ближайшей пачке.
+
+        Возвращает задачу или None, если её нет или она уже завершена.
+        """
+        with self.__condition:
+            job = self.__jobs.get(job_id)
+            if job is None or job.finished:
+                return None
+            job.cancel()
+            queued = job in self.__queue
+            if queued:
+                self.__queue.remove(job)
+                job.status = ImportJob.CANCELLED
+                job.finished_at = time.time()
+        if queued:
+            log_info(logger, f"Импорт #{job_id} отменён до запуска")
+            self.__report(job)
+        return job
+
+    def close(self, timeout=30):
+        """Отменяет ждущие и текущую задачи и дожидается остановки воркера."""
+        with self.__condition:
+            self.__stop = True
+            pending = list(self.__queue)
+            current = self.__current
+            self.__condition.notify_all()
+        for job in pending:
+            self.cancel(job.job_id)
+        if current is not None:
+            current.cancel()
+        if self.__thread is not None and self.__thread.is_alive():
+            self.__thread.join(timeout=timeout)
+
+    def __work_loop(self):
+        while True:
+            with self.__condition:
+                while not self.__queue and not self.__stop:
+                    self.__condition.wait()
+                if not self.__queue:
+                    return
+                job = self.__queue.popleft()
+                job.status = ImportJob.RUNNING
+                self.__current = job
+            self.__run_job(job)
+
+    def __run_job(self, job):
+        job.started_at = time.time()
+        self.__report(job)
+        try:
+            job.check()
+            job.result = self.__run(job)
+            job.status = ImportJob.DONE
+        except ImportCancelled:
+            job.status = ImportJob.CANCELLED
+        except ImportJobError as e:
+            job.errors.append(str(e))
+            job.status = ImportJob.FAILED
+        except Exception as e:
+            log_error(logger, e, f"Ошибка импорта #{job.job_id}")
+            job.errors.append(str(e))
+            job.status = ImportJob.FAILED
+        job.finished_at = time.time()
+        with self.__condition:
+            self.__current = None
+            self.__prune()
+        log_info(
+            logger,
+            f"Импорт #{job.job_id}: {job.status} за {job.finished_at - job.started_at:.1f} с, "
+            f"строк {job.rows}, товаров {job.products}, вариаций {job.variations}, ошибок {len(job.errors)}"
+        )
+        self.__report(job)
+
+    def __prune(self):
+        # Храним только последние завершённые задачи
+        finished = [job_id for job_id, job in self.__jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.MAX_FINISHED)]:
+            del self.__jobs[job_id]
+
+    def __changed(self, job, force):
+        if force or time.monotonic() - self.__last_report >= self.__progress_interval:
+            self.__report(job)
+
+    def __report(self, job):
+        self.__last_report = time.monotonic()
+        if self.__on_progress is None:
+            return
+        try:
+            self.__on_progress(job)
+        except Exception as e:
+            log_error(logger, e, f"Ошибка показа прогресса импорта #{job.job_id}")
@@ -50,6 +50,19 @@ def setup_logging():
     root_logger.addHandler(info_handler)
     root_logger.addHandler(console_handler)
     
+    # Отдельный файл для медленных SQL-запросов
+    slow_handler = logging.FileHandler(
+        os.path.join(log_dir, f"slow_queries_{datetime.now().strftime('%Y%m%d')}.log"),
+        encoding='utf-8'
+    )
+    slow_handler.setLevel(logging.WARNING)
+    slow_handler.setFormatter(formatter)
+    slow_logger = logging.getLogger('db.slow')
+    for handler in slow_logger.handlers[:]:
+        slow_logger.removeHandler(handler)
+    slow_logger.addHandler(slow_handler)
+    slow_logger.propagate = False
+    
     # Настройка логгеров для конкретных модулей
     setup_module_loggers()
     
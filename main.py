@@ -3,22 +3,31 @@ import telebot
 import os
 import traceback
 import re
+import io
 import json
 import threading
 import platform
 import logging
 import pandas as pd
+import openpyxl
 import requests
 import urllib.parse
 import pathlib
 import shutil
 import time
-from threading import Lock
+import itertools
+from collections import OrderedDict
+from collections.abc import Mapping
 from datetime import datetime, timedelta
 from config_parser import ConfigParser
 from frontend import Bot_inline_btns
 from telebot import types
 from backend import DbAct
+from catalog_import import (
+    ECONOMICS_COLUMNS, KEYS_COLUMNS, error_workbook, is_workbook_name, normalize_legacy_format,
+    normalize_new_format, open_workbook, read_sheet, report_counts, validate_legacy_format, validate_new_format
+)
+from import_jobs import ImportJob, ImportJobError, ImportJobQueue
 from db import DB
 from logging_config import setup_logging, get_logger, log_error, log_info
 
@@ -51,15 +60,31 @@ try:
         # Если по ошибке указан 8000, заменим на 3306
         port = 3306 if str(port_raw) == '8000' else port_raw
 
+    pool_config = mysql_config.get('pool', {}) or {}
     db = DB(
         host=host,
         user=mysql_config.get('user', 'root'),
         password=mysql_config.get('password', '12345678'),
         database=mysql_config.get('database', 'bridgeside_bot'),
         port=port,
-        lock=Lock()
+        pool_min_size=pool_config.get('min_size', 1),
+        pool_max_size=pool_config.get('max_size', 10),
+        pool_timeout=pool_config.get('timeout', 10),
+        pool_recycle=pool_config.get('recycle', 3600),
+        health_check_idle=pool_config.get('health_check_idle', 30),
+        keepalive_interval=pool_config.get('keepalive_interval', 60),
+        replicas=mysql_config.get('replicas', []),
+        replica_stickiness=mysql_config.get('replica_stickiness', 5),
+        bulk_chunk_size=mysql_config.get('bulk_chunk_size', 1000),
+        driver=mysql_config.get('driver', 'pymysql'),
+        stream_chunk_size=mysql_config.get('stream_chunk_size', 500),
+        slow_query_ms=mysql_config.get('slow_query_ms', 200)
     )
     db_actions = DbAct(db, config, config_data['xlsx_path'])
+    # Middleware track_user_activity держит users.last_active актуальным: на нём
+    # считается «активных за 24 ч» в статистике админа. Без него last_active
+    # менялся бы только при регистрации
+    telebot.apihelper.ENABLE_MIDDLEWARE = True
     bot = telebot.TeleBot(config.get_config()['tg_api'])
 except SystemExit as e:
     # Ошибки из ConfigParser (например, нет secrets.json или пустой tg_api)
@@ -75,6 +100,23 @@ except Exception as e:
 temp_data = {}
 pending_reviews = {}
 
+@bot.middleware_handler(update_types=['message', 'callback_query'])
+def track_user_activity(bot_instance, update):
+    """Обновляет last_active пользователя для метрики active_users_24h.
+
+    В БД пишется не чаще раза в activity.touch_interval секунд (secrets.json).
+    """
+    try:
+        # /start сам пишет last_active в upsert register_user
+        if (getattr(update, 'text', None) or '').startswith('/start'):
+            return
+        user = getattr(update, 'from_user', None)
+        if user is not None and not user.is_bot:
+            db_actions.touch_user(user.id)
+    except Exception as e:
+        # Ошибка в middleware отменила бы обработку апдейта
+        log_error(logger, e, "Ошибка учёта активности пользователя")
+
 def clear_temp_data(user_id):
     """Очистить временные данные пользователя"""
     if user_id in temp_data:
@@ -139,57 +181,46 @@ ACHIEVEMENTS = {
     }
 }
 
+# Условие ачивки -> (счётчик из get_achievement_counters, минимальное значение)
+ACHIEVEMENT_COUNTERS = {
+    'first_purchase': ('orders', 1),
+    'first_review_with_photo': ('reviews_with_photo', 1),
+    'three_referrals': ('referrals', 3),
+    # multi_brand_order и loyalty_level_5 пока не реализованы
+}
+
 def check_achievement_conditions(user_id, condition_type, **kwargs):
     """Проверить условия для получения ачивок"""
     try:
-        for achievement_code, achievement_data in ACHIEVEMENTS.items():
-            if achievement_data['condition'] == condition_type:
-                # Проверяем, есть ли уже эта ачивка
-                if db_actions.get_achievement_by_code(user_id, achievement_code):
-                    continue
-                
-                # Проверяем условие
-                if check_achievement_condition(user_id, condition_type, achievement_code, **kwargs):
-                    # Добавляем ачивку
-                    if db_actions.add_achievement(user_id, achievement_code, achievement_data):
-                        # Уведомляем пользователя
-                        notify_achievement_earned(user_id, achievement_data)
-                        return True
+        candidates = [
+            code for code, data in ACHIEVEMENTS.items() if data['condition'] == condition_type
+        ]
+        # Уже полученные отсекаются по кэшу маски ачивок, без запросов к БД
+        candidates = db_actions.missing_achievements(user_id, candidates)
+        if not candidates:
+            return False
+
+        counters = db_actions.get_achievement_counters(
+            user_id, {ACHIEVEMENT_COUNTERS[condition_type][0]} if condition_type in ACHIEVEMENT_COUNTERS else ()
+        )
+        earned = {
+            code: ACHIEVEMENTS[code] for code in candidates
+            if check_achievement_condition(user_id, ACHIEVEMENTS[code]['condition'], code, counters, **kwargs)
+        }
+        awarded = db_actions.award_achievements(user_id, earned)
+        for code in awarded:
+            notify_achievement_earned(user_id, ACHIEVEMENTS[code])
+        return bool(awarded)
     except Exception as e:
         log_error(logger, e, f"Ошибка проверки ачивок для пользователя {user_id}")
     return False
 
-def check_achievement_condition(user_id, condition_type, achievement_code, **kwargs):
-    """Проверить конкретное условие ачивки"""
+def check_achievement_condition(user_id, condition_type, achievement_code, counters, **kwargs):
+    """Проверить конкретное условие ачивки по счётчикам"""
     try:
-        if condition_type == 'first_purchase':
-            # Первая покупка
-            orders = db_actions.get_user_orders(user_id)
-            return len(orders) == 1
-            
-        elif condition_type == 'multi_brand_order':
-            # 3+ вещи разных брендов в одном заказе
-            # Это нужно будет реализовать при создании заказов
-            return False  # Пока не реализовано
-            
-        elif condition_type == 'first_review_with_photo':
-            # Первый отзыв с фото
-            reviews = db_actions.get_user_reviews(user_id)
-            for review in reviews:
-                if review.get('photos') and len(review['photos']) > 0:
-                    return True
-            return False
-            
-        elif condition_type == 'loyalty_level_5':
-            # Уровень лояльности 5 "Легенда"
-            # Это нужно будет реализовать на основе системы лояльности
-            return False  # Пока не реализовано
-            
-        elif condition_type == 'three_referrals':
-            # 3 реферала
-            referral_count = db_actions.get_referral_stats(user_id)
-            return referral_count >= 3
-            
+        if condition_type in ACHIEVEMENT_COUNTERS:
+            counter, minimum = ACHIEVEMENT_COUNTERS[condition_type]
+            return counters.get(counter, 0) >= minimum
     except Exception as e:
         log_error(logger, e, f"Ошибка проверки условия ачивки {achievement_code}")
     return False
@@ -383,9 +414,29 @@ def cleanup_local_files(paths: list) -> None:
 
 # ============ ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ============
 
+# Заказов на одной странице /my_orders и /orders
+ORDERS_PAGE_SIZE = 10
+# Фильтры статуса /orders для кнопки «дальше»: статус — свободный текст и может не
+# влезть в 64 байта callback_data, поэтому в кнопку идёт номер фильтра. Номера не
+# переиспользуются; самые старые забываются, и их кнопки просят вызвать /orders заново
+order_status_filters = OrderedDict()
+order_status_filter_codes = {}
+order_status_filter_next = itertools.count(1)
+MAX_ORDER_STATUS_FILTERS = 1000
+
+def order_status_filter_code(status_filter):
+    code = order_status_filter_codes.get(status_filter)
+    if code is None:
+        code = order_status_filter_codes[status_filter] = next(order_status_filter_next)
+        order_status_filters[code] = status_filter
+        while len(order_status_filters) > MAX_ORDER_STATUS_FILTERS:
+            _, old_filter = order_status_filters.popitem(last=False)
+            del order_status_filter_codes[old_filter]
+    return code
+
 def get_product_field(product, field_name, default=None):
     """Получить поле продукта по имени для совместимости с MySQL"""
-    if isinstance(product, dict):
+    if isinstance(product, Mapping):
         return product.get(field_name, default)
     elif isinstance(product, (list, tuple)):
         # Маппинг полей для обратной совместимости
@@ -414,11 +465,29 @@ def get_product_name(product):
     """Получить название продукта"""
     return get_product_field(product, 'name', 'Неизвестно')
 
+def write_xlsx_stream(filename, headers, rows):
+    """Пишет строки в xlsx по одной (write-only книга), не собирая их в памяти.
+
+    Возвращает количество записанных строк без заголовка.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(headers)
+    count = 0
+    for row in rows:
+        sheet.append(row)
+        count += 1
+    workbook.save(filename)
+    return count
+
 def show_product(user_id, product_id):
     product = db_actions.get_product(product_id)
     if not product:
         bot.send_message(user_id, "Товар не найден")
         return
+    if not get_product_field(product, 'is_available', True):
+        bot.send_message(user_id, "❌ Товар снят с продажи")
+        return
     variations = db_actions.get_product_variations(product_id)
     available_sizes = [v for v in variations if v['quantity'] > 0]
     
@@ -578,9 +647,13 @@ def show_product(user_id, product_id):
 
 def check_and_fix_photos():
     try:
-        products = db_actions.get_all_products()
-        for product in products:
-            product_id, name, _, _, _, photo_id, _, _, _, _, _ = product
+        # Проверка фото ходит в Telegram по каждому товару, поэтому сначала
+        # дочитываем поток из БД, чтобы не держать соединение во время запросов
+        products = [
+            (product['product_id'], product['name'], product['photo_id'])
+            for product in db_actions.get_all_products()
+        ]
+        for product_id, name, photo_id in products:
             if photo_id:
                 try:
                     file_info = bot.get_file(photo_id)
@@ -596,208 +669,346 @@ def handle_daily_bonus(user_id):
     # Ежедневный бонус отключен
     return False
 
-def check_comment_achievement(user_id):
-    user_data = db_actions.get_user_data(user_id)
-    if user_data and user_data['comments'] >= 10:
-        if "active_commentator" not in user_data['achievements']:
-            db_actions.add_achievement(user_id, "active_commentator")
-            db_actions.update_user_stats(user_id, 'discount', 1)
-            bot.send_message(
-                user_id,
-                "🏆 Достижение «Активный комментатор»! Ваша скидка увеличена на 1%"
-            )
-
+COMMENTS_FOR_ACHIEVEMENT = 10
+COMMENTATOR_ACHIEVEMENT = {
+    'name': '💬 Активный комментатор',
+    'description': f'{COMMENTS_FOR_ACHIEVEMENT} комментариев в обсуждениях',
+    'category': 'БЕРЕГ',
+    'bs_coin_reward': 0,
+    'discount_bonus': 1
+}
 
-def process_products_file(message):
-    user_id = message.from_user.id
-    if not message.document:
-        bot.send_message(user_id, "Пожалуйста, отправьте Excel файл")
+def check_comment_achievement(user_id, comments):
+    """Вызывается буфером счётчиков после записи в БД, пока comments не меньше порога."""
+    # Маска ачивок в памяти отсекает уже получивших без запроса к БД
+    if db_actions.has_achievement(user_id, "active_commentator"):
         return
-        
-    try:
-        bot.send_message(user_id, "🔄 Очищаем старые товары...")
-        db_actions.clear_all_products()
-        
-        file_info = bot.get_file(message.document.file_id)
-        downloaded_file = bot.download_file(file_info.file_path)
-        
-        filename = f"products_{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
-        with open(filename, 'wb') as f:
-            f.write(downloaded_file)
-        
-        # Проверяем, есть ли листы "ЭКОНОМИКА" и "КЛЮЧИ"
-        excel_file = pd.ExcelFile(filename)
-        sheet_names = excel_file.sheet_names
-        
-        if 'ЭКОНОМИКА' in sheet_names and 'КЛЮЧИ' in sheet_names:
-            # Новая структура с двумя листами
-            bot.send_message(user_id, "📊 Обнаружена новая структура файла с листами 'ЭКОНОМИКА' и 'КЛЮЧИ'")
-            
-            economics_df = pd.read_excel(filename, sheet_name='ЭКОНОМИКА')
-            keys_df = pd.read_excel(filename, sheet_name='КЛЮЧИ')
-            
-            # Проверяем необходимые колонки в листе "ЭКОНОМИКА"
-            required_economics_columns = ['Модель', 'ID модели', 'Размер', 'Цена Y', 'Кол.', 'Цена продажи', 'Цвет', 'Ссылки']
-            missing_economics_columns = [col for col in required_economics_columns if col not in economics_df.columns]
-            
-            if missing_economics_columns:
-                bot.send_message(user_id, f"❌ В листе 'ЭКОНОМИКА' отсутствуют колонки: {', '.join(missing_economics_columns)}")
-                os.remove(filename)
-                return
-            
-            # Проверяем необходимые колонки в листе "КЛЮЧИ"
-            required_keys_columns = ['ID', 'Краткое описание товара Telegram', '#Хештеги']
-            missing_keys_columns = [col for col in required_keys_columns if col not in keys_df.columns]
-            
-            if missing_keys_columns:
-                bot.send_message(user_id, f"❌ В листе 'КЛЮЧИ' отсутствуют колонки: {', '.join(missing_keys_columns)}")
-                os.remove(filename)
-                return
-            
-            success_count = db_actions.import_products_from_excel_new_format(economics_df, keys_df)
-            
-            total_products = len(economics_df['Модель'].unique())
-            total_variations = len(economics_df)
-            zero_quantity = len(economics_df[economics_df['Кол.'].fillna(0) == 0])
-            
-            stats_msg = (
-                f"✅ Успешно импортировано {success_count} товаров\n\n"
-                f"📊 Статистика:\n"
-                f"• Уникальных моделей: {total_products}\n"
-                f"• Всего вариаций: {total_variations}\n"
-                f"• С нулевым количеством: {zero_quantity}\n"
-                f"• Диапазон цен: {economics_df['Цена продажи'].min():.0f} - {economics_df['Цена продажи'].max():.0f}₽\n\n"
-                f"📊 Использована новая структура с описаниями и хештегами"
-            )
-            
-            bot.send_message(user_id, stats_msg)
-            
-            sample_msg = "📋 Пример первых 5 товаров:\n"
-            for i, (_, row) in enumerate(economics_df.head().iterrows()):
-                sample_msg += f"{i+1}. {row['Модель']} - {row['Размер']} - {row['Цена продажи']}₽\n"
-            
-            bot.send_message(user_id, sample_msg)
-            return
-            
-        else:
-            # Старая структура с одним листом
-            bot.send_message(user_id, "📊 Обнаружена старая структура файла")
-        
-        df = pd.read_excel(filename)
-
-        # Нормализуем названия колонок для старого формата (частые варианты из файлов)
-        def _normalize_column_name(name):
-            return str(name).strip().lower()
-
-        column_synonyms = {
-            'id модели': 'ID Модели',
-            'id модели.': 'ID Модели',
-            'кол.': 'Количество',
-            'количество': 'Количество',
-            'ссылки': 'Ссылка',
-            'ссылка': 'Ссылка',
-            'цена продажи': 'Цена',
-            'цена': 'Цена',
-            'цена y': 'Цена Y',
-            'модель': 'Модель',
-            'размер': 'Размер',
-        }
+    # Ачивка и +1% скидки пишутся одной транзакцией; повторно ачивка не выдаётся
+    if db_actions.add_achievement(user_id, "active_commentator", COMMENTATOR_ACHIEVEMENT):
+        bot.send_message(
+            user_id,
+            "🏆 Достижение «Активный комментатор»! Ваша скидка увеличена на 1%"
+        )
 
-        normalized_columns = {}
-        for original_col in list(df.columns):
-            key = _normalize_column_name(original_col)
-            if key in column_synonyms:
-                target = column_synonyms[key]
-                if original_col != target and target not in df.columns:
-                    df.rename(columns={original_col: target}, inplace=True)
-                normalized_columns[target] = True
-            else:
-                # оставляем исходное имя, если нет синонима
-                normalized_columns[original_col] = True
+db_actions.on_stat_threshold('comments', COMMENTS_FOR_ACHIEVEMENT, check_comment_achievement)
 
-        required_columns = ['Модель', 'ID Модели', 'Размер', 'Цена Y', 'Количество', 'Цена', 'Ссылка']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        
-        if missing_columns:
-            bot.send_message(user_id, f"❌ Неверный формат файла. Отсутствуют колонки: {', '.join(missing_columns)}")
-            os.remove(filename)
-            return
+
+def format_sync_stats(stats):
+    return (
+        f"🔄 Каталог синхронизирован\n\n"
+        f"📦 Товары: новых {stats['products_added']}, изменено {stats['products_updated']}, "
+        f"снято с продажи {stats['products_disabled']}\n"
+        f"📏 Вариации: новых {stats['variations_added']}, изменено {stats['variations_updated']}, "
+        f"обнулено {stats['variations_disabled']}"
+    )
+
+def describe_economics_upload(economics_df):
+    """Статистика и пример строк для новой структуры (два листа)"""
+    total_products = len(economics_df['Модель'].unique())
+    total_variations = len(economics_df)
+    zero_quantity = len(economics_df[economics_df['Кол.'].fillna(0) == 0])
+    # Нечисловые цены уже попали в отчёт проверки, в диапазон они не входят
+    prices = pd.to_numeric(economics_df['Цена продажи'], errors='coerce')
+    
+    stats_msg = (
+        f"📊 Статистика:\n"
+        f"• Уникальных моделей: {total_products}\n"
+        f"• Всего вариаций: {total_variations}\n"
+        f"• С нулевым количеством: {zero_quantity}\n"
+        f"• Диапазон цен: {prices.min():.0f} - {prices.max():.0f}₽\n\n"
+        f"📊 Использована новая структура с описаниями и хештегами"
+    )
+    
+    sample_msg = "📋 Пример первых 5 товаров:\n"
+    for i, (_, row) in enumerate(economics_df.head().iterrows()):
+        sample_msg += f"{i+1}. {row['Модель']} - {row['Размер']} - {row['Цена продажи']}₽\n"
+    return stats_msg, sample_msg
+
+def rename_legacy_columns(df):
+    """Приводит названия колонок старой структуры; ImportJobError, если нужных нет"""
+    # Нормализуем названия колонок для старого формата (частые варианты из файлов)
+    def _normalize_column_name(name):
+        return str(name).strip().lower()
+
+    column_synonyms = {
+        'id модели': 'ID Модели',
+        'id модели.': 'ID Модели',
+        'кол.': 'Количество',
+        'количество': 'Количество',
+        'ссылки': 'Ссылка',
+        'ссылка': 'Ссылка',
+        'цена продажи': 'Цена',
+        'цена': 'Цена',
+        'цена y': 'Цена Y',
+        'модель': 'Модель',
+        'размер': 'Размер',
+    }
+
+    for original_col in list(df.columns):
+        key = _normalize_column_name(original_col)
+        if key in column_synonyms:
+            target = column_synonyms[key]
+            if original_col != target and target not in df.columns:
+                df.rename(columns={original_col: target}, inplace=True)
+
+    required_columns = ['Модель', 'ID Модели', 'Размер', 'Цена Y', 'Количество', 'Цена', 'Ссылка']
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    
+    if missing_columns:
+        raise ImportJobError(f"Неверный формат файла. Отсутствуют колонки: {', '.join(missing_columns)}")
+    return df
+
+def prepare_legacy_upload(df):
+    """Приводит значения старой структуры к виду normalize_legacy_format; ImportJobError при ошибке"""
+    def calculate_price(row):
+        try:
+            price_yuan = row['Цена Y']
+            if pd.isna(price_yuan) or price_yuan == 0:
+                return 0
         
-        def calculate_price(row):
-            try:
-                price_yuan = row['Цена Y']
-                if pd.isna(price_yuan) or price_yuan == 0:
-                    return 0
-            
-                if isinstance(row['Цена'], (int, float)) and not pd.isna(row['Цена']):
-                    return float(row['Цена'])
-                
-                if isinstance(row['Цена'], str) and row['Цена'].startswith('='):
-                    return float(price_yuan) * 12
-                
+            if isinstance(row['Цена'], (int, float)) and not pd.isna(row['Цена']):
                 return float(row['Цена'])
-            except:
-                return float(price_yuan) * 12 
-        
-        df['Цена'] = df.apply(calculate_price, axis=1)
-        
-        df['ID Модели'] = df['ID Модели'].astype(str).apply(lambda x: x.split('.')[0] if '.' in x else x).str.strip()
-        
-        def safe_convert(value, default=0):
-            if value is None or value == '' or pd.isna(value):
-                return default
-            try:
-                if isinstance(value, str):
-                    value = value.strip().replace(',', '.')
-                    if not value:
-                        return default
-                return float(value)
-            except (ValueError, TypeError):
-                return default
-        
-        df['Количество'] = df['Количество'].apply(lambda x: int(safe_convert(x, 0)))
-        df['Цена Y'] = df['Цена Y'].apply(lambda x: safe_convert(x, 0))
-        
-        df['Модель'] = df['Модель'].fillna('Неизвестно').astype(str)
-        df['Размер'] = df['Размер'].fillna('').astype(str)
-        df['Ссылка'] = df['Ссылка'].fillna('').astype(str)
-        
-        if df['Цена'].isnull().all() or (df['Цена'] == 0).all():
-            bot.send_message(user_id, "❌ Ошибка: не удалось вычислить цены. Проверьте формат файла.")
-            os.remove(filename)
-            return
+            
+            if isinstance(row['Цена'], str) and row['Цена'].startswith('='):
+                return float(price_yuan) * 12
+            
+            return float(row['Цена'])
+        except:
+            return float(price_yuan) * 12 
     
-        success_count = db_actions.import_products_from_excel(df)
-        
-        total_products = len(df['Модель'].unique())
-        total_variations = len(df)
-        zero_quantity = len(df[df['Количество'] == 0])
-        
-        stats_msg = (
-            f"✅ Успешно импортировано {success_count} товаров\n\n"
-            f"📊 Статистика:\n"
-            f"• Уникальных моделей: {total_products}\n"
-            f"• Всего вариаций: {total_variations}\n"
-            f"• С нулевым количеством: {zero_quantity}\n"
-                f"• Диапазон цен: {df['Цена'].min():.0f} - {df['Цена'].max():.0f}₽\n\n"
-                f"📊 Использована старая структура"
+    df['Цена'] = df.apply(calculate_price, axis=1)
+    
+    df['ID Модели'] = df['ID Модели'].astype(str).apply(lambda x: x.split('.')[0] if '.' in x else x).str.strip()
+    
+    def safe_convert(value, default=0):
+        if value is None or value == '' or pd.isna(value):
+            return default
+        try:
+            if isinstance(value, str):
+                value = value.strip().replace(',', '.')
+                if not value:
+                    return default
+            return float(value)
+        except (ValueError, TypeError):
+            return default
+    
+    df['Количество'] = df['Количество'].apply(lambda x: int(safe_convert(x, 0)))
+    df['Цена Y'] = df['Цена Y'].apply(lambda x: safe_convert(x, 0))
+    
+    df['Модель'] = df['Модель'].fillna('Неизвестно').astype(str)
+    df['Размер'] = df['Размер'].fillna('').astype(str)
+    df['Ссылка'] = df['Ссылка'].fillna('').astype(str)
+    
+    if df['Цена'].isnull().all() or (df['Цена'] == 0).all():
+        raise ImportJobError("Не удалось вычислить цены. Проверьте формат файла.")
+    return df
+
+def describe_legacy_upload(df):
+    """Статистика и пример строк для старой структуры (один лист)"""
+    total_products = len(df['Модель'].unique())
+    total_variations = len(df)
+    zero_quantity = len(df[df['Количество'] == 0])
+    
+    stats_msg = (
+        f"📊 Статистика:\n"
+        f"• Уникальных моделей: {total_products}\n"
+        f"• Всего вариаций: {total_variations}\n"
+        f"• С нулевым количеством: {zero_quantity}\n"
+        f"• Диапазон цен: {df['Цена'].min():.0f} - {df['Цена'].max():.0f}₽\n\n"
+        f"📊 Использована старая структура"
+    )
+    
+    sample_msg = "📋 Пример первых 5 товаров:\n"
+    for i, (_, row) in enumerate(df.head().iterrows()):
+        sample_msg += f"{i+1}. {row['Модель']} - {row['Размер']} - {row['Цена']}₽\n"
+    return stats_msg, sample_msg
+
+def send_validation_report(job, report):
+    """Отправляет админу книгу со строками, не прошедшими проверку.
+
+    Возвращает (строк с ошибками, строк только с предупреждениями).
+    """
+    bad_rows, warning_rows = report_counts(report)
+    if bad_rows:
+        job.add_error(f"Строк с ошибками: {bad_rows}, подробности в файле")
+    try:
+        bot.send_document(
+            job.user_id,
+            io.BytesIO(error_workbook(report)),
+            caption=(
+                f"⚠️ Импорт #{job.job_id}: строк с ошибками — {bad_rows}, с предупреждениями — {warning_rows}. "
+                f"Ошибки останавливают импорт, строки с предупреждениями пропускаются"
+            ),
+            visible_file_name=f"import_{job.job_id}_errors.xlsx"
         )
-        
-        bot.send_message(user_id, stats_msg)
-        
-        sample_msg = "📋 Пример первых 5 товаров:\n"
-        for i, (_, row) in enumerate(df.head().iterrows()):
-            sample_msg += f"{i+1}. {row['Модель']} - {row['Размер']} - {row['Цена']}₽\n"
-        
-        bot.send_message(user_id, sample_msg)
-        
     except Exception as e:
-        error_msg = f"❌ Ошибка при обработке файла: {str(e)}"
-        log_error(logger, e, "Ошибка импорта товаров")
-        bot.send_message(user_id, error_msg)
+        log_error(logger, e, f"Ошибка отправки файла с ошибками импорта #{job.job_id}")
+    return bad_rows, warning_rows
+
+def run_catalog_import(job):
+    """Выполняется воркером import_jobs: файл -> каталог. Возвращает сообщения итога."""
+    full_reload = job.payload['full_reload']
+    dry_run = job.payload.get('dry_run', False)
+    
+    job.set_stage("загрузка файла")
+    file_info = bot.get_file(job.payload['file_id'])
+    downloaded_file = bot.download_file(file_info.file_path)
+    
+    # Книга читается из памяти в режиме read-only, каждый лист — один раз
+    job.set_stage("чтение листов")
+    try:
+        workbook = open_workbook(downloaded_file)
+    except ValueError as e:
+        raise ImportJobError(f"{e}. Сохраните файл в формате .xlsx") from e
+    try:
+        # Проверяем, есть ли листы "ЭКОНОМИКА" и "КЛЮЧИ"
+        new_format = 'ЭКОНОМИКА' in workbook.sheetnames and 'КЛЮЧИ' in workbook.sheetnames
+        if new_format:
+            economics_df = read_sheet(workbook, 'ЭКОНОМИКА', ECONOMICS_COLUMNS, progress=job.add_rows)
+            keys_df = read_sheet(workbook, 'КЛЮЧИ', KEYS_COLUMNS, progress=job.add_rows)
+        else:
+            df = read_sheet(workbook, progress=job.add_rows)
     finally:
-        if 'filename' in locals() and os.path.exists(filename):
-            os.remove(filename)
+        workbook.close()
+    del downloaded_file
+    
+    job.set_stage("проверка данных")
+    if new_format:
+        # Проверяем необходимые колонки в листах "ЭКОНОМИКА" и "КЛЮЧИ"
+        missing_economics_columns = [col for col in ECONOMICS_COLUMNS if col not in economics_df.columns]
+        if missing_economics_columns:
+            raise ImportJobError(f"В листе 'ЭКОНОМИКА' отсутствуют колонки: {', '.join(missing_economics_columns)}")
+        required_keys_columns = ['ID', 'Краткое описание товара Telegram', '#Хештеги']
+        missing_keys_columns = [col for col in required_keys_columns if col not in keys_df.columns]
+        if missing_keys_columns:
+            raise ImportJobError(f"В листе 'КЛЮЧИ' отсутствуют колонки: {', '.join(missing_keys_columns)}")
+        
+        report = validate_new_format(economics_df, keys_df)
+        stats_msg, sample_msg = describe_economics_upload(economics_df)
+    else:
+        df = rename_legacy_columns(df)
+        report = validate_legacy_format(df)
+        df = prepare_legacy_upload(df)
+        stats_msg, sample_msg = describe_legacy_upload(df)
+    
+    # Проверка идёт до записи: при ошибках каталог не трогаем, строки приходят файлом.
+    # Строки с предупреждениями импорт пропускает, о них говорится в итоге
+    bad_rows, warning_rows = send_validation_report(job, report) if report else (0, 0)
+    warning_line = f"\n⚠️ Пропущено строк с предупреждениями: {warning_rows}" if warning_rows else ""
+    if dry_run:
+        verdict = f"⚠️ Строк с ошибками: {bad_rows}" if bad_rows else "✅ Ошибок не найдено"
+        return [f"🔎 Проверка без записи в БД\n{verdict}{warning_line}\n\n{stats_msg}", sample_msg]
+    if bad_rows:
+        raise ImportJobError("Каталог не изменён: исправьте строки из файла с ошибками и загрузите его снова")
+    
+    if new_format:
+        products, variations = normalize_new_format(economics_df, keys_df)
+    else:
+        products, variations = normalize_legacy_format(df)
+    
+    job.set_stage("запись в БД")
+    if full_reload:
+        written_products, written_variations = db_actions.import_catalog(
+            products, variations, replace=True, progress=job.add_written
+        )
+        if len(products) and not written_products:
+            raise ImportJobError("Ошибка записи каталога в БД, изменения не применены")
+        log_info(logger, f"Импорт завершен. Товаров: {written_products}, вариаций: {written_variations}")
+        result_line = f"✅ Успешно импортировано {written_products} товаров"
+    else:
+        sync_stats = db_actions.sync_catalog(products, variations, progress=job.add_written)
+        if sync_stats is None:
+            raise ImportJobError("Ошибка синхронизации каталога, изменения не применены")
+        result_line = format_sync_stats(sync_stats)
+    
+    return [f"{result_line}{warning_line}\n\n{stats_msg}", sample_msg]
+
+IMPORT_JOB_TITLES = {
+    ImportJob.QUEUED: "🕓 в очереди",
+    ImportJob.DONE: "✅ завершён",
+    ImportJob.FAILED: "❌ ошибка",
+    ImportJob.CANCELLED: "⛔️ отменён",
+}
+
+def format_import_job(job):
+    if job.status == ImportJob.RUNNING:
+        title = "🔄 отменяется..." if job.cancel_requested else f"⏳ {job.stage or 'запуск'}"
+    else:
+        title = IMPORT_JOB_TITLES[job.status]
+    if job.payload.get('dry_run'):
+        mode = "проверка"
+    else:
+        mode = "полная замена" if job.payload['full_reload'] else "синхронизация"
+    text = (
+        f"📤 Импорт #{job.job_id} ({mode}): {title}\n\n"
+        f"📄 Прочитано строк: {job.rows}\n"
+        f"📦 Записано товаров: {job.products}, вариаций: {job.variations}\n"
+        f"⚠️ Ошибок: {len(job.errors)}"
+    )
+    if job.status == ImportJob.QUEUED:
+        position = import_jobs.position(job)
+        if position > 1:
+            text += f"\n\nПеред ним в очереди: {position - 1}"
+    if job.errors and job.finished:
+        text += "\n\n" + "\n".join(f"• {error}" for error in job.errors[-5:])
+    if job.status == ImportJob.CANCELLED and not job.payload.get('dry_run'):
+        text += "\n\nИзменения не применены"
+    return text
+
+def show_import_progress(job):
+    """on_progress очереди импорта: одно сообщение с прогрессом, правится на месте"""
+    text = format_import_job(job)
+    markup = None if job.finished else Bot_inline_btns().import_job_buttons(job.job_id)
+    if job.message_id is None:
+        job.message_id = bot.send_message(job.user_id, text, reply_markup=markup).message_id
+    else:
+        try:
+            bot.edit_message_text(text, chat_id=job.user_id, message_id=job.message_id, reply_markup=markup)
+        except telebot.apihelper.ApiTelegramException as e:
+            # Текст не изменился с прошлого показа — это не ошибка
+            if 'message is not modified' not in str(e):
+                log_error(logger, e, f"Ошибка обновления прогресса импорта #{job.job_id}")
+    if job.status == ImportJob.DONE:
+        for result_msg in job.result:
+            bot.send_message(job.user_id, result_msg)
+
+import_jobs = ImportJobQueue(run_catalog_import, on_progress=show_import_progress)
+
+def process_products_file(message, full_reload=False, dry_run=False):
+    user_id = message.from_user.id
+    if not message.document:
+        bot.send_message(user_id, "Пожалуйста, отправьте Excel файл")
+        return
+    if not is_workbook_name(message.document.file_name):
+        bot.send_message(
+            user_id,
+            "❌ Поддерживаются только файлы .xlsx. Файл .xls откройте в Excel и сохраните "
+            "как «Книга Excel (*.xlsx)», затем снова вызовите /upload_products"
+        )
+        return
+    
+    # Импорт идёт в фоне, обработчик сразу освобождается для других сообщений
+    try:
+        import_jobs.submit(user_id, {
+            'file_id': message.document.file_id,
+            'full_reload': full_reload,
+            'dry_run': dry_run,
+        })
+    except Exception as e:
+        log_error(logger, e, "Ошибка постановки импорта в очередь")
+        bot.send_message(user_id, f"❌ Не удалось запустить импорт: {str(e)}")
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('import_cancel_'))
+def handle_import_cancel(call):
+    user_id = call.from_user.id
+    if not db_actions.user_is_admin(user_id):
+        bot.answer_callback_query(call.id, "⛔️ Недостаточно прав")
+        return
+    job = import_jobs.cancel(int(call.data.split('_')[-1]))
+    if job is None:
+        bot.answer_callback_query(call.id, "Импорт уже завершён")
+    else:
+        bot.answer_callback_query(call.id, "Импорт отменяется, изменения не будут применены")
 
 def create_review_topic(user_data):
     """Создать топик для отзыва в группе админов"""
@@ -1236,25 +1447,30 @@ def start(message):
     clear_temp_data(user_id)
     buttons = Bot_inline_btns()
     
-    is_new_user = not db_actions.user_exists(user_id)
-    if is_new_user:
-        first_name = message.from_user.first_name or ""
-        last_name = message.from_user.last_name or ""
-        username = f"@{message.from_user.username}" if message.from_user.username else ""
-        db_actions.add_user(user_id, first_name, last_name, username)
-
     command_parts = message.text.split()
-    if len(command_parts) > 1:
-        param = command_parts[1]
-        
+    param = command_parts[1] if len(command_parts) > 1 else ''
+    referrer_id = None
+    if param.startswith('ref_'):
+        try:
+            referrer_id = int(param.split('_')[1])
+        except (ValueError, IndexError):
+            referrer_id = None
+
+    # Upsert и чтение профиля (вместе с проверкой пригласившего) — два запроса к БД;
+    # профиль и флаг админа попадают в кэш, поэтому user_is_admin ниже в БД не ходит
+    first_name = message.from_user.first_name or ""
+    last_name = message.from_user.last_name or ""
+    username = f"@{message.from_user.username}" if message.from_user.username else ""
+    is_new_user, _, referrer_exists = db_actions.register_user(
+        user_id, first_name, last_name, username, referrer_id=referrer_id
+    )
+
+    if param:
         if param.startswith('ref_'):
             try:
-                referrer_id = int(param.split('_')[1])
-                if is_new_user and db_actions.user_exists(referrer_id) and referrer_id != user_id:
+                if is_new_user and referrer_exists and referrer_id != user_id:
+                    # Бонусы обеим сторонам начисляются в той же транзакции, что и реферал
                     db_actions.add_referral(referrer_id, user_id)
-                    db_actions.update_user_stats(referrer_id, 'bs_coin', 100)
-                    db_actions.update_user_stats(user_id, 'bs_coin', 50)
-                    db_actions.update_user_stats(user_id, 'discount', 5)
                     
                     # Проверяем ачивки для рефералов
                     check_achievement_conditions(referrer_id, 'three_referrals')
@@ -1287,7 +1503,6 @@ def start(message):
     
     # Ежедневный бонус отключен
     
-    user_data = db_actions.get_user_data(user_id)
     welcome_msg = (
         f"🚀 Добро пожаловать на борт, Друг! 🚀\n"
         f"Рады приветствовать тебя в сообществе BridgeSide — месте, где встречаются твой стиль и уникальные возможности.\n\n"
@@ -1364,27 +1579,51 @@ def show_achievements_menu(message):
     clear_temp_data(message.from_user.id)
     show_achievements(message)
 
-@bot.message_handler(commands=['my_orders'])
-def my_orders(message):
-    user_id = message.from_user.id
-    clear_temp_data(user_id)
-    orders = db_actions.get_user_orders(user_id)
-    
+def render_my_orders_page(user_id, before_id=None):
+    """Текст и кнопка «дальше» для страницы заказов пользователя"""
+    orders, next_before_id = db_actions.get_orders_page(user_id=user_id, before_id=before_id, limit=ORDERS_PAGE_SIZE)
     if not orders:
-        bot.send_message(user_id, "У вас пока нет заказов")
-        return
+        return None, None
     
     orders_text = "📦 ВАШИ ЗАКАЗЫ:\n\n"
     for order in orders:
-        product = db_actions.get_product(order['product_id'])
         orders_text += (
             f"🛒 Заказ #{order['order_id']}\n"
-            f"🛍️ Товар: {get_product_name(product) if product else 'Неизвестно'}\n"
+            f"🛍️ Товар: {order['product_name'] or 'Неизвестно'}\n"
             f"📊 Статус: {order['status']}\n"
             f"🕒 Дата: {order['created_at']}\n\n"
         )
     
-    bot.send_message(user_id, orders_text)
+    markup = None
+    if next_before_id:
+        markup = Bot_inline_btns().next_page_button(f"my_orders_page_{next_before_id}")
+    return orders_text, markup
+
+@bot.message_handler(commands=['my_orders'])
+def my_orders(message):
+    user_id = message.from_user.id
+    clear_temp_data(user_id)
+    orders_text, markup = render_my_orders_page(user_id)
+    
+    if not orders_text:
+        bot.send_message(user_id, "У вас пока нет заказов")
+        return
+    
+    bot.send_message(user_id, orders_text, reply_markup=markup)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('my_orders_page_'))
+def my_orders_next_page(call):
+    user_id = call.from_user.id
+    try:
+        before_id = int(call.data[len('my_orders_page_'):])
+        orders_text, markup = render_my_orders_page(user_id, before_id)
+        bot.answer_callback_query(call.id)
+        if not orders_text:
+            bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
+            return
+        bot.edit_message_text(orders_text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
+    except Exception as e:
+        log_error(logger, e, "Ошибка перелистывания заказов пользователя")
 
 @bot.message_handler(commands=['support'])
 def support(message):
@@ -1568,12 +1807,33 @@ def ref_command(message):
         f"🎁 ЧТО ПОЛУЧАЕТ ТВОЙ ДРУГ:\n"
         f" Щедрый подарок на первый заказ — СКИДКА 5% 🎯 + +50 BS Coin на свой счет! Отличный повод начать shopping!\n"
         f"🏆 ТОП-5 ПО РЕФЕРАЛАМ ЕЖЕМЕСЯЧНО ПОЛУЧАЮТ ЭКСКЛЮЗИВНЫЙ МЕРЧ!\n"
-        f"Чем больше друзей ты приведёшь, тем выше твой шанс оказаться в числе Легенд нашего клуба! Смотри рейтинг в своём профиле (/profile).\n"
+        f"Чем больше друзей ты приведёшь, тем выше твой шанс оказаться в числе Легенд нашего клуба! Смотри рейтинг: /ref_top\n"
         f"🚀Не копи — зарабатывай! Переходи по ссылкам, покупай и приглашай!"
     )
     
     bot.send_message(user_id, ref_msg, parse_mode="HTML")
 
+REFERRAL_TOP_SHOWN = 5
+
+@bot.message_handler(commands=['ref_top'])
+def ref_top_command(message):
+    user_id = message.from_user.id
+    clear_temp_data(user_id)
+    # Топ отдаётся из памяти: он обновляется при каждом новом реферале
+    leaders = db_actions.get_referral_leaderboard(REFERRAL_TOP_SHOWN)
+    if not leaders:
+        bot.send_message(user_id, "🏆 Рейтинг пока пуст — пригласи друзей первым! /ref")
+        return
+
+    medals = ["🥇", "🥈", "🥉"]
+    lines = ["🏆 ТОП ПО РЕФЕРАЛАМ\n"]
+    for place, leader in enumerate(leaders, start=1):
+        name = leader.get('username') or leader.get('first_name') or f"ID {leader['user_id']}"
+        badge = medals[place - 1] if place <= len(medals) else f"{place}."
+        lines.append(f"{badge} {name} — {leader['referral_count']}")
+    lines.append(f"\n👥 Твои рефералы: {db_actions.get_referral_stats(user_id)}")
+    bot.send_message(user_id, "\n".join(lines))
+
 @bot.message_handler(commands=['set_discount'])
 def set_discount(message):
     user_id = message.from_user.id
@@ -1763,21 +2023,108 @@ def admin_stats(message):
         bot.send_message(user_id, "⛔️ Недостаточно прав")
         return
         
-    products_count = db_actions.get_products_count()
-    variations_count = db_actions.get_variations_count()
-    users_count = db_actions.get_users_count()
-    reviews_count = db_actions.get_reviews_count()
+    stats = db_actions.get_admin_stats()
+    if not stats:
+        bot.send_message(user_id, "❌ Не удалось получить статистику")
+        return
     
     stats_msg = (
         f"📊 Статистика магазина:\n\n"
-        f"🛍️ Товаров: {products_count}\n"
-        f"📦 Вариаций: {variations_count}\n"
-        f"👥 Пользователей: {users_count}\n"
-        f"📝 Отзывов: {reviews_count}"
+        f"🛍️ Товаров: {stats.get('products', 0)}\n"
+        f"📦 Вариаций: {stats.get('variations', 0)}, на складе единиц: {stats.get('stock_units', 0)}\n"
+        f"👥 Пользователей: {stats.get('users', 0)}, активных за 24ч: {stats.get('active_users_24h', 0)}\n"
+        f"📝 Отзывов: {stats.get('reviews', 0)}\n"
+        f"🛒 Заказов: {stats.get('orders', 0)}, сегодня: {stats.get('orders_today', 0)}"
     )
+    by_status = sorted(stats.get('orders_by_status', {}).items(), key=lambda item: item[1], reverse=True)
+    if by_status:
+        stats_msg += "\n\n📋 Заказы по статусам:\n"
+        stats_msg += "\n".join(f"• {status}: {count}" for status, count in by_status)
     
     bot.send_message(user_id, stats_msg)
 
+@bot.message_handler(commands=['db_pool'])
+def db_pool_stats(message):
+    """Показать занятость пула соединений с БД"""
+    user_id = message.from_user.id
+    clear_temp_data(user_id)
+    if not db_actions.user_is_admin(user_id):
+        bot.send_message(user_id, "⛔️ Недостаточно прав")
+        return
+
+    stats = db.pool_stats()
+    stats_msg = (
+        f"🗄 Пул соединений MySQL:\n\n"
+        f"🔌 Открыто: {stats.get('size', 0)} (мин {stats.get('min_size', 0)}, макс {stats.get('max_size', 0)})\n"
+        f"⚙️ Занято сейчас: {stats.get('in_use', 0)}, свободно: {stats.get('idle', 0)}\n"
+        f"📈 Пик занятости: {stats.get('peak_in_use', 0)}\n"
+        f"📥 Выдано соединений: {stats.get('checkouts', 0)}\n"
+        f"⏳ Ожиданий: {stats.get('waits', 0)}, таймаутов: {stats.get('timeouts', 0)}\n"
+        f"⏱ Ожидание: среднее {stats.get('avg_wait_ms', 0):.2f} мс, макс {stats.get('max_wait_ms', 0):.2f} мс\n"
+        f"♻️ Пересоздано по возрасту: {stats.get('recycled', 0)}, выброшено сломанных: {stats.get('discarded', 0)}"
+    )
+    for i, replica_stats in enumerate(db.replica_pool_stats(), start=1):
+        stats_msg += (
+            f"\n\n📚 Реплика #{i}: открыто {replica_stats.get('size', 0)}, "
+            f"занято {replica_stats.get('in_use', 0)}, выдано {replica_stats.get('checkouts', 0)}, "
+            f"ожидание макс {replica_stats.get('max_wait_ms', 0):.2f} мс"
+        )
+
+    cache_stats = db_actions.user_cache_stats()
+    stats_msg += (
+        f"\n\n👤 Кэш профилей: {cache_stats['size']} из {cache_stats['max_size']}, "
+        f"попаданий {cache_stats['hits']}, промахов {cache_stats['misses']}"
+    )
+
+    bot.send_message(user_id, stats_msg)
+
+@bot.message_handler(commands=['db_top'])
+def db_top_queries(message):
+    """Топ SQL-запросов по суммарному времени: /db_top [N] [total|avg|p95|max|calls|rows|wait] или /db_top reset"""
+    user_id = message.from_user.id
+    clear_temp_data(user_id)
+    if not db_actions.user_is_admin(user_id):
+        bot.send_message(user_id, "⛔️ Недостаточно прав")
+        return
+
+    args = message.text.split()[1:]
+    if args and args[0] == 'reset':
+        db.reset_query_stats()
+        bot.send_message(user_id, "♻️ Статистика запросов сброшена")
+        return
+
+    limit = 10
+    order_by = 'total_ms'
+    for arg in args:
+        if arg.isdigit():
+            limit = max(1, min(int(arg), 30))
+        elif arg in ('calls', 'rows'):
+            order_by = arg
+        elif arg in ('total', 'avg', 'p95', 'max', 'wait'):
+            order_by = f'{arg}_ms'
+
+    top = db.query_stats(limit, order_by)
+    if not top:
+        bot.send_message(user_id, "📭 Запросов пока не было")
+        return
+
+    stats_msg = f"🐢 Топ-{len(top)} запросов ({order_by}) с {db.query_stats_since().strftime('%d.%m %H:%M')}:\n"
+    for i, item in enumerate(top, start=1):
+        query = item['fingerprint']
+        if len(query) > 200:
+            query = query[:200] + '…'
+        stats_msg += (
+            f"\n{i}. {query}\n"
+            f"   вызовов {item['calls']}, ошибок {item['errors']}, всего {item['total_ms']:.0f} мс\n"
+            f"   ср {item['avg_ms']:.1f} / p50 {item['p50_ms']:.1f} / p95 {item['p95_ms']:.1f} / "
+            f"p99 {item['p99_ms']:.1f} / макс {item['max_ms']:.1f} мс\n"
+            f"   строк {item['rows']}, ожидание соединения {item['wait_ms']:.0f} мс\n"
+        )
+
+    # Ограничение Telegram на длину сообщения
+    for start in range(0, len(stats_msg), 4000):
+        bot.send_message(user_id, stats_msg[start:start + 4000])
+
 @bot.message_handler(commands=['export_products'])
 def export_products(message):
     user_id = message.from_user.id
@@ -1787,28 +2134,23 @@ def export_products(message):
         return
     
     try:
-        products_data = db_actions.get_all_products_for_export()
+        filename = f"products_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        rows = (
+            (product['name'], product['model_id'], product['size'], product['price_yuan'],
+             product['quantity'], product['price'], product['link'])
+            for product in db_actions.get_all_products_for_export()
+        )
+        exported = write_xlsx_stream(
+            filename,
+            ['Модель', 'ID Модели', 'Размер', 'Цена Y', 'Количество', 'Цена', 'Ссылка'],
+            rows
+        )
         
-        if not products_data:
+        if not exported:
+            os.remove(filename)
             bot.send_message(user_id, "❌ Нет товаров для экспорта")
             return
         
-        df_data = []
-        for product in products_data:
-            df_data.append({
-                'Модель': product['name'],
-                'ID Модели': product['model_id'],
-                'Размер': product['size'],
-                'Цена Y': product['price_yuan'],
-                'Количество': product['quantity'],
-                'Цена': product['price'],
-                'Ссылка': product['link']
-            })
-        
-        df = pd.DataFrame(df_data)
-        filename = f"products_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        df.to_excel(filename, index=False)
-        
         with open(filename, 'rb') as f:
             bot.send_document(user_id, f, caption="📊 Экспорт товаров")
         
@@ -1827,8 +2169,23 @@ def upload_products(message):
         bot.send_message(user_id, "⛔️ Недостаточно прав")
         return
         
-    bot.send_message(user_id, "📤 Отправьте Excel файл с товарами")
-    bot.register_next_step_handler(message, process_products_file)
+    # /upload_products full — удалить каталог и загрузить заново; check — только проверить файл;
+    # по умолчанию — синхронизация
+    command_parts = message.text.split()
+    mode = command_parts[1].lower() if len(command_parts) > 1 else ''
+    full_reload = mode == 'full'
+    dry_run = mode == 'check'
+    if dry_run:
+        bot.send_message(user_id, "📤 Отправьте Excel файл (.xlsx) с товарами\n🔎 Файл будет только проверен, каталог не изменится")
+    elif full_reload:
+        bot.send_message(user_id, "📤 Отправьте Excel файл (.xlsx) с товарами\n⚠️ Каталог будет полностью заменён, заказы по старым товарам удалятся")
+    else:
+        bot.send_message(
+            user_id,
+            "📤 Отправьте Excel файл (.xlsx) с товарами\n🔄 Изменятся только отличающиеся позиции "
+            "(полная замена: /upload_products full, проверка без записи: /upload_products check)"
+        )
+    bot.register_next_step_handler(message, process_products_file, full_reload, dry_run)
 
 @bot.message_handler(commands=['yadisk_auth'])
 def yadisk_auth(message):
@@ -2687,15 +3044,13 @@ def export_users(message):
         bot.send_message(user_id, "⛔️ Недостаточно прав")
         return
         
-    users = db_actions.get_all_users()
-    if not users:
+    columns = ['user_id', 'first_name', 'last_name', 'username']
+    filename = f"users_export_{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
+    rows = ([user[column] for column in columns] for user in db_actions.get_all_users())
+    if not write_xlsx_stream(filename, columns, rows):
+        os.remove(filename)
         bot.send_message(user_id, "Нет пользователей для экспорта")
         return
-        
-    df = pd.DataFrame(users, columns=['user_id', 'first_name', 'last_name', 'username'])
-    
-    filename = f"users_export_{datetime.now().strftime('%Y%m%d%H%M%S')}.xlsx"
-    df.to_excel(filename, index=False)
     
     with open(filename, 'rb') as f:
         bot.send_document(user_id, f, caption="📊 Экспорт пользователей")
@@ -2856,31 +3211,64 @@ def list_orders(message):
     if len(args) > 1:
         status_filter = args[1].lower()
     
-    orders = db_actions.get_all_orders(status_filter)
+    orders_text, markup = render_orders_page(status_filter)
     
-    if not orders:
+    if not orders_text:
         bot.send_message(user_id, "Заказы не найдены")
         return
     
+    bot.send_message(user_id, orders_text, reply_markup=markup)
+
+def render_orders_page(status_filter=None, before_id=None):
+    """Текст и кнопка «дальше» для страницы списка заказов (админ)"""
+    orders, next_before_id = db_actions.get_orders_page(status=status_filter, before_id=before_id, limit=ORDERS_PAGE_SIZE)
+    if not orders:
+        return None, None
+    
     orders_text = "📦 СПИСОК ЗАКАЗОВ"
     if status_filter:
         orders_text += f" (фильтр: {status_filter})"
     orders_text += "\n\n"
     
     for order in orders:
-        product = db_actions.get_product(order['product_id'])
-        user_data = db_actions.get_user_data(order['user_id'])
-        
+        customer = ' '.join(part for part in (order['first_name'], order['last_name']) if part) or 'Неизвестно'
         orders_text += (
             f"🛒 Заказ #{order['order_id']}\n"
-            f"👤 {user_data['first_name']} {user_data['last_name']}\n"
-            f"🛍️ {get_product_name(product) if product else 'Неизвестно'}\n"
+            f"👤 {customer}\n"
+            f"🛍️ {order['product_name'] or 'Неизвестно'}\n"
             f"📊 Статус: {order['status']}\n"
             f"🕒 {order['created_at']}\n"
             f"🔗 /order_info_{order['order_id']}\n\n"
         )
     
-    bot.send_message(user_id, orders_text)
+    markup = None
+    if next_before_id:
+        filter_code = order_status_filter_code(status_filter) if status_filter else ''
+        markup = Bot_inline_btns().next_page_button(f"orders_page_{next_before_id}_{filter_code}")
+    return orders_text, markup
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('orders_page_'))
+def list_orders_next_page(call):
+    user_id = call.from_user.id
+    if not db_actions.user_is_admin(user_id):
+        bot.answer_callback_query(call.id, "⛔ Только для администраторов")
+        return
+    try:
+        before_id, _, filter_code = call.data[len('orders_page_'):].partition('_')
+        status_filter = None
+        if filter_code:
+            status_filter = order_status_filters.get(int(filter_code))
+            if status_filter is None:
+                bot.answer_callback_query(call.id, "Список устарел, вызовите /orders заново")
+                return
+        orders_text, markup = render_orders_page(status_filter, int(before_id))
+        bot.answer_callback_query(call.id)
+        if not orders_text:
+            bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=None)
+            return
+        bot.edit_message_text(orders_text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
+    except Exception as e:
+        log_error(logger, e, "Ошибка перелистывания списка заказов")
 
 @bot.message_handler(func=lambda message: message.text.startswith('/order_info_'))
 def order_info(message):
@@ -5195,17 +5583,14 @@ def handle_channel_post(message):
     if message.reply_to_message:
         user_id = message.from_user.id
         
-        db_actions.update_user_stats(user_id, 'comments', 1)
-        
-        check_comment_achievement(user_id)
+        # Счётчик копится в буфере; ачивку проверяет check_comment_achievement после записи
+        db_actions.queue_user_stats(user_id, 'comments', 1)
 
 @bot.message_handler(content_types=['text'], func=lambda message: message.is_topic_message)
 def handle_topic_messages(message):
     user_id = message.from_user.id
     
-    db_actions.update_user_stats(user_id, 'comments', 1)
-    
-    check_comment_achievement(user_id)
+    db_actions.queue_user_stats(user_id, 'comments', 1)
 
 # ============ ЗАПУСК БОТА ============
 
@@ -5215,4 +5600,10 @@ if __name__ == '__main__':
         bot.polling(none_stop=True)
     except Exception as e:
         log_error(logger, e, "Ошибка при запуске бота")
-        traceback.print_exc()
\ No newline at end of file
+        traceback.print_exc()
+    finally:
+        # Незавершённый импорт отменяется: его транзакция откатывается
+        import_jobs.close()
+        # Дописываем в БД счётчики, накопленные в буфере
+        flushed = db_actions.close_stats_buffer()
+        log_info(logger, f"Буфер счётчиков сброшен при остановке, записей: {flushed}")
\ No newline at end of file
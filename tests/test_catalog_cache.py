@@ -0,0 +1,81 @@
+import unittest
+from contextlib import contextmanager
+
+from backend import CatalogCache
+
+
+def product(product_id, table_id, is_available=True):
+    return {'product_id': product_id, 'name': f'Модель {product_id}', 'table_id': table_id,
+            'category': 'general', 'is_available': is_available}
+
+
+def variation(variation_id, product_id, quantity):
+    return {'variation_id': variation_id, 'product_id': product_id, 'model_id': f'm{product_id}',
+            'size': 'M', 'quantity': quantity, 'price': 100, 'price_yuan': 10, 'link': None}
+
+
+class FakeCatalogDB:
+    """Таблицы products и product_variations в памяти: только запросы CatalogCache."""
+
+    def __init__(self, products, variations):
+        self.products = {row['product_id']: row for row in products}
+        self.variations = {row['variation_id']: row for row in variations}
+
+    def read(self, query, params=()):
+        if 'FROM products' in query:
+            rows = sorted(self.products.values(), key=lambda row: row['product_id'])
+            return [row for row in rows if not params or row['product_id'] == params[0]]
+        rows = sorted(self.variations.values(), key=lambda row: row['variation_id'])
+        return [row for row in rows if not params or row['product_id'] == params[0]]
+
+    def run_transaction(self, func):
+        return func(self)
+
+    @contextmanager
+    def transaction(self):
+        yield self
+
+
+class CatalogCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeCatalogDB(
+            [product(1, 'a1'), product(2, 'b1')],
+            [variation(1, 1, 3), variation(2, 2, 0)]
+        )
+        self.cache = CatalogCache(self.db)
+
+    def test_refresh_does_not_change_published_snapshot(self):
+        snapshot = self.cache.get()
+        products = iter(snapshot.products.values())
+        next(products)
+        # Новый товар и снятие старого во время обхода каталога покупателем
+        self.db.products[3] = product(3, 'c1')
+        self.cache.refresh_product(3)
+        del self.db.products[2]
+        self.cache.refresh_product(2)
+        self.assertEqual([row['product_id'] for row in products], [2])
+        self.assertEqual(sorted(snapshot.products), [1, 2])
+
+        current = self.cache.get()
+        self.assertIsNot(current, snapshot)
+        self.assertEqual(sorted(current.products), [1, 3])
+        self.assertEqual(current.by_table_id, {'a1': 1, 'c1': 3})
+
+    def test_refresh_variations(self):
+        snapshot = self.cache.get()
+        self.db.variations[1] = variation(1, 1, 0)
+        self.cache.refresh_variations(1)
+        self.assertEqual(snapshot.variations[1][0]['quantity'], 3)
+        self.assertEqual(self.cache.get().variations[1][0]['quantity'], 0)
+        self.assertEqual(self.cache.get().variations[2], snapshot.variations[2])
+
+    def test_unavailable_product_leaves_table_id_index(self):
+        self.cache.get()
+        self.db.products[1] = product(1, 'a1', is_available=False)
+        self.cache.refresh_product(1)
+        self.assertNotIn('a1', self.cache.get().by_table_id)
+        self.assertFalse(self.cache.get().products[1]['is_available'])
+
+
+if __name__ == '__main__':
+    unittest.main()
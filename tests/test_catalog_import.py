@@ -0,0 +1,180 @@
+import io
+import unittest
+
+import openpyxl
+import pandas as pd
+
+from catalog_import import (
+    PRODUCT_COLUMNS, VARIATION_COLUMNS, error_workbook, normalize_legacy_format, normalize_new_format,
+    report_counts, validate_legacy_format, validate_new_format
+)
+
+
+def economics_sheet(rows):
+    columns = ['Модель', 'ID модели', 'Размер', 'Цена Y', 'Кол.', 'Цена продажи', 'Цвет', 'Ссылки']
+    return pd.DataFrame(rows, columns=columns)
+
+
+def keys_sheet(rows):
+    columns = ['ID', 'Краткое описание товара Telegram', '#Хештеги', 'Топ - 10 ключевый запросов Yandex WordStat']
+    return pd.DataFrame(rows, columns=columns)
+
+
+class NormalizeNewFormatTest(unittest.TestCase):
+    def setUp(self):
+        economics = economics_sheet([
+            ['B', 'b1', 'M', 10, 1, 100, None, 'http://x'],
+            ['A', 'a1', 'S', 20, 2, 200, 'red', None],
+            ['A', 'a1', 'L', None, None, 250, None, ''],
+            [None, None, None, None, None, None, None, None],
+            ['B', 'b1', '', 10, 5, 100, None, None],
+        ])
+        keys = keys_sheet([
+            ['a1', 'старое', '#old', 'old'],
+            ['a1', 'Кроссовки', '#shoes', 'кроссовки'],
+        ])
+        self.products, self.variations = normalize_new_format(economics, keys)
+
+    def test_products(self):
+        self.assertEqual(list(self.products.columns), PRODUCT_COLUMNS)
+        products = self.products.set_index('name')
+        self.assertEqual(list(products.index), ['A', 'B'])
+        # Цены товара — из первой строки модели; описание — из последней строки КЛЮЧИ с этим ID
+        self.assertEqual(products.loc['A', 'price'], 200)
+        self.assertEqual(products.loc['A', 'price_yuan'], 20)
+        self.assertEqual(products.loc['A', 'table_id'], 'a1')
+        self.assertEqual(products.loc['A', 'description'], 'Модель: A')
+        self.assertEqual(products.loc['A', 'description_full'], 'Кроссовки\n\n#shoes')
+        self.assertEqual(products.loc['A', 'keywords'], 'кроссовки')
+        # Модели без строки в КЛЮЧИ — описание по умолчанию
+        self.assertEqual(products.loc['B', 'description_full'], 'Модель: B')
+        self.assertEqual(products.loc['B', 'keywords'], '')
+
+    def test_variations(self):
+        self.assertEqual(list(self.variations.columns), VARIATION_COLUMNS)
+        rows = self.variations[['name', 'model_id', 'size', 'quantity', 'price', 'price_yuan']]
+        self.assertEqual(rows.values.tolist(), [
+            # Цвет дописывается к размеру, пустые цены и количество берутся от товара и нуля
+            ['A', 'a1', 'S (red)', 2, 200, 20],
+            ['A', 'a1', 'L', 0, 250, 20],
+            # Строка без размера пропускается
+            ['B', 'b1', 'M', 1, 100, 10],
+        ])
+        self.assertEqual(self.variations['link'].tolist()[1:], [None, 'http://x'])
+
+
+class NormalizeLegacyFormatTest(unittest.TestCase):
+    def test_products_and_variations(self):
+        df = pd.DataFrame({
+            'Модель': ['Z', 'Z', 'Y', ''],
+            'ID Модели': ['z1', 'z2', 'y1', 'x1'],
+            'Размер': ['42', '43', 'M', 'S'],
+            'Цена': [1000, 'abc', 500, 1],
+            'Цена Y': [70, 75, None, 1],
+            'Количество': [3, None, 1, 1],
+            'Ссылка': ['', 'http://z', '', ''],
+        })
+        products, variations = normalize_legacy_format(df)
+        self.assertEqual(products[['name', 'price', 'price_yuan']].values.tolist(), [
+            ['Y', 500, 0],
+            ['Z', 1000, 70],
+        ])
+        self.assertTrue(products['table_id'].isna().all())
+        self.assertEqual(variations[['name', 'model_id', 'size', 'quantity', 'price', 'price_yuan']].values.tolist(), [
+            ['Y', 'y1', 'M', 1, 500, 0],
+            ['Z', 'z1', '42', 3, 1000, 70],
+            # Нечисловая цена заменяется ценой товара
+            ['Z', 'z2', '43', 0, 1000, 75],
+        ])
+
+
+def errors(rows):
+    return rows[['Строка', 'Ошибки', 'Предупреждения']].values.tolist()
+
+
+class ValidateNewFormatTest(unittest.TestCase):
+    def test_valid_sheets(self):
+        economics = economics_sheet([['A', 'a1', 'S', 20, 2, 200, None, None]])
+        keys = keys_sheet([['a1', 'Кроссовки', '#shoes', '']])
+        self.assertEqual(validate_new_format(economics, keys), {})
+
+    def test_errors_by_row(self):
+        economics = economics_sheet([
+            ['A', 'a1', 'S', 20, 2, 200, None, None],
+            ['A', 'a1', 'S', 20, -1, 'дорого', None, None],
+            [None, 'x', 'M', 1, 1, 1, None, None],
+            ['B', '', 'M', '?', 1, 1, None, None],
+            # Тот же размер другого цвета — не повтор
+            ['A', 'a1', 'S', 20, 1, 200, 'red', None],
+        ])
+        keys = keys_sheet([
+            ['a1', 'описание', '#a', ''],
+            ['zz', 'описание', '#z', ''],
+            [None, 'только описание', None, None],
+        ])
+        report = validate_new_format(economics, keys)
+        # Номера строк — как в Excel: заголовок в первой строке
+        self.assertEqual(errors(report['ЭКОНОМИКА']), [
+            [3, 'Цена продажи: не число «дорого»; Кол.: отрицательное количество; '
+                'повтор модели и размера из строки 2', ''],
+            # Строку без модели импорт пропускает — это предупреждение
+            [4, '', 'не указана модель, строка пропущена'],
+            [5, 'не указан ID модели; Цена Y: не число «?»', ''],
+        ])
+        self.assertEqual(errors(report['КЛЮЧИ']), [
+            [3, '', 'ID нет в листе ЭКОНОМИКА, строка пропущена'],
+            [4, '', 'не указан ID, строка пропущена'],
+        ])
+        self.assertEqual(report_counts(report), (2, 3))
+
+    def test_stale_key_rows_do_not_block_import(self):
+        economics = economics_sheet([['A', 'a1', 'S', 20, 2, 200, None, None]])
+        keys = keys_sheet([['a1', 'описание', '', ''], ['old', 'снятая модель', '', '']])
+        report = validate_new_format(economics, keys)
+        self.assertEqual(errors(report['КЛЮЧИ']), [[3, '', 'ID нет в листе ЭКОНОМИКА, строка пропущена']])
+        self.assertEqual(report_counts(report), (0, 1))
+
+    def test_duplicate_key_ids(self):
+        economics = economics_sheet([['A', 'a1', 'S', 20, 2, 200, None, None]])
+        keys = keys_sheet([['a1', 'первое', '', ''], ['a1', 'второе', '', '']])
+        report = validate_new_format(economics, keys)
+        self.assertEqual(list(report), ['КЛЮЧИ'])
+        # Импорт берёт последнюю строку с этим ID
+        self.assertEqual(errors(report['КЛЮЧИ']), [[3, '', 'повтор ID из строки 2']])
+        self.assertEqual(report_counts(report), (0, 1))
+
+
+class ValidateLegacyFormatTest(unittest.TestCase):
+    def test_errors_by_row(self):
+        df = pd.DataFrame({
+            'Модель': ['Z', 'Z', 'Y'],
+            'ID Модели': ['z1', 'z2', 'y1'],
+            'Размер': ['42', '42', 'M'],
+            # Формула в «Цена» и десятичная запятая в «Цена Y»/«Количество» — не ошибки
+            'Цена': ['=B2*2', 'x', 5],
+            'Цена Y': ['7,5', 'a', 1],
+            'Количество': ['1,0', '-2', 1],
+        })
+        report = validate_legacy_format(df)
+        self.assertEqual(errors(report['Товары']), [
+            [3, 'Цена: не число «x»; Цена Y: не число «a»; Количество: отрицательное количество; '
+                'повтор модели и размера из строки 2', ''],
+        ])
+
+
+class ErrorWorkbookTest(unittest.TestCase):
+    def test_sheets_and_columns(self):
+        economics = economics_sheet([['A', '', 'S', 20, 2, 200, None, None]])
+        keys = keys_sheet([['zz', 'описание', '', '']])
+        data = error_workbook(validate_new_format(economics, keys))
+        workbook = openpyxl.load_workbook(io.BytesIO(data))
+        self.assertEqual(workbook.sheetnames, ['ЭКОНОМИКА', 'КЛЮЧИ'])
+        header, row = workbook['ЭКОНОМИКА'].iter_rows(values_only=True)
+        self.assertEqual((header[0], header[-2], header[-1]), ('Строка', 'Ошибки', 'Предупреждения'))
+        self.assertEqual((row[0], row[1], row[-2]), (2, 'A', 'не указан ID модели'))
+        (_, keys_row) = workbook['КЛЮЧИ'].iter_rows(values_only=True)
+        self.assertEqual(keys_row[-1], 'ID нет в листе ЭКОНОМИКА, строка пропущена')
+
+
+if __name__ == '__main__':
+    unittest.main()
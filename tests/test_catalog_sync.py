@@ -0,0 +1,256 @@
+import unittest
+from contextlib import contextmanager
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pandas as pd
+
+from backend import DbAct, sync_same, sync_table_key
+from catalog_import import normalize_new_format
+
+
+def money(value):
+    # DECIMAL(10, 2), как в таблицах products и product_variations
+    return Decimal(str(round(float(value), 2)))
+
+
+class FakeCatalogTx:
+    """products и product_variations в памяти: запросы синхронизации и кэша каталога.
+
+    Считает строки, которые реально изменили UPDATE и INSERT.
+    """
+
+    def __init__(self):
+        self.products = {}
+        self.variations = {}
+        self.next_product_id = 1
+        self.next_variation_id = 1
+        self.changed = 0
+
+    # --- интерфейс DB ---
+    def run_transaction(self, func):
+        return func(self)
+
+    @contextmanager
+    def transaction(self):
+        yield self
+
+    # --- интерфейс Transaction ---
+    def read(self, query, params=()):
+        if 'FROM products' in query:
+            rows = [dict(row) for _, row in sorted(self.products.items())]
+            if 'product_id >=' in query:
+                first_id, names = params[0], set(params[1:])
+                return [row for row in rows if row['product_id'] >= first_id and row['name'] in names]
+            if 'WHERE product_id = %s' in query:
+                return [row for row in rows if row['product_id'] == params[0]]
+            return rows
+        rows = [dict(row) for _, row in sorted(self.variations.items())]
+        if 'WHERE product_id = %s' in query:
+            return [row for row in rows if row['product_id'] == params[0]]
+        return rows
+
+    def insert(self, query, params):
+        # Многострочный INSERT товаров: по 7 значений на строку
+        first_id = self.next_product_id
+        for start in range(0, len(params), 7):
+            name, description, description_full, table_id, keywords, price, price_yuan = params[start:start + 7]
+            self.products[self.next_product_id] = {
+                'product_id': self.next_product_id, 'name': name, 'description': description,
+                'description_full': description_full, 'table_id': table_id, 'keywords': keywords,
+                'price': money(price), 'price_yuan': money(price_yuan), 'is_available': 1,
+                'category': 'general',
+            }
+            self.next_product_id += 1
+            self.changed += 1
+        return first_id
+
+    def write_many(self, query, rows):
+        rows = list(rows)
+        if query.lstrip().startswith('INSERT INTO product_variations'):
+            for product_id, model_id, size, quantity, price, price_yuan, link in rows:
+                self.variations[self.next_variation_id] = {
+                    'variation_id': self.next_variation_id, 'product_id': product_id, 'model_id': model_id,
+                    'size': size, 'quantity': int(quantity), 'price': money(price),
+                    'price_yuan': money(price_yuan), 'link': link,
+                }
+                self.next_variation_id += 1
+        elif 'UPDATE products' in query:
+            for name, description, description_full, table_id, keywords, price, price_yuan, product_id in rows:
+                self.products[product_id].update(
+                    name=name, description=description, description_full=description_full, table_id=table_id,
+                    keywords=keywords, price=money(price), price_yuan=money(price_yuan), is_available=1
+                )
+        else:
+            for model_id, size, quantity, price, price_yuan, link, variation_id in rows:
+                self.variations[variation_id].update(
+                    model_id=model_id, size=size, quantity=int(quantity), price=money(price),
+                    price_yuan=money(price_yuan), link=link
+                )
+        self.changed += len(rows)
+        return len(rows)
+
+    def write(self, query, params=()):
+        if 'is_available = FALSE' in query:
+            for product_id in params:
+                self.products[product_id]['is_available'] = 0
+        elif 'SET quantity = 0' in query:
+            for variation_id in params:
+                self.variations[variation_id]['quantity'] = 0
+        else:
+            raise AssertionError(f"Неожиданный запрос: {query}")
+        self.changed += len(params)
+        return len(params)
+
+
+def sheets(models, keys=None):
+    """models: {модель: (ID модели, [(размер, количество, цена), ...])} -> листы ЭКОНОМИКА и КЛЮЧИ."""
+    economics = pd.DataFrame([
+        {'Модель': model, 'ID модели': model_id, 'Размер': size, 'Цена Y': 100, 'Кол.': quantity,
+         'Цена продажи': price, 'Цвет': '', 'Ссылки': ''}
+        for model, (model_id, sizes) in models.items()
+        for size, quantity, price in sizes
+    ])
+    if keys is None:
+        keys = [model_id for model_id, _ in models.values()]
+    keys_df = pd.DataFrame([
+        {'ID': model_id, 'Краткое описание товара Telegram': f'Описание {model_id}', '#Хештеги': '#shop',
+         'Топ - 10 ключевый запросов Yandex WordStat': ''}
+        for model_id in keys
+    ])
+    return economics, keys_df
+
+
+def catalog(count=20):
+    return {
+        f'Модель {n:02d}': (f'M{n:02d}', [('S', 1, 1999.9), ('M', 2, 1999.9), ('L', 0, 1999.9)])
+        for n in range(count)
+    }
+
+
+class SyncCatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeCatalogTx()
+        config = SimpleNamespace(get_config=lambda: {}, version=1)
+        self.db_actions = DbAct(self.db, config, 'report.xlsx')
+        self.addCleanup(self.db_actions.close_stats_buffer)
+
+    def sync(self, models, keys=None):
+        self.db.changed = 0
+        return self.db_actions.sync_catalog(*normalize_new_format(*sheets(models, keys)))
+
+    def product(self, name):
+        return next(row for row in self.db.products.values() if row['name'] == name)
+
+    def variations(self, name):
+        product_id = self.product(name)['product_id']
+        return sorted(
+            (row['size'], row['quantity'], row['price'])
+            for row in self.db.variations.values() if row['product_id'] == product_id
+        )
+
+    def test_first_sync_adds_everything(self):
+        stats = self.sync(catalog())
+        self.assertEqual(stats['products_added'], 20)
+        self.assertEqual(stats['variations_added'], 60)
+        self.assertEqual(self.product('Модель 03')['table_id'], 'M03')
+        self.assertEqual(self.db_actions.get_product_by_table_id('M03')['name'], 'Модель 03')
+
+    def test_unchanged_sheet_touches_nothing(self):
+        self.sync(catalog())
+        stats = self.sync(catalog())
+        self.assertEqual(set(stats.values()), {0})
+        # Цены в БД — Decimal, в листе — float: 1999.9 не считается изменением
+        self.assertEqual(self.db.changed, 0)
+
+    def test_price_changes_update_only_changed_rows(self):
+        self.sync(catalog())
+        models = catalog()
+        for n in range(10):
+            model_id, sizes = models[f'Модель {n:02d}']
+            # Меняется цена второй строки модели: цена товара берётся из первой и не меняется
+            sizes[1] = ('M', 2, 2099.9)
+        stats = self.sync(models)
+        self.assertEqual(stats['variations_updated'], 10)
+        self.assertEqual(stats['products_updated'], 0)
+        self.assertEqual(self.db.changed, 10)
+        self.assertIn(('M', 2, Decimal('2099.90')), self.variations('Модель 00'))
+
+    def test_missing_items_are_disabled_not_deleted(self):
+        self.sync(catalog())
+        products_before = len(self.db.products)
+        variations_before = len(self.db.variations)
+        models = catalog()
+        del models['Модель 05']
+        # У оставшейся модели из листа пропал размер S
+        models['Модель 06'][1].pop(0)
+        stats = self.sync(models)
+        self.assertEqual(stats['products_disabled'], 1)
+        self.assertEqual(len(self.db.products), products_before)
+        self.assertEqual(len(self.db.variations), variations_before)
+        self.assertFalse(self.product('Модель 05')['is_available'])
+        self.assertEqual([quantity for _, quantity, _ in self.variations('Модель 05')], [0, 0, 0])
+        self.assertEqual(self.variations('Модель 06')[2], ('S', 0, Decimal('1999.90')))
+        self.assertIsNone(self.db_actions.get_product_by_table_id('M05'))
+        self.assertNotIn('Модель 05', [row['name'] for row in self.db_actions.get_products(limit=100)])
+
+        # Модель вернулась в лист — товар снова в продаже, без дубля
+        stats = self.sync(catalog())
+        self.assertEqual(stats['products_added'], 0)
+        self.assertEqual(stats['products_updated'], 1)
+        self.assertTrue(self.product('Модель 05')['is_available'])
+        self.assertEqual(self.db_actions.get_product_by_table_id('M05')['name'], 'Модель 05')
+
+    def test_renamed_model_is_matched_by_table_id(self):
+        self.sync(catalog(3))
+        product_id = self.product('Модель 01')['product_id']
+        models = catalog(3)
+        models['Модель 01 (новая)'] = models.pop('Модель 01')
+        stats = self.sync(models)
+        self.assertEqual((stats['products_added'], stats['products_updated']), (0, 1))
+        self.assertEqual(self.db.products[product_id]['name'], 'Модель 01 (новая)')
+
+    def test_duplicate_table_id_in_sheet_falls_back_to_name(self):
+        self.sync(catalog(3))
+        models = catalog(3)
+        # Две модели листа с одним ID: по table_id их не различить, сопоставляются по названию
+        models['Модель 02'] = ('M01', models['Модель 02'][1])
+        stats = self.sync(models, keys=['M00', 'M01'])
+        self.assertEqual(stats['products_added'], 0)
+        self.assertEqual(len(self.db.products), 3)
+        self.assertEqual(self.product('Модель 02')['table_id'], 'M01')
+        self.assertEqual(self.product('Модель 01')['table_id'], 'M01')
+
+    def test_duplicate_table_id_in_db_keeps_first_product(self):
+        self.sync(catalog(3))
+        # В БД два товара с одним table_id (например, после ручной правки)
+        self.product('Модель 02')['table_id'] = 'M01'
+        models = {'Модель 01': catalog(3)['Модель 01'], 'Модель 00': catalog(3)['Модель 00']}
+        stats = self.sync(models)
+        # Строка листа с M01 достаётся товару с меньшим product_id, второй снимается с продажи
+        self.assertEqual(stats['products_disabled'], 1)
+        self.assertTrue(self.product('Модель 01')['is_available'])
+        self.assertFalse(self.product('Модель 02')['is_available'])
+
+
+class SyncHelpersTest(unittest.TestCase):
+    def test_sync_same(self):
+        self.assertTrue(sync_same(Decimal('1999.90'), 1999.9))
+        self.assertTrue(sync_same(Decimal('0.30'), 0.1 + 0.2))
+        self.assertFalse(sync_same(Decimal('1999.90'), 1999.91))
+        self.assertFalse(sync_same(None, 0))
+        self.assertTrue(sync_same(None, ''))
+        self.assertTrue(sync_same('', None))
+        self.assertFalse(sync_same('a', 'b'))
+        self.assertTrue(sync_same(1, True))
+
+    def test_sync_table_key(self):
+        # Как VARCHAR в MySQL: хвостовые пробелы и регистр не различаются
+        self.assertEqual(sync_table_key(' M01 '), ' m01')
+        self.assertIsNone(sync_table_key('nan'))
+        self.assertIsNone(sync_table_key(''))
+        self.assertIsNone(sync_table_key(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import threading
+import unittest
+from types import SimpleNamespace
+
+from backend import CounterBuffer, DbAct
+
+
+class CounterBufferTest(unittest.TestCase):
+    def test_increments_coalesce_by_user_and_field(self):
+        batches = []
+        buffer = CounterBuffer(batches.append, flush_interval=60)
+        buffer.add(1, 'comments', 1)
+        buffer.add(1, 'comments', 2)
+        buffer.add(2, 'comments', 1)
+        buffer.add(1, 'orders', 1)
+        self.assertEqual(buffer.size(), 3)
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(batches, [{(1, 'comments'): 3, (2, 'comments'): 1, (1, 'orders'): 1}])
+        self.assertEqual(buffer.flush(), 0)
+        buffer.close()
+
+    def test_full_buffer_flushes_without_waiting_for_interval(self):
+        flushed = threading.Event()
+        batches = []
+
+        def flush(pending):
+            batches.append(pending)
+            flushed.set()
+
+        buffer = CounterBuffer(flush, flush_interval=60, max_entries=2)
+        buffer.add(1, 'comments', 1)
+        self.assertFalse(flushed.wait(0.2))
+        buffer.add(2, 'comments', 1)
+        self.assertTrue(flushed.wait(5))
+        self.assertEqual(batches, [{(1, 'comments'): 1, (2, 'comments'): 1}])
+        buffer.close()
+
+    def test_failed_flush_keeps_increments(self):
+        calls = []
+
+        def flush(pending):
+            calls.append(dict(pending))
+            if len(calls) == 1:
+                raise RuntimeError('db is down')
+
+        buffer = CounterBuffer(flush, flush_interval=60)
+        buffer.add(1, 'comments', 2)
+        self.assertEqual(buffer.flush(), 0)
+        # Инкременты, пришедшие после неудачной записи, складываются с возвращёнными
+        buffer.add(1, 'comments', 1)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(calls[-1], {(1, 'comments'): 3})
+        buffer.close()
+
+    def test_close_flushes_rest(self):
+        batches = []
+        buffer = CounterBuffer(batches.append, flush_interval=60)
+        buffer.add(1, 'comments', 1)
+        buffer.close()
+        self.assertEqual(batches, [{(1, 'comments'): 1}])
+        self.assertEqual(buffer.size(), 0)
+
+
+class FakeUsersDB:
+    """users.comments в памяти: ровно те запросы, что делает сброс буфера счётчиков."""
+
+    def __init__(self, comments):
+        self.comments = dict(comments)
+
+    def run_transaction(self, func):
+        return func(self)
+
+    def write(self, query, params):
+        # SET comments = comments + CASE user_id WHEN %s THEN %s ... END WHERE user_id IN (%s, ...):
+        # на каждого пользователя пара (user_id, прирост) и user_id в списке IN
+        cases = params[:len(params) // 3 * 2]
+        for user_id, delta in zip(cases[::2], cases[1::2]):
+            self.comments[user_id] += delta
+        return len(cases) // 2
+
+    def read(self, query, params):
+        return [{'user_id': user_id, 'comments': self.comments[user_id]} for user_id in params]
+
+
+class StatThresholdTest(unittest.TestCase):
+    def make_db_actions(self, comments):
+        config = SimpleNamespace(get_config=lambda: {'stats_buffer': {'flush_interval': 60}}, version=1)
+        self.db = FakeUsersDB(comments)
+        db_actions = DbAct(self.db, config, 'report.xlsx')
+        self.addCleanup(db_actions.close_stats_buffer)
+        self.calls = []
+        db_actions.on_stat_threshold('comments', 10, lambda user_id, value: self.calls.append((user_id, value)))
+        return db_actions
+
+    def test_threshold_fires_at_and_above(self):
+        db_actions = self.make_db_actions({1: 8, 2: 9, 3: 25, 4: 0})
+        for user_id in (1, 2, 3, 4):
+            db_actions.queue_user_stats(user_id, 'comments', 1)
+        db_actions.queue_user_stats(1, 'comments', 1)
+        db_actions.flush_user_stats()
+        # 8+2 и 9+1 достигли порога, 25 перешёл его раньше — тоже вызов; у 0+1 вызова нет
+        self.assertEqual(sorted(self.calls), [(1, 10), (2, 10), (3, 26)])
+
+    def test_no_call_without_change(self):
+        db_actions = self.make_db_actions({1: 30})
+        db_actions.flush_user_stats()
+        self.assertEqual(self.calls, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+
+from db import fingerprint
+
+
+class FingerprintTest(unittest.TestCase):
+    def test_parameters_and_numbers(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM users WHERE user_id = %s LIMIT 10'),
+            'SELECT * FROM users WHERE user_id = ? LIMIT ?'
+        )
+
+    def test_string_literals(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM orders WHERE status = 'new' OR note = \"x\""),
+            'SELECT * FROM orders WHERE status = ? OR note = ?'
+        )
+
+    def test_escaped_quotes(self):
+        # Удвоенная кавычка и обратная косая черта не закрывают строку
+        self.assertEqual(fingerprint("SELECT 'it''s', 'a\\'b', \"say \"\"hi\"\"\""), 'SELECT ?, ?, ?')
+        self.assertEqual(fingerprint("WHERE a = '' AND b = ''''"), 'WHERE a = ? AND b = ?')
+
+    def test_same_query_with_different_values(self):
+        self.assertEqual(
+            fingerprint("UPDATE users SET note = 'don''t' WHERE user_id = 1"),
+            fingerprint("UPDATE users SET note = 'ok' WHERE user_id = 42")
+        )
+
+    def test_value_lists_collapse(self):
+        self.assertEqual(
+            fingerprint('SELECT * FROM users WHERE user_id IN (%s, %s, %s)'),
+            'SELECT * FROM users WHERE user_id IN (?+)'
+        )
+        self.assertEqual(
+            fingerprint('INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s),\n (%s, %s)'),
+            'INSERT INTO t (a, b) VALUES (?+)'
+        )
+
+    def test_identifiers_with_digits_are_kept(self):
+        self.assertEqual(fingerprint('SELECT col1 FROM t2'), 'SELECT col1 FROM t2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import threading
+import time
+import unittest
+
+from import_jobs import ImportJob, ImportJobError, ImportJobQueue
+
+
+class ImportJobQueueTest(unittest.TestCase):
+    def make_queue(self, run):
+        self.reports = []
+        queue = ImportJobQueue(run, on_progress=self.on_progress, progress_interval=60)
+        self.addCleanup(queue.close, 5)
+        return queue
+
+    def on_progress(self, job):
+        self.reports.append((job.job_id, job.status, job.stage, job.rows, job.products))
+
+    def wait(self, job):
+        for _ in range(500):
+            if job.finished:
+                return
+            time.sleep(0.01)
+        self.fail(f"Импорт #{job.job_id} не завершился")
+
+    def test_result_and_progress(self):
+        def run(job):
+            job.set_stage('чтение')
+            job.add_rows(10)
+            job.add_rows(5)
+            job.set_stage('запись')
+            job.add_written(3, 7)
+            return ['готово']
+
+        queue = self.make_queue(run)
+        job = queue.submit(1, {'file_id': 'f'})
+        self.wait(job)
+        # Итоговый показ идёт после смены статуса — дожидаемся воркера
+        queue.close(5)
+        self.assertEqual(job.status, ImportJob.DONE)
+        self.assertEqual(job.result, ['готово'])
+        self.assertEqual((job.rows, job.products, job.variations), (15, 3, 7))
+        # Между этапами показы реже progress_interval, этап и статус показываются всегда
+        self.assertEqual(self.reports, [
+            (1, ImportJob.QUEUED, '', 0, 0),
+            (1, ImportJob.RUNNING, '', 0, 0),
+            (1, ImportJob.RUNNING, 'чтение', 0, 0),
+            (1, ImportJob.RUNNING, 'запись', 15, 0),
+            (1, ImportJob.DONE, 'запись', 15, 3),
+        ])
+
+    def test_errors(self):
+        def run(job):
+            if job.payload == 'understood':
+                raise ImportJobError('нет колонок')
+            raise ValueError('сбой')
+
+        queue = self.make_queue(run)
+        understood = queue.submit(1, 'understood')
+        unexpected = queue.submit(1, 'unexpected')
+        self.wait(unexpected)
+        self.assertEqual((understood.status, understood.errors), (ImportJob.FAILED, ['нет колонок']))
+        self.assertEqual((unexpected.status, unexpected.errors), (ImportJob.FAILED, ['сбой']))
+
+    def test_cancel_running_and_queued(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def run(job):
+            started.set()
+            release.wait(5)
+            job.add_rows(1)
+            return ['не должно дойти']
+
+        queue = self.make_queue(run)
+        running = queue.submit(1, 'a')
+        queued = queue.submit(1, 'b')
+        self.assertTrue(started.wait(5))
+        self.assertIs(queue.current(), running)
+        self.assertEqual(queue.position(queued), 1)
+
+        # Ждущая задача снимается сразу, выполняемая — на ближайшей проверке
+        self.assertIs(queue.cancel(queued.job_id), queued)
+        self.assertEqual(queued.status, ImportJob.CANCELLED)
+        self.assertEqual(queue.position(queued), 0)
+        self.assertIs(queue.cancel(running.job_id), running)
+        self.assertEqual(running.status, ImportJob.RUNNING)
+        release.set()
+        self.wait(running)
+        self.assertEqual(running.status, ImportJob.CANCELLED)
+        self.assertIsNone(running.result)
+        self.assertIsNone(queue.cancel(running.job_id))
+        self.assertIsNone(queue.cancel(999))
+
+    def test_progress_errors_do_not_stop_job(self):
+        def on_progress(job):
+            raise RuntimeError('Telegram недоступен')
+
+        queue = ImportJobQueue(lambda job: 'ok', on_progress=on_progress)
+        self.addCleanup(queue.close, 5)
+        job = queue.submit(1, None)
+        self.wait(job)
+        self.assertEqual((job.status, job.result), (ImportJob.DONE, 'ok'))
+
+    def test_finished_jobs_are_pruned(self):
+        queue = self.make_queue(lambda job: None)
+        jobs = [queue.submit(1, n) for n in range(ImportJobQueue.MAX_FINISHED + 2)]
+        self.wait(jobs[-1])
+        queue.close(5)
+        self.assertIsNone(queue.get(jobs[0].job_id))
+        self.assertIsNone(queue.get(jobs[1].job_id))
+        self.assertIs(queue.get(jobs[-1].job_id), jobs[-1])
+
+    def test_close_rejects_new_jobs(self):
+        queue = self.make_queue(lambda job: None)
+        queue.close(5)
+        with self.assertRaises(RuntimeError):
+            queue.submit(1, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+from backend import ReferralLeaderboard
+
+
+def entry(user_id, referral_count):
+    return {'user_id': user_id, 'referral_count': referral_count}
+
+
+def ranking(board):
+    return [(row['user_id'], row['referral_count']) for row in board.top()]
+
+
+class ReferralLeaderboardTest(unittest.TestCase):
+    def test_load_sorts_and_trims(self):
+        board = ReferralLeaderboard(size=3)
+        board.load([entry(1, 5), entry(2, 7), entry(3, None), entry(4, 5), entry(5, 1)])
+        # Как ORDER BY referral_count DESC, user_id DESC
+        self.assertEqual(ranking(board), [(2, 7), (4, 5), (1, 5)])
+        self.assertEqual([row['user_id'] for row in board.top(limit=2)], [2, 4])
+
+    def test_bump_before_load_is_ignored(self):
+        board = ReferralLeaderboard(size=3)
+        board.bump(entry(1, 10))
+        self.assertEqual(board.top(), [])
+        self.assertFalse(board.is_fresh())
+
+    def test_bump_moves_existing_entry(self):
+        board = ReferralLeaderboard(size=3)
+        board.load([entry(1, 5), entry(2, 4), entry(3, 3)])
+        board.bump(entry(3, 6))
+        self.assertEqual(ranking(board), [(3, 6), (1, 5), (2, 4)])
+
+    def test_bump_new_entry_displaces_last(self):
+        board = ReferralLeaderboard(size=3)
+        board.load([entry(1, 5), entry(2, 4), entry(3, 3)])
+        board.bump(entry(9, 4))
+        self.assertEqual(ranking(board), [(1, 5), (9, 4), (2, 4)])
+        # Не лучше последнего в полном топе — не попадает
+        board.bump(entry(8, 1))
+        self.assertEqual(ranking(board), [(1, 5), (9, 4), (2, 4)])
+
+    def test_top_returns_copies(self):
+        board = ReferralLeaderboard(size=3)
+        board.load([entry(1, 5)])
+        board.top()[0]['referral_count'] = 100
+        self.assertEqual(ranking(board), [(1, 5)])
+
+    def test_freshness(self):
+        now = [1000.0]
+        with mock.patch('backend.time.monotonic', lambda: now[0]):
+            board = ReferralLeaderboard(size=3, ttl=600)
+            board.load([])
+            self.assertTrue(board.is_fresh())
+            now[0] += 600
+            self.assertFalse(board.is_fresh())
+
+
+if __name__ == '__main__':
+    unittest.main()
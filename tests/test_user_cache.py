@@ -0,0 +1,86 @@
+import unittest
+from unittest import mock
+
+from backend import UserCache
+
+
+class UserCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('backend.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_returns_copy(self):
+        cache = UserCache(max_size=10, ttl=60)
+        cache.put(1, {'user_id': 1, 'achievements': ['a']})
+        profile = cache.get(1)
+        profile['achievements'].append('b')
+        profile['bs_coin'] = 5
+        self.assertEqual(cache.get(1), {'user_id': 1, 'achievements': ['a']})
+
+    def test_ttl(self):
+        cache = UserCache(max_size=10, ttl=60)
+        cache.put(1, {'user_id': 1})
+        self.now += 59
+        self.assertTrue(cache.contains(1))
+        self.now += 1
+        self.assertFalse(cache.contains(1))
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_lru_eviction(self):
+        cache = UserCache(max_size=2, ttl=60)
+        cache.put(1, {'user_id': 1})
+        cache.put(2, {'user_id': 2})
+        # Чтение поднимает 1 в конец очереди, вытесняется 2
+        cache.get(1)
+        cache.put(3, {'user_id': 3})
+        self.assertIsNotNone(cache.get(1))
+        self.assertIsNone(cache.get(2))
+        self.assertIsNotNone(cache.get(3))
+
+    def test_hits_and_misses(self):
+        cache = UserCache(max_size=10, ttl=60)
+        cache.get(1)
+        cache.put(1, {'user_id': 1})
+        cache.get(1)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_update_applies_changes_and_deltas(self):
+        cache = UserCache(max_size=10, ttl=60)
+        cache.put(1, {'user_id': 1, 'bs_coin': 10, 'discount': None})
+        cache.update(1, changes={'username': '@u'}, deltas={'bs_coin': 5, 'discount': 1})
+        self.assertEqual(cache.get(1), {'user_id': 1, 'bs_coin': 15, 'discount': 1, 'username': '@u'})
+        # Профиля нет в кэше — обновлять нечего
+        cache.update(2, changes={'bs_coin': 1})
+        self.assertIsNone(cache.get(2))
+
+    def test_update_with_incompatible_types_drops_entry(self):
+        cache = UserCache(max_size=10, ttl=60)
+        cache.put(1, {'user_id': 1, 'bs_coin': 'x'})
+        cache.update(1, deltas={'bs_coin': 1})
+        self.assertIsNone(cache.get(1))
+
+    def test_load_is_discarded_after_concurrent_write(self):
+        cache = UserCache(max_size=10, ttl=60)
+        token = cache.begin_load(1)
+        # Пока шло чтение из БД, профиль изменили — прочитанный устарел
+        cache.invalidate(1)
+        cache.finish_load(1, token, {'user_id': 1, 'bs_coin': 0})
+        self.assertIsNone(cache.get(1))
+
+        token = cache.begin_load(1)
+        cache.finish_load(1, token, {'user_id': 1, 'bs_coin': 0})
+        self.assertEqual(cache.get(1), {'user_id': 1, 'bs_coin': 0})
+
+    def test_finish_load_without_profile(self):
+        cache = UserCache(max_size=10, ttl=60)
+        token = cache.begin_load(1)
+        cache.finish_load(1, token, None)
+        self.assertFalse(cache.contains(1))
+
+
+if __name__ == '__main__':
+    unittest.main()